@@ -0,0 +1,139 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Number of rasterized masks kept for reuse across reruns
+MASK_CACHE_SIZE = 32
+
+# Shared by the analysis job threads, so every access holds the lock
+_mask_cache = OrderedDict()
+_mask_cache_lock = threading.Lock()
+
+
+def pixel_centers(bounds, shape):
+    """
+    Longitudes of column centers and latitudes of row centers of a north-up grid.
+
+    Args:
+        bounds: (min_lon, min_lat, max_lon, max_lat) of the grid
+        shape: Tuple (height, width)
+
+    Returns:
+        Tuple of (lons, lats) 1D arrays
+    """
+    min_lon, min_lat, max_lon, max_lat = bounds
+    height, width = shape
+    lons = min_lon + (np.arange(width) + 0.5) * (max_lon - min_lon) / width
+    # Row 0 is the northern edge
+    lats = max_lat - (np.arange(height) + 0.5) * (max_lat - min_lat) / height
+    return lons, lats
+
+
+def rasterize_polygon(rings, bounds, shape):
+    """
+    Rasterize polygon rings with the even-odd rule using scanlines.
+
+    Every edge is intersected with every row-center scanline at once; each
+    crossing toggles the inside state from the first pixel center to its right,
+    and a cumulative sum along the row turns the toggles into the mask. Cost is
+    O(rows x edges + pixels). Holes (extra rings) are handled by the even-odd rule.
+
+    Args:
+        rings: List of [[lon, lat], ...] rings (GeoJSON polygon coordinates)
+        bounds: (min_lon, min_lat, max_lon, max_lat) of the grid
+        shape: Tuple (height, width)
+
+    Returns:
+        Boolean mask, True inside the polygon
+    """
+    height, width = shape
+    lons, lats = pixel_centers(bounds, shape)
+    pixel_width = (bounds[2] - bounds[0]) / width
+
+    starts = np.concatenate([np.asarray(ring, dtype=np.float64)[:, :2] for ring in rings])
+    ends = np.concatenate([np.roll(np.asarray(ring, dtype=np.float64)[:, :2], -1, axis=0) for ring in rings])
+    x1, y1 = starts[:, 0], starts[:, 1]
+    x2, y2 = ends[:, 0], ends[:, 1]
+
+    # Half-open test so a scanline through a vertex counts once
+    y = lats[:, None]
+    crosses = (y1 <= y) != (y2 <= y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_cross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+
+    rows, edges = np.nonzero(crosses)
+    # First column whose center lies right of the crossing
+    cols = np.ceil((x_cross[rows, edges] - lons[0]) / pixel_width).astype(np.int64)
+    cols = np.clip(cols, 0, width)
+
+    toggles = np.zeros((height, width + 1), dtype=np.int32)
+    np.add.at(toggles, (rows, cols), 1)
+    return (np.cumsum(toggles[:, :width], axis=1) % 2).astype(bool)
+
+
+def rasterize_circle(center, radius_m, bounds, shape):
+    """
+    Rasterize a circle given by its center and radius in meters.
+
+    Args:
+        center: Dict with "lat" and "lon"
+        radius_m: Radius in meters
+        bounds: (min_lon, min_lat, max_lon, max_lat) of the grid
+        shape: Tuple (height, width)
+
+    Returns:
+        Boolean mask, True inside the circle
+    """
+    lons, lats = pixel_centers(bounds, shape)
+    # Approximate distance: 111 km per degree, longitude scaled by latitude
+    dy = (lats[:, None] - center["lat"]) * 111000
+    dx = (lons[None, :] - center["lon"]) * 111000 * np.cos(np.radians(center["lat"]))
+    return dx**2 + dy**2 <= radius_m**2
+
+
+def geometry_key(feature):
+    """Hash identifying a drawn feature's geometry (and circle radius)"""
+    geometry = feature.get("geometry", feature)
+    radius = (feature.get("properties") or {}).get("radius")
+    payload = json.dumps({"geometry": geometry, "radius": radius}, sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def rasterize_feature(feature, bounds, shape):
+    """
+    AOI mask of a drawn GeoJSON feature on a grid, cached by geometry hash.
+
+    Polygons and rectangles are rasterized with the even-odd rule; circles
+    drawn with Leaflet.draw arrive as a Point with a "radius" property in meters.
+
+    Returns:
+        Read-only boolean mask, True inside the AOI
+    """
+    key = (geometry_key(feature), tuple(bounds), tuple(shape))
+    with _mask_cache_lock:
+        if key in _mask_cache:
+            _mask_cache.move_to_end(key)
+            return _mask_cache[key]
+
+    geometry = feature.get("geometry", feature)
+    geometry_type = geometry.get("type", "")
+    if geometry_type in ["Polygon", "Rectangle"]:
+        mask = rasterize_polygon(geometry["coordinates"], bounds, shape)
+    elif geometry_type in ["Point", "Circle"]:
+        lon, lat = geometry["coordinates"][:2]
+        radius_m = (feature.get("properties") or {}).get("radius", 0)
+        mask = rasterize_circle({"lat": lat, "lon": lon}, radius_m, bounds, shape)
+    else:
+        raise ValueError(f"Unsupported geometry type: {geometry_type}")
+
+    mask.setflags(write=False)
+    # Rasterized outside the lock; a mask computed concurrently for the same key is simply replaced
+    with _mask_cache_lock:
+        _mask_cache[key] = mask
+        _mask_cache.move_to_end(key)
+        while len(_mask_cache) > MASK_CACHE_SIZE:
+            _mask_cache.popitem(last=False)
+    return mask
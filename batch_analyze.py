@@ -0,0 +1,169 @@
+"""
+Batch crop health analysis from the command line.
+
+Analyzes every AOI in a file (or every predefined location) in a process
+pool and writes one row per field as JSON lines or CSV. With --tiled, a whole
+Sentinel-2 scene is analyzed instead, one memory-mapped tile at a time.
+
+Example:
+    python batch_analyze.py fields.geojson -o results.csv --workers 8
+    python batch_analyze.py --tiled scenes/2024-07-15/manifest.json --tile-size 2048
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from aoi_mask import rasterize_feature
+from crop_analysis import LOCATION_OPTIONS, CLOUD_HANDLING_METHODS, analyze_area, feature_bounds, feature_center
+from gap_filling import GAP_FILL_METHODS, DEFAULT_GAP_FILL_METHOD
+from sentinel_ingest import load_scene_manifest, open_scene
+from tiled_analysis import DEFAULT_TILE_SIZE, analyze_tiled
+
+
+def load_aois(path=None):
+    """
+    Load AOIs to analyze.
+
+    Args:
+        path: GeoJSON FeatureCollection, or a JSON object mapping names to
+            {"lat", "lon"} (the LOCATION_OPTIONS layout). If None, every
+            predefined location is used.
+
+    Returns:
+        List of dicts with "name" and "center" (and "feature" for GeoJSON input)
+    """
+    if path is None:
+        data = {name: options for name, options in LOCATION_OPTIONS.items() if name != "Select a location"}
+    else:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+
+    if data.get("type") == "FeatureCollection":
+        aois = []
+        for i, feature in enumerate(data["features"]):
+            properties = feature.get("properties") or {}
+            name = properties.get("name", feature.get("id", f"field_{i}"))
+            aois.append({"name": str(name), "center": feature_center(feature["geometry"]), "feature": feature})
+        return aois
+
+    return [{"name": name, "center": {"lat": options["lat"], "lon": options["lon"]}}
+            for name, options in data.items()]
+
+
+def analyze_aoi(task):
+    """
+    Worker entry point: analyze one AOI and return its flat record.
+
+    A GeoJSON field is analyzed inside its own shape, like a shape drawn in
+    the app: the simulated scene covers the field's bounding box and only the
+    pixels inside the polygon (or circle) are counted.
+    """
+    aoi, options = task
+    aoi_mask = None
+    if "feature" in aoi:
+        aoi_mask = rasterize_feature(aoi["feature"], feature_bounds(aoi["feature"]), options["shape"])
+    result = analyze_area(aoi["center"], location_name=aoi["name"], aoi_mask=aoi_mask, **options)
+    return result.to_record()
+
+
+def analyze_scene_tiled(manifest_path, cloud_masking=True, cloud_handling=None,
+                        gap_fill_method=DEFAULT_GAP_FILL_METHOD, tile_size=DEFAULT_TILE_SIZE):
+    """
+    Analyze a whole Sentinel-2 scene tile by tile.
+
+    The bands stay memory-mapped and only one tile (plus its halo) is read at
+    a time, so the scene can be larger than RAM.
+
+    Args:
+        manifest_path: Scene manifest with .npy or raw bands (see sentinel_ingest.load_scene_manifest())
+        cloud_masking: Whether to mask clouds with the QA60 band
+        cloud_handling: One of CLOUD_HANDLING_METHODS
+        gap_fill_method: Gap filling method for "Interpolate"
+        tile_size: Tile edge length in pixels
+
+    Returns:
+        AnalysisResult without array fields
+    """
+    manifest = load_scene_manifest(manifest_path)
+    ndvi, cloud_mask = open_scene(manifest)
+    min_lon, min_lat, max_lon, max_lat = manifest["bounds"]
+    return analyze_tiled(
+        ndvi, cloud_mask if cloud_masking else None, cloud_handling, tile_size,
+        location_name=manifest.get("date", manifest_path),
+        center={"lat": (min_lat + max_lat) / 2, "lon": (min_lon + max_lon) / 2},
+        gap_fill_method=gap_fill_method
+    )
+
+
+def write_records(records, output):
+    """Write records as CSV if the output ends in .csv, otherwise as JSON lines"""
+    out = sys.stdout if output == "-" else open(output, "w", newline="", encoding="utf-8")
+    try:
+        writer = None
+        for record in records:
+            if output.endswith(".csv"):
+                if writer is None:
+                    writer = csv.DictWriter(out, fieldnames=list(record.keys()))
+                    writer.writeheader()
+                writer.writerow(record)
+            else:
+                out.write(json.dumps(record) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch NDVI crop health analysis")
+    parser.add_argument("aois", nargs="?", help="GeoJSON of fields or JSON of named locations (default: predefined locations)")
+    parser.add_argument("-o", "--output", default="-", help="Output file (.csv or JSON lines), '-' for stdout")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--size", type=int, default=100, help="Scene size in pixels per side")
+    parser.add_argument("--no-cloud-masking", action="store_true", help="Disable QA60 cloud masking")
+    parser.add_argument("--cloud-coverage", type=float, default=0.2, help="Simulated cloud coverage (0-1)")
+    parser.add_argument("--cloud-size", type=int, default=10, help="Simulated cloud cluster size in pixels")
+    parser.add_argument("--cloud-handling", choices=CLOUD_HANDLING_METHODS, default=CLOUD_HANDLING_METHODS[0])
+    parser.add_argument("--gap-fill", choices=list(GAP_FILL_METHODS), default=DEFAULT_GAP_FILL_METHOD,
+                        help="Gap filling method for --cloud-handling Interpolate")
+    parser.add_argument("--seed", type=int, help="Base seed; field i uses seed + i for reproducible runs")
+    parser.add_argument("--tiled", metavar="MANIFEST",
+                        help="Analyze the whole scene of a Sentinel-2 manifest (.npy or raw bands) tile by tile instead of the AOIs")
+    parser.add_argument("--tile-size", type=int, default=DEFAULT_TILE_SIZE, help="Tile edge length in pixels for --tiled")
+    args = parser.parse_args(argv)
+
+    if args.tiled:
+        try:
+            result = analyze_scene_tiled(args.tiled, not args.no_cloud_masking, args.cloud_handling,
+                                         args.gap_fill, args.tile_size)
+        except ValueError as e:
+            parser.error(str(e))
+        write_records([result.to_record()], args.output)
+        return 0
+
+    aois = load_aois(args.aois)
+    tasks = []
+    for i, aoi in enumerate(aois):
+        options = {
+            "shape": (args.size, args.size),
+            "cloud_masking": not args.no_cloud_masking,
+            "cloud_coverage": args.cloud_coverage,
+            "cloud_size": args.cloud_size,
+            "cloud_handling": args.cloud_handling,
+            "gap_fill_method": args.gap_fill,
+            "seed": None if args.seed is None else args.seed + i,
+        }
+        tasks.append((aoi, options))
+
+    chunksize = max(1, len(tasks) // (4 * max(args.workers, 1)))
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        write_records(executor.map(analyze_aoi, tasks, chunksize=chunksize), args.output)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
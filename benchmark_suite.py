@@ -0,0 +1,198 @@
+"""
+Performance benchmarks for every analysis stage at several scene sizes.
+
+Each stage runs on inputs prepared from fixed seeds. After one untimed
+warm-up run (lazy imports, first-touch allocations), the best wall time of
+several repeats and the peak traced memory of one extra run are recorded.
+Results can be saved as a baseline and later runs compared against it, with a
+non-zero exit status when a stage got slower or hungrier than the threshold.
+
+Example:
+    python benchmark_suite.py --save-baseline benchmark_baseline.json
+    python benchmark_suite.py --baseline benchmark_baseline.json --threshold 0.25
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from functools import lru_cache
+
+import numpy as np
+
+from crop_analysis import NDVI_CLASS_LUT, analyze_area, simulate_ndvi, simulate_qa60_cloud_mask
+from gap_filling import DEFAULT_GAP_FILL_METHOD
+from ndvi_charts import ndvi_histogram_chart
+from ndvi_rendering import NDVI_PALETTE
+from ndvi_statistics import NDVIStatistics
+from scene import Scene
+from tiled_analysis import analyze_tiled
+
+DEFAULT_SIZES = (100, 1000, 5000)
+
+# Simulated scene parameters shared by every stage
+CLOUD_COVERAGE = 0.2
+CLOUD_SIZE = 10
+SHOWN = "Mask Clouds (Show)"
+
+# Tile edge length of the tiled stage; small enough that every size but the smallest spans several tiles
+BENCHMARK_TILE_SIZE = 256
+
+# Slowdowns smaller than this are timer noise and never count as regressions
+MIN_SECONDS_DELTA = 0.001
+
+
+@lru_cache(maxsize=1)
+def _inputs(size, seed):
+    """Inputs of every stage for one scene size, computed once and shared"""
+    shape = (size, size)
+    ndvi = simulate_ndvi(shape, seed)
+    cloud_mask = simulate_qa60_cloud_mask(shape, CLOUD_COVERAGE, CLOUD_SIZE, seed)
+    scene = Scene(ndvi, cloud_mask)
+    valid_mask = scene.valid_mask(SHOWN)
+    class_index = scene.class_index(NDVI_CLASS_LUT, SHOWN)
+    return {
+        "shape": shape,
+        "ndvi": ndvi,
+        "cloud_mask": cloud_mask,
+        "scene": scene,
+        "valid_mask": valid_mask,
+        "class_index": class_index,
+    }
+
+
+# Stage name -> function taking the prepared inputs and the seed, returning the callable to time
+STAGES = {
+    "cloud_mask": lambda d, seed: lambda: simulate_qa60_cloud_mask(d["shape"], CLOUD_COVERAGE, CLOUD_SIZE, seed),
+    "masking": lambda d, seed: lambda: Scene(d["ndvi"], d["cloud_mask"]).valid_mask(SHOWN),
+    "interpolation": lambda d, seed: lambda: Scene(d["ndvi"], d["cloud_mask"]).data("Interpolate",
+                                                                                    DEFAULT_GAP_FILL_METHOD),
+    "classification": lambda d, seed: lambda: d["scene"].class_index(NDVI_CLASS_LUT, SHOWN),
+    "colorization": lambda d, seed: lambda: np.take(NDVI_PALETTE, d["scene"].palette_indices(SHOWN), axis=0),
+    "statistics": lambda d, seed: lambda: NDVIStatistics(NDVI_CLASS_LUT).update(
+        d["scene"].ndvi, d["valid_mask"], d["class_index"]),
+    # The histogram is binned in the fused statistics pass; this times that binning (without
+    # class counts), the display bins summed from it and the chart spec built from them
+    "histogram": lambda d, seed: lambda: ndvi_histogram_chart(
+        NDVIStatistics(NDVI_CLASS_LUT).update(d["scene"].ndvi, d["valid_mask"]).histogram(), show_clouds=True),
+    "end_to_end": lambda d, seed: lambda: analyze_area({"lat": 0.0, "lon": 0.0}, shape=d["shape"],
+                                                       cloud_coverage=CLOUD_COVERAGE, cloud_size=CLOUD_SIZE,
+                                                       seed=seed),
+    "tiled": lambda d, seed: lambda: analyze_tiled(d["ndvi"], d["cloud_mask"], SHOWN, BENCHMARK_TILE_SIZE),
+}
+
+
+def measure(func, repeat=3):
+    """
+    Time a callable and trace its peak memory.
+
+    The callable first runs once untimed, so lazy imports and caches filled on
+    first use do not count.
+
+    Args:
+        func: Zero-argument callable
+        repeat: Number of timed runs; the fastest is reported
+
+    Returns:
+        Dict with "seconds" (best wall time) and "peak_bytes" (peak traced
+        allocation of one additional run)
+    """
+    func()
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    # Tracing slows allocation-heavy code, so memory is measured separately
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": best, "peak_bytes": peak}
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, stages=None, repeat=3, seed=0):
+    """
+    Run the selected stages at every scene size.
+
+    Returns:
+        Dict mapping "stage@size" to measure() results
+    """
+    results = {}
+    for size in sizes:
+        inputs = _inputs(size, seed)
+        for stage in stages or STAGES:
+            results[f"{stage}@{size}"] = measure(STAGES[stage](inputs, seed), repeat)
+    return results
+
+
+def compare_to_baseline(results, baseline, threshold=0.2, memory_threshold=None):
+    """
+    Find benchmarks that regressed compared with a baseline.
+
+    Args:
+        results: Dict from run_benchmarks()
+        baseline: Dict from an earlier run_benchmarks()
+        threshold: Allowed relative slowdown (0.2 = 20% slower)
+        memory_threshold: Allowed relative peak memory growth, defaults to threshold
+
+    Returns:
+        List of (name, metric, baseline value, new value) tuples
+    """
+    if memory_threshold is None:
+        memory_threshold = threshold
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric, allowed in (("seconds", threshold), ("peak_bytes", memory_threshold)):
+            old, new = baseline[name][metric], result[metric]
+            if metric == "seconds" and new - old < MIN_SECONDS_DELTA:
+                continue
+            if old > 0 and new > old * (1 + allowed):
+                regressions.append((name, metric, old, new))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the NDVI analysis stages")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="Scene edge lengths in pixels")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), help="Stages to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark; the fastest is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", help="Write the results as a new baseline JSON")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative slowdown before failing")
+    parser.add_argument("--memory-threshold", type=float, help="Allowed relative peak memory growth (default: --threshold)")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, args.stages, args.repeat, args.seed)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    print(f"{'benchmark':<26}{'ms':>12}{'peak MB':>10}{'vs baseline':>14}")
+    for name, result in results.items():
+        change = ""
+        if name in baseline and baseline[name]["seconds"] > 0:
+            change = f"{result['seconds'] / baseline[name]['seconds'] - 1:+.1%}"
+        print(f"{name:<26}{result['seconds'] * 1000:>12.2f}{result['peak_bytes'] / 2**20:>10.1f}{change:>14}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    regressions = compare_to_baseline(results, baseline, args.threshold, args.memory_threshold)
+    for name, metric, old, new in regressions:
+        print(f"REGRESSION {name} {metric}: {old:.4g} -> {new:.4g} ({new / old - 1:+.1%})", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
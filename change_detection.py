@@ -0,0 +1,238 @@
+"""
+Two-date NDVI change detection.
+
+The scenes at the start and end of a date range are compared a chunk of rows
+at a time. A pixel is compared only when it is clear on both dates (the union
+of the two cloud masks is excluded) and inside the AOI. Each chunk adds to
+the ΔNDVI statistics and histogram, the change category counts and the
+from-class x to-class transition matrix (one bincount on combined class
+indices), and writes its rows of the paletted change map. Memory is bounded
+by the chunk budget rather than by the scene, so two full Sentinel-2 tiles can
+be compared.
+"""
+import os
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from ndvi_classification import CLOUD_COLOR, NODATA_COLOR, classify_ndvi_array
+from sentinel_ingest import BAND_ROWS
+
+# Memory budget for the working arrays of one chunk
+CHANGE_CHUNK_BYTES = int(os.environ.get("CROP_HEALTH_CHANGE_CHUNK_MB", 64)) * 2**20
+
+# Peak working bytes per chunk pixel (measured): band reads and NDVI of both dates,
+# cloud masks, the compared values, their difference and class indices
+_BYTES_PER_PIXEL = 56
+
+# Change categories by ΔNDVI, as (label, upper bound, color)
+CHANGE_CATEGORIES = [
+    ("Strong Loss", -0.2, [215, 48, 39]),
+    ("Loss", -0.05, [252, 141, 89]),
+    ("Stable", 0.05, [247, 247, 247]),
+    ("Gain", 0.2, [145, 207, 96]),
+    ("Strong Gain", np.inf, [26, 152, 80]),
+]
+
+# ΔNDVI shown from full red to full green on the change map
+CHANGE_DISPLAY_RANGE = 0.5
+
+# Bin edges of the ΔNDVI histogram
+DELTA_HISTOGRAM_EDGES = np.linspace(-1.0, 1.0, 41)
+
+# Palette layout: 254 ΔNDVI levels, then clouds on either date and pixels outside the AOI
+CHANGE_LEVELS = 254
+CHANGE_CLOUD_INDEX = 254
+CHANGE_NODATA_INDEX = 255
+
+
+def build_change_palette():
+    """Diverging red-white-green palette over the change levels plus the reserved entries"""
+    anchors = np.array([CHANGE_CATEGORIES[0][2], CHANGE_CATEGORIES[2][2], CHANGE_CATEGORIES[-1][2]], dtype=float)
+    positions = np.linspace(0, 1, CHANGE_LEVELS)
+    palette = np.stack([np.interp(positions, [0, 0.5, 1], anchors[:, channel]) for channel in range(3)], axis=1)
+    return np.vstack([palette, [CLOUD_COLOR, NODATA_COLOR]]).round().astype(np.uint8)
+
+
+CHANGE_PALETTE = build_change_palette()
+
+
+def quantize_change(delta):
+    """Palette indices of ΔNDVI values (clipped to the display range)"""
+    scaled = (np.asarray(delta, dtype=np.float32) + CHANGE_DISPLAY_RANGE) * ((CHANGE_LEVELS - 1) / (2 * CHANGE_DISPLAY_RANGE))
+    np.clip(scaled, 0, CHANGE_LEVELS - 1, out=scaled)
+    return np.rint(scaled, out=scaled).astype(np.uint8)
+
+
+@dataclass
+class ChangeResult:
+    """Outcome of comparing two dates of one area"""
+    class_labels: list
+    area_pixels: int
+    cloud_pixels: int
+    delta_stats: dict
+    delta_histogram: np.ndarray = field(repr=False)
+    category_counts: dict = field(default_factory=dict)
+    transitions: np.ndarray = field(default=None, repr=False)
+    change_indices: np.ndarray = field(default=None, repr=False)
+
+    @property
+    def valid_pixels(self):
+        return self.delta_stats["count"]
+
+    @property
+    def cloud_percentage(self):
+        """Share of the AOI cloudy on either date, in percent"""
+        return self.cloud_pixels / max(self.area_pixels, 1) * 100
+
+    @property
+    def category_percentages(self):
+        """Share of the compared pixels in each change category, in percent"""
+        return {label: count / max(self.valid_pixels, 1) * 100 for label, count in self.category_counts.items()}
+
+    def transition_table(self):
+        """Transition matrix as rows of {"From", <to class>: percent of the from-class pixels}"""
+        rows = []
+        for from_class, counts in zip(self.class_labels, self.transitions):
+            total = max(int(counts.sum()), 1)
+            row = {"From": from_class}
+            row.update({to_class: float(count / total * 100) for to_class, count in zip(self.class_labels, counts)})
+            rows.append(row)
+        return rows
+
+
+class ChangeAccumulator:
+    """Running change statistics over chunks of two co-registered scenes"""
+
+    def __init__(self, class_lut):
+        self.class_lut = class_lut
+        self.num_classes = len(class_lut["labels"])
+        self.area_pixels = 0
+        self.cloud_pixels = 0
+        self.count = 0
+        self.delta_sum = 0.0
+        self.delta_sum_squares = 0.0
+        self.delta_min = np.inf
+        self.delta_max = -np.inf
+        self.histogram = np.zeros(len(DELTA_HISTOGRAM_EDGES) - 1, dtype=np.int64)
+        self.categories = np.zeros(len(CHANGE_CATEGORIES), dtype=np.int64)
+        self.transitions = np.zeros((self.num_classes, self.num_classes), dtype=np.int64)
+
+    def update(self, ndvi_before, cloud_before, ndvi_after, cloud_after, aoi=None, out=None):
+        """
+        Add one chunk.
+
+        Args:
+            ndvi_before, ndvi_after: NDVI of the chunk on both dates (NaN = no data)
+            cloud_before, cloud_after: Cloud masks (1 = cloud) or None
+            aoi: Optional boolean mask of the chunk pixels inside the AOI
+            out: Optional uint8 array receiving the chunk's change map indices
+        """
+        inside = np.ones(ndvi_before.shape, dtype=bool) if aoi is None else aoi.astype(bool, copy=False)
+        cloudy = np.zeros(ndvi_before.shape, dtype=bool)
+        for cloud_mask in (cloud_before, cloud_after):
+            if cloud_mask is not None:
+                cloudy |= cloud_mask.astype(bool, copy=False)
+        cloudy &= inside
+        valid = inside & ~cloudy & ~np.isnan(ndvi_before) & ~np.isnan(ndvi_after)
+        self.area_pixels += int(np.count_nonzero(inside))
+        self.cloud_pixels += int(np.count_nonzero(cloudy))
+
+        before, after = ndvi_before[valid], ndvi_after[valid]
+        delta = np.subtract(after, before, dtype=np.float32)
+        if delta.size:
+            self.count += delta.size
+            self.delta_sum += float(delta.sum(dtype=np.float64))
+            self.delta_sum_squares += float(np.dot(delta.astype(np.float64), delta))
+            self.delta_min = min(self.delta_min, float(delta.min()))
+            self.delta_max = max(self.delta_max, float(delta.max()))
+
+            bins = np.searchsorted(DELTA_HISTOGRAM_EDGES[1:-1], delta, side="right")
+            self.histogram += np.bincount(bins, minlength=len(self.histogram))
+            edges = [upper for _, upper, _ in CHANGE_CATEGORIES[:-1]]
+            self.categories += np.bincount(np.searchsorted(edges, delta, side="right"), minlength=len(self.categories))
+
+            # From-class x to-class counts with a single bincount on combined indices; values
+            # below the lowest class are raised to it so none is taken for the cloud index
+            lowest = self.class_lut["edges"][0]
+            from_class = classify_ndvi_array(np.maximum(before, lowest), self.class_lut).astype(np.int64)
+            to_class = classify_ndvi_array(np.maximum(after, lowest), self.class_lut)
+            combined = from_class * self.num_classes + to_class
+            self.transitions += np.bincount(combined, minlength=self.num_classes ** 2).reshape(
+                self.num_classes, self.num_classes)
+
+        if out is not None:
+            out[...] = CHANGE_NODATA_INDEX
+            out[cloudy] = CHANGE_CLOUD_INDEX
+            out[valid] = quantize_change(delta)
+
+    def result(self, change_indices=None):
+        """ChangeResult of everything added so far"""
+        if self.count:
+            mean = self.delta_sum / self.count
+            delta_stats = {
+                "count": self.count,
+                "mean": mean,
+                "std": float(np.sqrt(max(self.delta_sum_squares / self.count - mean * mean, 0.0))),
+                "min": self.delta_min,
+                "max": self.delta_max,
+            }
+        else:
+            delta_stats = {"count": 0, "mean": None, "std": None, "min": None, "max": None}
+        return ChangeResult(
+            class_labels=list(self.class_lut["labels"]),
+            area_pixels=self.area_pixels,
+            cloud_pixels=self.cloud_pixels,
+            delta_stats=delta_stats,
+            delta_histogram=self.histogram.copy(),
+            category_counts={label: int(count) for (label, _, _), count in zip(CHANGE_CATEGORIES, self.categories)},
+            transitions=self.transitions.copy(),
+            change_indices=change_indices,
+        )
+
+
+def chunk_rows(width, chunk_bytes=CHANGE_CHUNK_BYTES):
+    """Rows per chunk within the budget, a whole number of scene bands"""
+    rows = chunk_bytes // (width * _BYTES_PER_PIXEL)
+    return max(BAND_ROWS, rows // BAND_ROWS * BAND_ROWS)
+
+
+def detect_change(shape, read_before, read_after, class_lut, aoi_mask=None, chunk_bytes=CHANGE_CHUNK_BYTES,
+                  change_map=False):
+    """
+    Compare two co-registered scenes chunk by chunk.
+
+    Args:
+        shape: Tuple (height, width) of both scenes
+        read_before, read_after: Functions of a row slice returning
+            (NDVI, cloud mask or None) for those rows of each scene (see
+            sentinel_ingest.aoi_row_reader() and synthetic_scene.SyntheticScene.row_reader())
+        class_lut: Compiled class table for the transition matrix
+        aoi_mask: Optional boolean mask of the pixels inside the AOI
+        chunk_bytes: Memory budget of one chunk
+        change_map: Whether to build the paletted change map in memory (one
+            byte per pixel, off by default so memory stays within the chunk
+            budget); pass an array (e.g. a .npy memmap) of the scene shape to
+            write it there instead
+
+    Returns:
+        ChangeResult
+    """
+    height, width = shape
+    if change_map is True:
+        change_map = np.empty(shape, dtype=np.uint8)
+    elif change_map is False:
+        change_map = None
+
+    accumulator = ChangeAccumulator(class_lut)
+    rows_per_chunk = chunk_rows(width, chunk_bytes)
+    for start in range(0, height, rows_per_chunk):
+        rows = slice(start, min(start + rows_per_chunk, height))
+        ndvi_before, cloud_before = read_before(rows)
+        ndvi_after, cloud_after = read_after(rows)
+        accumulator.update(
+            ndvi_before, cloud_before, ndvi_after, cloud_after,
+            aoi=None if aoi_mask is None else aoi_mask[rows],
+            out=None if change_map is None else change_map[rows],
+        )
+    return accumulator.result(change_map)
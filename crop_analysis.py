@@ -0,0 +1,517 @@
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+from gap_filling import DEFAULT_GAP_FILL_METHOD
+from ndvi_classification import compile_ndvi_classes
+from ndvi_statistics import NDVIStatistics, PERCENTILES
+from instrumentation import profile_stage
+from scene import Scene
+
+# Predefined locations for easy selection
+LOCATION_OPTIONS = {
+    "Select a location": {"lat": 20.5937, "lon": 78.9629, "zoom": 5},  # Default - India
+    "Punjab (Wheat Belt)": {"lat": 30.9010, "lon": 75.8573, "zoom": 8},
+    "Karnataka (Coffee Region)": {"lat": 12.9716, "lon": 75.6099, "zoom": 9},
+    "Maharashtra (Cotton Belt)": {"lat": 20.7128, "lon": 77.0020, "zoom": 8},
+    "Tamil Nadu (Rice Fields)": {"lat": 11.1271, "lon": 78.6569, "zoom": 8},
+    "Uttar Pradesh (Sugarcane Region)": {"lat": 28.0000, "lon": 79.0000, "zoom": 8},
+}
+
+# Define NDVI classification thresholds and categories
+NDVI_CLASSES = {
+    (-0.2, 0.0): {"label": "Water/Non-Vegetation", "color": [0, 0, 128], "description": "Bodies of water, bare soil, or artificial surfaces"},
+    (0.0, 0.2): {"label": "Sparse Vegetation", "color": [255, 165, 0], "description": "Very sparse vegetation, stressed crops, or barren areas"},
+    (0.2, 0.4): {"label": "Moderate Vegetation", "color": [255, 255, 0], "description": "Moderate vegetation, potentially with mild stress or early growth stages"},
+    (0.4, 0.6): {"label": "Good Vegetation", "color": [144, 238, 144], "description": "Healthy vegetation with good leaf area coverage"},
+    (0.6, 0.9): {"label": "Dense Vegetation", "color": [0, 128, 0], "description": "Very healthy, dense vegetation with optimal photosynthetic activity"}
+}
+
+# Compiled lookup table for classifying whole NDVI arrays at once
+NDVI_CLASS_LUT = compile_ndvi_classes(NDVI_CLASSES)
+
+# Upper NDVI bound of water and bare soil; only zones above it are cited for soil testing
+BARE_SOIL_MAX_NDVI = 0.0
+
+# Upper bound on pixels stamped per batch when drawing cloud clusters
+CLOUD_STAMP_BATCH_PIXELS = 1 << 22
+
+def simulate_qa60_cloud_mask(shape, cloud_coverage=0.2, cloud_size=10, seed=None):
+    """
+    Simulate QA60 band from Sentinel-2 for cloud masking.
+    
+    Args:
+        shape: Tuple, shape of the image (height, width)
+        cloud_coverage: Float, percentage of the image covered by clouds (0-1)
+        cloud_size: Int, approximate size of cloud clusters in pixels
+        seed: Optional int seed or numpy.random.Generator for reproducible masks
+        
+    Returns:
+        Binary mask where 1 = cloud, 0 = clear
+    """
+    rng = np.random.default_rng(seed)
+    height, width = shape
+    # Start with all clear
+    mask = np.zeros(shape, dtype=np.uint8)
+    
+    # Number of cloud clusters
+    num_clusters = int((height * width * cloud_coverage) / (cloud_size * cloud_size))
+    
+    # Random centers and radii for all cloud clusters
+    centers_y = rng.integers(0, height, num_clusters)
+    centers_x = rng.integers(0, width, num_clusters)
+    radii = rng.integers(cloud_size//2, cloud_size, num_clusters)
+    
+    stamp_cloud_clusters(mask, centers_y, centers_x, radii, rng)
+    
+    return mask
+
+def stamp_cloud_clusters(mask, centers_y, centers_x, radii, rng, row_offset=0):
+    """
+    Stamp circular cloud clusters into a mask, touching only each cluster's window.
+    
+    Clusters sharing a radius share one precomputed stamp of core and edge
+    offsets, so the cost is proportional to the cloud area rather than the
+    image area. Edge noise is drawn only for pixels in the cluster ring.
+    
+    Args:
+        mask: uint8 mask to update in place (1 = cloud)
+        centers_y: Array of cluster center rows (in full-image coordinates)
+        centers_x: Array of cluster center columns
+        radii: Array of cluster radii in pixels
+        rng: numpy.random.Generator used for edge scatter
+        row_offset: Full-image row of mask[0], for stamping into a row chunk
+    """
+    for radius in np.unique(radii):
+        # Core clouds (always cloudy) and edges (partially cloudy) of this radius
+        dy, dx = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+        dist_from_center = np.sqrt(dy**2 + dx**2)
+        core = dist_from_center <= radius * 0.7
+        edge = (dist_from_center > radius * 0.7) & (dist_from_center <= radius)
+        
+        cluster_ids = np.flatnonzero(radii == radius)
+        batch_size = max(1, CLOUD_STAMP_BATCH_PIXELS // dy.size)
+        
+        for start in range(0, len(cluster_ids), batch_size):
+            batch = cluster_ids[start:start + batch_size]
+            batch_y = centers_y[batch] - row_offset
+            batch_x = centers_x[batch]
+            
+            _stamp_offsets(mask, batch_y, batch_x, dy[core], dx[core])
+            
+            # Random scatter at edges to make it look more natural
+            edge_rand = rng.random((len(batch), int(edge.sum()))) < 0.7
+            _stamp_offsets(mask, batch_y, batch_x, dy[edge], dx[edge], edge_rand)
+
+def _stamp_offsets(mask, centers_y, centers_x, offsets_y, offsets_x, keep=None):
+    """Set mask pixels at center + offset positions, clipped to the mask bounds"""
+    height, width = mask.shape
+    ys = centers_y[:, None] + offsets_y[None, :]
+    xs = centers_x[:, None] + offsets_x[None, :]
+    
+    inside = (ys >= 0) & (ys < height) & (xs >= 0) & (xs < width)
+    if keep is not None:
+        inside &= keep
+    
+    mask[ys[inside], xs[inside]] = 1
+
+# Cloud handling methods offered in the app
+CLOUD_HANDLING_METHODS = ["Mask Clouds (Show)", "Remove Clouds (Hide)", "Interpolate"]
+
+# Health score weights, higher for better vegetation classes
+HEALTH_WEIGHTS = {
+    "Water/Non-Vegetation": 0.0,
+    "Sparse Vegetation": 0.25,
+    "Moderate Vegetation": 0.5,
+    "Good Vegetation": 0.75,
+    "Dense Vegetation": 1.0
+}
+
+def simulate_ndvi(shape=(100, 100), seed=None):
+    """
+    Create simulated NDVI data with a smooth spatial pattern.
+    
+    Args:
+        shape: Tuple, shape of the image (height, width)
+        seed: Optional int seed or numpy.random.Generator
+        
+    Returns:
+        NDVI array clipped to [-0.2, 0.9]
+    """
+    rng = np.random.default_rng(seed)
+    ndvi = rng.uniform(-0.2, 0.9, shape)
+    
+    # Add some patterns to make it look more realistic
+    x, y = np.mgrid[0:shape[0], 0:shape[1]]
+    pattern = np.sin(x/10) * np.cos(y/10) * 0.3
+    return np.clip(ndvi + pattern, -0.2, 0.9)
+
+def compute_class_percentages(class_counts):
+    """Convert class pixel counts into percentages of the valid (non-cloud) pixels"""
+    total_valid_pixels = sum(class_counts.values())
+    return {label: (count / max(total_valid_pixels, 1)) * 100 
+            for label, count in class_counts.items()}
+
+def compute_health_score(class_percentages):
+    """Health score (0-100) weighted by class percentages"""
+    return sum(HEALTH_WEIGHTS[label] * pct for label, pct in class_percentages.items())
+
+def get_health_status(health_score):
+    """
+    Map a health score to a status level and message.
+    
+    Returns:
+        Tuple of (level, message) where level is "success", "warning" or "error"
+    """
+    if health_score > 70:
+        return "success", "Crop health is excellent! The vegetation in this area shows optimal photosynthetic activity."
+    if health_score > 50:
+        return "success", "Crop health is good. Most of the area has healthy vegetation."
+    if health_score > 30:
+        return "warning", "Crop health is moderate. Consider monitoring irrigation and nutrient levels."
+    return "error", "Crop health is poor. Immediate attention may be required to address potential issues."
+
+def generate_insights(class_percentages, cloud_percentage=None):
+    """
+    Generate insights based on the classification.
+    
+    Args:
+        class_percentages: Dict mapping class labels to percentages
+        cloud_percentage: Cloud coverage percentage, or None if cloud masking is disabled
+        
+    Returns:
+        List of insight strings
+    """
+    insights = []
+    
+    # Water/non-vegetation insights
+    water_pct = class_percentages["Water/Non-Vegetation"]
+    if water_pct > 15:
+        insights.append(f"Significant non-vegetative area detected ({water_pct:.1f}%). This may include water bodies, bare soil, or artificial surfaces.")
+    
+    # Sparse vegetation insights
+    sparse_pct = class_percentages["Sparse Vegetation"]
+    if sparse_pct > 30:
+        insights.append(f"Large portions of sparse vegetation ({sparse_pct:.1f}%) indicate potential crop stress or early growth stages.")
+    
+    # Moderate vegetation insights
+    moderate_pct = class_percentages["Moderate Vegetation"]
+    if moderate_pct > 40:
+        insights.append(f"Predominant moderate vegetation ({moderate_pct:.1f}%) suggests developing crops that may benefit from additional nutrients.")
+    
+    # Good vegetation insights
+    good_pct = class_percentages["Good Vegetation"]
+    if good_pct > 40:
+        insights.append(f"Significant healthy vegetation ({good_pct:.1f}%) indicates well-maintained crops with good photosynthetic activity.")
+    
+    # Dense vegetation insights
+    dense_pct = class_percentages["Dense Vegetation"]
+    if dense_pct > 30:
+        insights.append(f"High proportion of dense vegetation ({dense_pct:.1f}%) shows excellent crop development and optimal growing conditions.")
+    
+    # Cloud impact insights
+    if cloud_percentage is not None and cloud_percentage > 20:
+        insights.append(f"Significant cloud coverage ({cloud_percentage:.1f}%) detected. Consider acquiring additional imagery with lower cloud coverage for more accurate analysis.")
+    
+    if not insights:
+        insights.append("The area shows a mixed pattern of vegetation health. Regular monitoring is recommended.")
+    
+    return insights
+
+def cite_zones(zones, label=None, limit=2):
+    """
+    Phrase naming the first ranked zones (of one class), e.g. "Zone 1 (2.4 ha at 30.9010°N, 75.8573°E)".
+    
+    Args:
+        zones: Ranked zone records (see management_zones.rank_zones()), or None
+        label: Only cite zones whose class is this label
+        limit: Number of zones cited
+        
+    Returns:
+        Phrase, or "" when there is nothing to cite
+    """
+    cited = [zone for zone in zones or [] if label is None or zone["class"] == label][:limit]
+    return " and ".join(
+        f"Zone {zone['zone']} ({zone['area_ha']:.1f} ha at {zone['lat']:.4f}°N, {zone['lon']:.4f}°E)"
+        for zone in cited
+    )
+
+def generate_recommendations(class_percentages, cloud_percentage=None, zones=None):
+    """
+    Generate management recommendations based on the classification.
+    
+    Args:
+        class_percentages: Dict mapping class labels to percentages
+        cloud_percentage: Cloud coverage percentage, or None if cloud masking is disabled
+        zones: Optional ranked management zones; the largest zones of each
+            class are cited so the advice says where to act
+        
+    Returns:
+        List of recommendation strings
+    """
+    sparse_zones = cite_zones(zones, "Sparse Vegetation")
+    moderate_zones = cite_zones(zones, "Moderate Vegetation")
+    # The least healthy vegetated zone; water and bare soil have low NDVI without any soil problem
+    vegetated_zones = [zone for zone in zones or [] if zone["mean_ndvi"] > BARE_SOIL_MAX_NDVI]
+    low_zone = min(vegetated_zones, key=lambda zone: zone["mean_ndvi"]) if vegetated_zones else None
+    recommendations = [
+        f"Focus irrigation on areas showing sparse vegetation (orange regions - {class_percentages['Sparse Vegetation']:.1f}% of area)"
+        + (f", starting with {sparse_zones}" if sparse_zones else ""),
+        f"Apply targeted fertilizer to boost moderate vegetation areas (yellow regions - {class_percentages['Moderate Vegetation']:.1f}% of area)"
+        + (f", starting with {moderate_zones}" if moderate_zones else ""),
+        "Monitor temporal changes in NDVI to track crop development over time",
+        "Consider soil testing in areas with consistently low NDVI values"
+        + (f", such as {cite_zones([low_zone])} with a mean NDVI of {low_zone['mean_ndvi']:.2f}" if low_zone else ""),
+        "Implement crop rotation strategies for the next season in underperforming regions"
+    ]
+    
+    # Add cloud-specific recommendations if needed
+    if cloud_percentage is not None and cloud_percentage > 30:
+        recommendations.insert(0, "Acquire additional satellite imagery with lower cloud coverage for more accurate analysis")
+    
+    return recommendations
+
+@dataclass
+class AnalysisResult:
+    """
+    Outcome of analyzing one area.
+    
+    The scene and arrays are kept for rendering but left out of records;
+    apart from the histogram they are None when the scene was analyzed
+    tile by tile.
+    """
+    location_name: str
+    center: dict
+    cloud_handling: Optional[str]
+    cloud_percentage: Optional[float]
+    class_counts: dict
+    class_percentages: dict
+    ndvi_stats: Optional[dict]
+    health_score: Optional[float]
+    dominant_class: Optional[str]
+    insights: list
+    recommendations: list
+    scene: Optional[Scene] = field(default=None, repr=False)
+    gap_fill_method: Optional[str] = None
+    class_index: Optional[np.ndarray] = field(default=None, repr=False)
+    ndvi_histogram: Optional[np.ndarray] = field(default=None, repr=False)
+    zones: Optional[list] = field(default=None, repr=False)
+    
+    @property
+    def ndvi(self):
+        """Original float32 NDVI"""
+        return None if self.scene is None else self.scene.ndvi
+    
+    @property
+    def masked_ndvi(self):
+        """Cloud-handled NDVI as a masked array view (masked = cloud, no-data or outside the AOI)"""
+        return None if self.scene is None else self.scene.view(self.cloud_handling, self.gap_fill_method)
+    
+    @property
+    def cloud_mask(self):
+        """Boolean cloud mask unpacked from the scene"""
+        return None if self.scene is None else self.scene.cloud_mask
+    
+    @property
+    def valid_mask(self):
+        """Boolean mask of the pixels counted in the statistics"""
+        return None if self.scene is None else self.scene.valid_mask(self.cloud_handling, self.gap_fill_method)
+    
+    def to_record(self):
+        """Flatten the scalar results into a single row for JSON/CSV output"""
+        record = {
+            "location_name": self.location_name,
+            "lat": self.center["lat"],
+            "lon": self.center["lon"],
+            "cloud_handling": self.cloud_handling,
+            "cloud_percentage": self.cloud_percentage,
+            "health_score": self.health_score,
+            "dominant_class": self.dominant_class,
+        }
+        for name in ("min", "mean", "max", "std"):
+            record[f"ndvi_{name}"] = self.ndvi_stats[name] if self.ndvi_stats else None
+        for q in PERCENTILES:
+            record[f"ndvi_p{q}"] = self.ndvi_stats["percentiles"][q] if self.ndvi_stats else None
+        for label, pct in self.class_percentages.items():
+            record[f"pct_{label}"] = pct
+        return record
+
+def simulation_rngs(seed=None):
+    """
+    Separate generators for the simulated NDVI and the simulated clouds.
+    
+    Each stream depends only on the seed, so the cloud mask for a seed is the
+    same whether or not the NDVI was simulated in the same run. A Generator
+    passed as seed is used for both.
+    
+    Returns:
+        (ndvi_rng, cloud_rng)
+    """
+    if isinstance(seed, np.random.Generator):
+        return seed, seed
+    ndvi_sequence, cloud_sequence = np.random.SeedSequence(seed).spawn(2)
+    return np.random.default_rng(ndvi_sequence), np.random.default_rng(cloud_sequence)
+
+def scene_cloud_percentage(scene):
+    """Cloud coverage of a Scene in percent; only pixels inside its AOI count"""
+    aoi = scene.aoi_mask
+    area_pixels = max(int(np.count_nonzero(aoi)), 1)
+    return float(np.count_nonzero(scene.cloud_mask & aoi) / area_pixels) * 100
+
+def analyze_area(center, location_name="", shape=(100, 100), cloud_masking=True,
+                 cloud_coverage=0.2, cloud_size=10, cloud_handling="Mask Clouds (Show)", seed=None,
+                 ndvi=None, cloud_mask=None, gap_fill_method=DEFAULT_GAP_FILL_METHOD, aoi_mask=None):
+    """
+    Run the full NDVI analysis for one area without any UI.
+    
+    Args:
+        center: Dict with "lat" and "lon" of the area center
+        location_name: Name used in reports
+        shape: Tuple, shape of the simulated scene (height, width)
+        cloud_masking: Whether to simulate and handle QA60 clouds
+        cloud_coverage: Float, simulated cloud coverage (0-1)
+        cloud_size: Int, simulated cloud cluster size in pixels
+        cloud_handling: One of CLOUD_HANDLING_METHODS
+        seed: Optional int seed or numpy.random.Generator for reproducible results
+        ndvi: Optional NDVI array (e.g. from sentinel_ingest.read_aoi) used
+            instead of the simulated scene
+        cloud_mask: Optional QA60 cloud mask used instead of the simulated one
+        gap_fill_method: One of gap_filling.GAP_FILL_METHODS, used by "Interpolate"
+        aoi_mask: Optional boolean mask of the pixels inside the drawn shape
+            (see aoi_mask.rasterize_feature); only these pixels are counted
+        
+    Returns:
+        AnalysisResult
+    """
+    ndvi_rng, cloud_rng = simulation_rngs(seed)
+    if ndvi is None:
+        with profile_stage("simulate_ndvi"):
+            ndvi = simulate_ndvi(shape, ndvi_rng)
+    
+    if cloud_masking:
+        if cloud_mask is None:
+            with profile_stage("cloud_mask"):
+                cloud_mask = simulate_qa60_cloud_mask(ndvi.shape, cloud_coverage, cloud_size, cloud_rng)
+        if cloud_handling not in CLOUD_HANDLING_METHODS:
+            raise ValueError(f"Unknown cloud handling method: {cloud_handling}")
+    else:
+        # No cloud masking, just use the original NDVI
+        cloud_handling = None
+        cloud_mask = None
+    
+    # One float32 buffer plus cloud and AOI bitmaps; the cloud handling
+    # modes are views over it instead of separately masked copies
+    scene = Scene(ndvi, cloud_mask, aoi_mask)
+    
+    cloud_percentage = scene_cloud_percentage(scene) if cloud_mask is not None else None
+    
+    with profile_stage("cloud_handling"):
+        valid_mask = scene.valid_mask(cloud_handling, gap_fill_method)
+    
+    # Classify all pixels at once (clouds and excluded pixels become extra classes)
+    with profile_stage("classification"):
+        class_index = scene.class_index(NDVI_CLASS_LUT, cloud_handling, gap_fill_method)
+    
+    # Class counts, NDVI statistics and the histogram in one pass
+    with profile_stage("statistics"):
+        stats = NDVIStatistics(NDVI_CLASS_LUT).update(scene.data(cloud_handling, gap_fill_method),
+                                                      valid_mask, class_index)
+    
+    return build_analysis_result(
+        location_name, center, cloud_handling, cloud_percentage,
+        stats.class_counts_by_label(), stats.ndvi_stats(),
+        scene=scene,
+        gap_fill_method=gap_fill_method,
+        class_index=class_index,
+        ndvi_histogram=stats.histogram(),
+    )
+
+def build_analysis_result(location_name, center, cloud_handling, cloud_percentage,
+                          class_counts, ndvi_stats, zones=None, **arrays):
+    """
+    Derive percentages, health score, insights and recommendations and wrap
+    everything in an AnalysisResult.
+    
+    Shared by the in-memory and tiled paths so both report identical metrics
+    from the same counts and statistics.
+    
+    Args:
+        location_name: Name used in reports
+        center: Dict with "lat" and "lon" of the area center
+        cloud_handling: One of CLOUD_HANDLING_METHODS, or None without cloud masking
+        cloud_percentage: Cloud coverage percentage, or None without cloud masking
+        class_counts: Dict mapping class labels to valid pixel counts
+        ndvi_stats: Dict from NDVIStatistics.ndvi_stats(), or None
+        zones: Optional ranked management zones (see management_zones.rank_zones())
+        **arrays: Optional array fields of AnalysisResult
+        
+    Returns:
+        AnalysisResult
+    """
+    class_percentages = compute_class_percentages(class_counts)
+    
+    health_score = dominant_class = None
+    insights = []
+    recommendations = []
+    if ndvi_stats is not None:
+        dominant_class = max(class_percentages.items(), key=lambda x: x[1])[0]
+        health_score = compute_health_score(class_percentages)
+        insights = generate_insights(class_percentages, cloud_percentage)
+        recommendations = generate_recommendations(class_percentages, cloud_percentage, zones)
+    
+    return AnalysisResult(
+        location_name=location_name,
+        center=center,
+        cloud_handling=cloud_handling,
+        cloud_percentage=cloud_percentage,
+        class_counts=class_counts,
+        class_percentages=class_percentages,
+        ndvi_stats=ndvi_stats,
+        health_score=health_score,
+        dominant_class=dominant_class,
+        insights=insights,
+        recommendations=recommendations,
+        zones=zones,
+        **arrays
+    )
+
+def feature_center(geometry):
+    """
+    Center of a GeoJSON geometry as a {"lat", "lon"} dict.
+    
+    Points use their coordinates directly, polygons the average of their vertices
+    (the same approximation used for drawn shapes in the app).
+    """
+    geometry_type = geometry.get("type", "")
+    if geometry_type in ["Point", "Circle"]:
+        lon, lat = geometry["coordinates"][:2]
+        return {"lat": lat, "lon": lon}
+    if geometry_type in ["Polygon", "Rectangle"]:
+        coordinates = geometry["coordinates"][0]
+        lats = [coord[1] for coord in coordinates]
+        lons = [coord[0] for coord in coordinates]
+        return {"lat": sum(lats) / len(lats), "lon": sum(lons) / len(lons)}
+    raise ValueError(f"Unsupported geometry type: {geometry_type}")
+
+def feature_bounds(feature):
+    """
+    Bounding box of a drawn GeoJSON feature as (min_lon, min_lat, max_lon, max_lat).
+    
+    Circles drawn with Leaflet.draw arrive as a Point with a "radius" property in meters.
+    """
+    geometry = feature.get("geometry", feature)
+    geometry_type = geometry.get("type", "")
+    if geometry_type in ["Point", "Circle"]:
+        lon, lat = geometry["coordinates"][:2]
+        radius_m = (feature.get("properties") or {}).get("radius", 0)
+        return circle_bounds({"lat": lat, "lon": lon}, radius_m / 111000)
+    if geometry_type in ["Polygon", "Rectangle"]:
+        coordinates = geometry["coordinates"][0]
+        lats = [coord[1] for coord in coordinates]
+        lons = [coord[0] for coord in coordinates]
+        return (min(lons), min(lats), max(lons), max(lats))
+    raise ValueError(f"Unsupported geometry type: {geometry_type}")
+
+def circle_bounds(center, radius):
+    """Bounding box of a circle whose radius is given in degrees (as in the area size options)"""
+    return (center["lon"] - radius, center["lat"] - radius, center["lon"] + radius, center["lat"] + radius)
@@ -0,0 +1,314 @@
+"""
+Fleet analysis: many field geometries over one regional scene.
+
+The regional NDVI and cloud mask are placed in shared memory once; worker
+processes attach to them, so each task only carries field geometries and
+pixel windows. Every field is analyzed inside its own rasterized shape and
+the per-field results are collected into a pandas DataFrame (CSV or Parquet).
+
+Example:
+    python fleet_batch.py fields.geojson -o fleet.parquet --workers 8
+    python fleet_batch.py --demo-fields 500 --scaling
+"""
+import argparse
+import importlib.util
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from aoi_mask import rasterize_feature
+from batch_analyze import load_aois
+from crop_analysis import (LOCATION_OPTIONS, CLOUD_HANDLING_METHODS, analyze_area, feature_bounds,
+                           simulate_ndvi, simulate_qa60_cloud_mask)
+from gap_filling import GAP_FILL_METHODS, DEFAULT_GAP_FILL_METHOD
+from sentinel_ingest import bounds_to_window, read_aoi, window_bounds
+
+# Ground resolution of the simulated regional grid (about 10 m, the Sentinel-2 B4/B8 pixel)
+DEFAULT_RESOLUTION_DEG = 0.0001
+
+# Margin added around the fields when planning the regional grid, in degrees
+REGION_MARGIN_DEG = 0.001
+
+# Fields per task; large enough to amortize task overhead, small enough to balance load
+FIELDS_PER_TASK = 16
+
+# Fields analyzed per second per worker process that a run is expected to reach
+TARGET_FIELDS_PER_SECOND_PER_CORE = 200
+
+# Arrays shared with the worker processes, set by _attach_scene()
+_scene = {}
+
+
+def region_bounds(features, margin=REGION_MARGIN_DEG):
+    """Bounding box (min_lon, min_lat, max_lon, max_lat) of all features plus a margin"""
+    boxes = np.array([feature_bounds(feature) for feature in features])
+    return (float(boxes[:, 0].min() - margin), float(boxes[:, 1].min() - margin),
+            float(boxes[:, 2].max() + margin), float(boxes[:, 3].max() + margin))
+
+
+def synthetic_fields(center, count, seed=None, spread_deg=0.1, max_size_deg=0.005):
+    """
+    Random quadrilateral fields scattered around a center, for demos and scaling runs.
+
+    Returns:
+        GeoJSON FeatureCollection
+    """
+    rng = np.random.default_rng(seed)
+    features = []
+    for i in range(count):
+        lon = center["lon"] + rng.uniform(-spread_deg, spread_deg)
+        lat = center["lat"] + rng.uniform(-spread_deg, spread_deg)
+        half_width, half_height = rng.uniform(max_size_deg / 4, max_size_deg / 2, 2)
+        # Jittered corners so fields are not all axis-aligned rectangles
+        jitter = rng.uniform(-0.3, 0.3, (4, 2)) * [half_width, half_height]
+        corners = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]]) * [half_width, half_height] + jitter + [lon, lat]
+        ring = corners.tolist() + [corners[0].tolist()]
+        features.append({
+            "type": "Feature",
+            "properties": {"name": f"field_{i}"},
+            "geometry": {"type": "Polygon", "coordinates": [ring]},
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def _to_shared(array):
+    """Copy an array into a new shared memory block"""
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block, {"name": block.name, "shape": array.shape, "dtype": array.dtype.str}
+
+
+def _attach(spec):
+    """Attach to a shared memory block created by the parent process"""
+    # Workers share the parent's resource tracker, so the parent's unlink()
+    # remains the only cleanup; nothing is unregistered here
+    block = shared_memory.SharedMemory(name=spec["name"])
+    return block, np.ndarray(spec["shape"], dtype=np.dtype(spec["dtype"]), buffer=block.buf)
+
+
+def _attach_scene(specs, scene_bounds, ready):
+    """Worker initializer: map the shared regional arrays"""
+    _scene["bounds"] = scene_bounds
+    _scene["ready"] = ready
+    for name, spec in specs.items():
+        block, array = _attach(spec)
+        # Keep the block referenced for as long as the array view is used
+        _scene[f"{name}_block"] = block
+        _scene[name] = array
+
+
+def _wait_ready():
+    """Warm-up task: return once every worker of the pool has started and attached"""
+    _scene["ready"].wait()
+
+
+def analyze_fields(task):
+    """
+    Worker entry point: analyze a batch of fields against the shared scene.
+
+    Args:
+        task: Tuple of (list of (name, feature, window) tuples, analysis options)
+
+    Returns:
+        List of result records
+    """
+    fields, options = task
+    ndvi, cloud_mask = _scene["ndvi"], _scene.get("cloud_mask")
+    records = []
+    for name, feature, window in fields:
+        bounds = window_bounds(_scene["bounds"], ndvi.shape, window)
+        field_ndvi = ndvi[window]
+        aoi = rasterize_feature(feature, bounds, field_ndvi.shape)
+        result = analyze_area(
+            {"lat": (bounds[1] + bounds[3]) / 2, "lon": (bounds[0] + bounds[2]) / 2},
+            location_name=name,
+            ndvi=field_ndvi,
+            cloud_mask=None if cloud_mask is None else cloud_mask[window],
+            cloud_masking=cloud_mask is not None,
+            aoi_mask=aoi,
+            **options,
+        )
+        record = result.to_record()
+        record["pixels"] = int(np.count_nonzero(aoi))
+        records.append(record)
+    return records
+
+
+def plan_tasks(aois, scene_bounds, scene_shape, options, fields_per_task=FIELDS_PER_TASK):
+    """
+    Assign fields to tasks.
+
+    Fields are ordered north to south, west to east, so consecutive tasks
+    read neighbouring rows of the shared scene.
+
+    Returns:
+        List of task tuples for analyze_fields()
+    """
+    planned = []
+    for aoi in aois:
+        window = bounds_to_window(scene_bounds, scene_shape, feature_bounds(aoi["feature"]))
+        planned.append((aoi["name"], aoi["feature"], window))
+    planned.sort(key=lambda field: (field[2][0].start, field[2][1].start))
+    return [(planned[i:i + fields_per_task], options) for i in range(0, len(planned), fields_per_task)]
+
+
+def load_region_scene(scene_bounds, manifest=None, resolution=DEFAULT_RESOLUTION_DEG,
+                      cloud_coverage=0.2, cloud_size=10, seed=None):
+    """
+    NDVI and cloud mask covering the region.
+
+    Args:
+        scene_bounds: Region bounds from region_bounds()
+        manifest: Optional Sentinel-2 scene manifest; the region window is read
+            from it (aligned to the nearest scene pixels)
+        resolution: Pixel size in degrees of the simulated grid
+
+    Returns:
+        Tuple of (float32 NDVI, uint8 cloud mask or None, bounds of the grid);
+        the bounds differ from scene_bounds when a window is read from a manifest
+    """
+    if manifest is not None:
+        return read_aoi(manifest, scene_bounds)
+    rng = np.random.default_rng(seed)
+    shape = (int(np.ceil((scene_bounds[3] - scene_bounds[1]) / resolution)),
+             int(np.ceil((scene_bounds[2] - scene_bounds[0]) / resolution)))
+    ndvi = simulate_ndvi(shape, rng).astype(np.float32)
+    return ndvi, simulate_qa60_cloud_mask(shape, cloud_coverage, cloud_size, rng), scene_bounds
+
+
+def run_fleet(aois, ndvi, cloud_mask, scene_bounds, options, workers=None, fields_per_task=FIELDS_PER_TASK):
+    """
+    Analyze every field in a process pool sharing the regional arrays.
+
+    Args:
+        aois: List of dicts with "name" and "feature"
+        ndvi: Regional NDVI array
+        cloud_mask: Regional cloud mask, or None without cloud masking
+        scene_bounds: Bounds of the regional grid as returned by load_region_scene()
+        options: Keyword arguments for analyze_area() (cloud_handling, gap_fill_method)
+        workers: Number of worker processes
+        fields_per_task: Fields per task
+
+    Returns:
+        Tuple of (pandas DataFrame with one row per field, elapsed seconds);
+        the time excludes starting the worker processes
+    """
+    workers = workers or os.cpu_count()
+    arrays = {"ndvi": ndvi} if cloud_mask is None else {"ndvi": ndvi, "cloud_mask": cloud_mask}
+    blocks, specs = [], {}
+    try:
+        for name, array in arrays.items():
+            block, specs[name] = _to_shared(np.ascontiguousarray(array))
+            blocks.append(block)
+
+        tasks = plan_tasks(aois, scene_bounds, ndvi.shape, options, fields_per_task)
+        ready = multiprocessing.Barrier(workers)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach_scene,
+                                 initargs=(specs, scene_bounds, ready)) as executor:
+            # One warm-up task per worker, each held at the barrier until all have started,
+            # so process start-up and attaching are not timed
+            for future in [executor.submit(_wait_ready) for _ in range(workers)]:
+                future.result()
+            start = time.perf_counter()
+            records = [record for batch in executor.map(analyze_fields, tasks) for record in batch]
+            elapsed = time.perf_counter() - start
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    return pd.DataFrame.from_records(records), elapsed
+
+
+def parquet_supported():
+    """Whether pandas has a Parquet engine (pyarrow or fastparquet) to write with"""
+    return any(importlib.util.find_spec(engine) is not None for engine in ("pyarrow", "fastparquet"))
+
+
+def write_frame(frame, output):
+    """Write a results DataFrame as Parquet (.parquet) or CSV (anything else, '-' for stdout)"""
+    if output.endswith(".parquet"):
+        frame.to_parquet(output, index=False)
+    else:
+        frame.to_csv(sys.stdout if output == "-" else output, index=False)
+
+
+def throughput(field_count, elapsed, workers):
+    """Fields analyzed per second per worker process"""
+    return field_count / max(elapsed, 1e-9) / workers
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze a fleet of fields over one regional scene")
+    parser.add_argument("fields", nargs="?", help="GeoJSON FeatureCollection of field polygons or circles")
+    parser.add_argument("-o", "--output", default="-", help="Output file (.parquet or .csv), '-' for CSV on stdout")
+    parser.add_argument("--manifest", help="Sentinel-2 scene manifest covering the fields (default: simulated scene)")
+    parser.add_argument("--demo-fields", type=int, help="Generate this many random fields instead of reading a file")
+    parser.add_argument("--demo-location", default="Punjab (Wheat Belt)", choices=[name for name in LOCATION_OPTIONS if name != "Select a location"])
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--fields-per-task", type=int, default=FIELDS_PER_TASK)
+    parser.add_argument("--resolution", type=float, default=DEFAULT_RESOLUTION_DEG, help="Simulated pixel size in degrees")
+    parser.add_argument("--no-cloud-masking", action="store_true", help="Disable QA60 cloud masking")
+    parser.add_argument("--cloud-coverage", type=float, default=0.2, help="Simulated cloud coverage (0-1)")
+    parser.add_argument("--cloud-size", type=int, default=10, help="Simulated cloud cluster size in pixels")
+    parser.add_argument("--cloud-handling", choices=CLOUD_HANDLING_METHODS, default=CLOUD_HANDLING_METHODS[0])
+    parser.add_argument("--gap-fill", choices=list(GAP_FILL_METHODS), default=DEFAULT_GAP_FILL_METHOD)
+    parser.add_argument("--seed", type=int, help="Seed for the simulated scene and demo fields")
+    parser.add_argument("--target", type=float, default=TARGET_FIELDS_PER_SECOND_PER_CORE,
+                        help="Throughput target in fields per second per core")
+    parser.add_argument("--scaling", action="store_true", help="Repeat the run with 1, 2, 4, ... workers and report scaling")
+    args = parser.parse_args(argv)
+    # Checked before the run, which would otherwise only fail once every field is analyzed
+    if args.output.endswith(".parquet") and not parquet_supported():
+        parser.error("Writing Parquet needs pyarrow or fastparquet (pip install pyarrow); "
+                     "install one or write a .csv output instead")
+
+    if args.demo_fields:
+        collection = synthetic_fields(LOCATION_OPTIONS[args.demo_location], args.demo_fields, args.seed)
+        aois = [{"name": feature["properties"]["name"], "feature": feature} for feature in collection["features"]]
+    elif args.fields:
+        aois = [aoi for aoi in load_aois(args.fields) if "feature" in aoi]
+        if not aois:
+            parser.error("The fields file must be a GeoJSON FeatureCollection")
+    else:
+        parser.error("Pass a fields GeoJSON or --demo-fields")
+
+    scene_bounds = region_bounds([aoi["feature"] for aoi in aois])
+    ndvi, cloud_mask, scene_bounds = load_region_scene(scene_bounds, args.manifest, args.resolution,
+                                                       args.cloud_coverage, args.cloud_size, args.seed)
+    if args.no_cloud_masking:
+        cloud_mask = None
+    options = {"cloud_handling": args.cloud_handling, "gap_fill_method": args.gap_fill}
+
+    worker_counts = [args.workers]
+    if args.scaling:
+        worker_counts = sorted({min(2**i, args.workers) for i in range(args.workers.bit_length() + 1)})
+
+    # Fields per second of a single worker, the reference for speedup and efficiency
+    single_worker_rate = None
+    for workers in worker_counts:
+        frame, elapsed = run_fleet(aois, ndvi, cloud_mask, scene_bounds, options, workers, args.fields_per_task)
+        rate = throughput(len(frame), elapsed, workers)
+        if workers == 1:
+            single_worker_rate = rate
+        summary = (f"{len(frame)} fields on a {ndvi.shape[0]}x{ndvi.shape[1]} scene with {workers} workers: "
+                   f"{elapsed:.2f} s, {rate:.1f} fields/s/core")
+        if single_worker_rate is not None:
+            speedup = rate * workers / single_worker_rate
+            summary += f", speedup {speedup:.2f}x ({speedup / workers:.0%} efficiency)"
+        print(summary, file=sys.stderr)
+
+    write_frame(frame, args.output)
+    if rate < args.target:
+        print(f"Throughput {rate:.1f} fields/s/core is below the target of {args.target:g}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+import numpy as np
+
+# scipy.ndimage is imported inside the fill functions: it takes longer to import than
+# the rest of the app's modules together and is only needed for the Interpolate method
+
+# Size of the averaging kernel used by the kernel-mean and normalized convolution fills
+INTERPOLATION_KERNEL_SIZE = 5
+
+# Weight below which a pixel counts as having no valid neighbours
+MIN_WEIGHT = 1e-6
+
+
+def fill_kernel_mean(ndvi, invalid):
+    """
+    Fill invalid pixels with the mean of the surrounding 5x5 window.
+
+    This is the original simplified approach: invalid pixels are averaged in
+    as zeros, so values near clouds are biased low and the centre of clouds
+    wider than the kernel becomes ~0.
+
+    Args:
+        ndvi: NDVI data array
+        invalid: Boolean mask of pixels to fill
+
+    Returns:
+        Filled copy of ndvi
+    """
+    from scipy import ndimage
+
+    filled = ndvi.copy()
+    kernel = np.ones((INTERPOLATION_KERNEL_SIZE, INTERPOLATION_KERNEL_SIZE)) / INTERPOLATION_KERNEL_SIZE**2
+    filled[invalid] = 0  # Replace invalid pixels with 0 temporarily for convolution
+
+    # Convolve with the kernel
+    smoothed = ndimage.convolve(filled, kernel, mode='reflect')
+
+    # Only use the interpolated values for invalid pixels
+    filled[invalid] = smoothed[invalid]
+    return filled
+
+
+def _downsample_sums(array):
+    """Sum 2x2 blocks, zero-padding odd edges"""
+    height, width = array.shape
+    padded = np.pad(array, ((0, height % 2), (0, width % 2)))
+    return padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2).sum(axis=(1, 3))
+
+
+def _normalized_estimate(weighted_values, weights, kernel_size):
+    """
+    Normalized convolution at one pyramid level, with holes filled from coarser levels.
+
+    Args:
+        weighted_values: Sum of value * weight per pixel
+        weights: Sum of weights per pixel
+        kernel_size: Averaging window size
+
+    Returns:
+        Estimate for every pixel of this level
+    """
+    from scipy import ndimage
+
+    numerator = ndimage.uniform_filter(weighted_values, kernel_size, mode='reflect')
+    denominator = ndimage.uniform_filter(weights, kernel_size, mode='reflect')
+
+    estimate = np.zeros_like(numerator)
+    has_support = denominator > MIN_WEIGHT
+    np.divide(numerator, denominator, out=estimate, where=has_support)
+
+    holes = ~has_support
+    if holes.any() and max(weights.shape) > 1 and weights.sum() > MIN_WEIGHT:
+        # Each level is a quarter of the size, so the whole pyramid costs O(N)
+        coarse = _normalized_estimate(_downsample_sums(weighted_values), _downsample_sums(weights), kernel_size)
+        upsampled = np.repeat(np.repeat(coarse, 2, axis=0), 2, axis=1)[:weights.shape[0], :weights.shape[1]]
+        estimate[holes] = upsampled[holes]
+    return estimate
+
+
+def fill_normalized_convolution(ndvi, invalid, kernel_size=INTERPOLATION_KERNEL_SIZE):
+    """
+    Fill invalid pixels by normalized convolution over a multi-scale pyramid.
+
+    The convolved values are divided by the convolved validity mask, so only
+    valid neighbours contribute. Pixels without any valid neighbour in the
+    window take the estimate from the next coarser level, which fills
+    arbitrarily large holes in linear time.
+
+    Args:
+        ndvi: NDVI data array
+        invalid: Boolean mask of pixels to fill
+        kernel_size: Averaging window size at each level
+
+    Returns:
+        Filled copy of ndvi
+    """
+    weights = (~invalid).astype(np.float64)
+    weighted_values = np.where(invalid, 0.0, ndvi)
+
+    filled = ndvi.copy()
+    if weights.any():
+        filled[invalid] = _normalized_estimate(weighted_values, weights, kernel_size)[invalid]
+    return filled
+
+
+def fill_nearest(ndvi, invalid):
+    """
+    Fill invalid pixels with the value of the nearest valid pixel.
+
+    Uses the indices returned by ndimage.distance_transform_edt.
+
+    Args:
+        ndvi: NDVI data array
+        invalid: Boolean mask of pixels to fill
+
+    Returns:
+        Filled copy of ndvi
+    """
+    if not invalid.any() or invalid.all():
+        return ndvi.copy()
+    from scipy import ndimage
+
+    nearest_rows, nearest_cols = ndimage.distance_transform_edt(
+        invalid, return_distances=False, return_indices=True)
+    return ndvi[nearest_rows, nearest_cols]
+
+
+# Gap filling methods offered for the "Interpolate" cloud handling method
+GAP_FILL_METHODS = {
+    "Normalized Convolution": fill_normalized_convolution,
+    "Nearest Valid": fill_nearest,
+    "Kernel Mean (5x5)": fill_kernel_mean,
+}
+
+DEFAULT_GAP_FILL_METHOD = "Normalized Convolution"
+
+
+def fill_gaps(ndvi, invalid, method=DEFAULT_GAP_FILL_METHOD):
+    """Fill invalid pixels with one of the GAP_FILL_METHODS"""
+    try:
+        fill = GAP_FILL_METHODS[method]
+    except KeyError:
+        raise ValueError(f"Unknown gap filling method: {method}") from None
+    return fill(ndvi, invalid)
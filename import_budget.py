@@ -0,0 +1,127 @@
+"""
+Import-time report and startup budget check for the Streamlit app.
+
+The app module is imported in a fresh interpreter with `python -X importtime`
+and the per-module times are parsed into a table. The command exits non-zero
+when the import takes longer than the budget, or when a module that the app
+only needs on demand (scipy, pandas, ...) is imported at startup.
+
+Example:
+    python import_budget.py
+    python import_budget.py --budget-ms 1500 --top 25
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+# Module whose import is a cold start of the app
+APP_MODULE = "main_simplified"
+
+# Wall time allowed for importing the app, in milliseconds
+STARTUP_BUDGET_MS = float(os.environ.get("CROP_HEALTH_STARTUP_BUDGET_MS", 2000))
+
+# Packages imported only by the code paths that use them, never at startup
+DEFERRED_PACKAGES = ("scipy", "pandas", "matplotlib", "PIL", "rasterio", "pyarrow", "folium.plugins")
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def parse_importtime(stderr):
+    """
+    Parse `python -X importtime` output.
+
+    Returns:
+        List of dicts with module, depth, self_us and cumulative_us, in import order
+    """
+    records = []
+    for line in stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            records.append({
+                "module": match[4],
+                "depth": (len(match[3]) - 1) // 2,
+                "self_us": int(match[1]),
+                "cumulative_us": int(match[2]),
+            })
+    return records
+
+
+def measure_imports(module=APP_MODULE, repeat=3):
+    """
+    Import a module in fresh interpreters and keep the fastest run.
+
+    Args:
+        module: Module to import
+        repeat: Number of interpreters started; the first also warms the bytecode cache
+
+    Returns:
+        Records of the fastest run (see parse_importtime())
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    best, best_total = None, None
+    for _ in range(max(1, repeat)):
+        completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                   cwd=directory, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise RuntimeError(f"Importing {module} failed:\n{completed.stderr[-2000:]}")
+        records = parse_importtime(completed.stderr)
+        total = sum(record["cumulative_us"] for record in records if record["depth"] == 0)
+        if best_total is None or total < best_total:
+            best, best_total = records, total
+    return best
+
+
+def check_budget(records, budget_ms=STARTUP_BUDGET_MS, deferred=DEFERRED_PACKAGES):
+    """
+    Problems with an import run.
+
+    Returns:
+        List of messages; empty when the run is within budget
+    """
+    problems = []
+    total_ms = sum(record["cumulative_us"] for record in records if record["depth"] == 0) / 1000
+    if total_ms > budget_ms:
+        problems.append(f"startup imports took {total_ms:.0f} ms, over the {budget_ms:.0f} ms budget")
+    imported = {record["module"] for record in records}
+    for package in deferred:
+        if package in imported:
+            problems.append(f"{package} is imported at startup; import it where it is used")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report the app's import times and check the startup budget")
+    parser.add_argument("--module", default=APP_MODULE, help="Module to import")
+    parser.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS, help="Allowed total import time")
+    parser.add_argument("--top", type=int, default=15, help="Slowest modules listed")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh interpreters started; the fastest is kept")
+    args = parser.parse_args(argv)
+
+    records = measure_imports(args.module, args.repeat)
+    total_ms = sum(record["cumulative_us"] for record in records if record["depth"] == 0) / 1000
+
+    # Top-level packages first, then the slowest individual modules by their own time
+    packages = {}
+    for record in records:
+        package = record["module"].split(".")[0]
+        packages[package] = packages.get(package, 0) + record["self_us"]
+    print(f"{'package':<32}{'ms':>10}{'share':>9}")
+    for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{package:<32}{self_us / 1000:>10.1f}{self_us / 1000 / max(total_ms, 1e-9):>9.1%}")
+    print()
+    print(f"{'module':<48}{'self ms':>10}{'cumul ms':>10}")
+    for record in sorted(records, key=lambda record: -record["self_us"])[:args.top]:
+        print(f"{record['module']:<48}{record['self_us'] / 1000:>10.1f}{record['cumulative_us'] / 1000:>10.1f}")
+    print()
+    print(f"Total import time of {args.module}: {total_ms:.0f} ms (budget {args.budget_ms:.0f} ms)")
+
+    problems = check_budget(records, args.budget_ms)
+    for problem in problems:
+        print(f"OVER BUDGET {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
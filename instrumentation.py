@@ -0,0 +1,184 @@
+import contextlib
+import contextvars
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+
+# Where the app appends its per-run metrics; a local Prometheus node_exporter
+# textfile collector can be pointed at this directory
+METRICS_DIRECTORY = os.environ.get(
+    "CROP_HEALTH_METRICS_DIR", os.path.join(tempfile.gettempdir(), "crop_health_metrics"))
+METRICS_JSONL = "stages.jsonl"
+METRICS_PROM = "crop_health.prom"
+
+# Prometheus metric name and help text per recorded field
+PROMETHEUS_METRICS = {
+    "wall_seconds": ("crop_health_stage_wall_seconds", "Wall time of the analysis stage in the last run"),
+    "cpu_seconds": ("crop_health_stage_cpu_seconds", "CPU time of the thread running the analysis stage in the last run"),
+    "peak_bytes": ("crop_health_stage_peak_bytes", "Peak traced memory above the stage start in the last run"),
+    "allocated_bytes": ("crop_health_stage_allocated_bytes", "Traced memory still held when the stage ended in the last run"),
+}
+
+# Shared no-op context returned while profiling is off
+_NULL_STAGE = contextlib.nullcontext()
+
+_active_profiler = contextvars.ContextVar("active_profiler", default=None)
+
+# Stages open across all profilers and threads; tracemalloc runs while any is
+# open and is stopped by the last one to close if a stage started it
+_tracing_lock = threading.Lock()
+_open_stages = 0
+_started_tracing = False
+
+
+class StageProfiler:
+    """
+    Records wall time, CPU time and traced memory of named pipeline stages.
+
+    Memory is traced with tracemalloc (NumPy reports its array buffers to it),
+    which is only started while a stage is open. Stages may nest; a parent's
+    peak includes its children. CPU time is that of the calling thread, so
+    profilers in concurrent jobs do not count each other's work.
+
+    tracemalloc's counters are process-wide. The peak is reset when a stage
+    opens only if no other profiler has a stage open; while stages of several
+    profilers overlap, peaks include the other threads' allocations and are
+    upper bounds.
+
+    When disabled, stage() returns a shared no-op context manager, so
+    instrumented code costs one attribute check.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.records = []
+        self._open = []
+
+    def stage(self, name):
+        """Context manager measuring one stage"""
+        if not self.enabled:
+            return _NULL_STAGE
+        return self._measure(name)
+
+    @contextlib.contextmanager
+    def _measure(self, name):
+        global _open_stages, _started_tracing
+        with _tracing_lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _started_tracing = True
+            current, peak = tracemalloc.get_traced_memory()
+            if self._open:
+                # Keep the parent's peak so far before the counter is reset for this stage
+                self._open[-1]["peak"] = max(self._open[-1]["peak"], peak)
+            if _open_stages == len(self._open):
+                tracemalloc.reset_peak()
+                peak = current
+            _open_stages += 1
+        entry = {"start_bytes": current, "peak": current}
+        self._open.append(entry)
+
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.thread_time() - cpu_start
+            with _tracing_lock:
+                current, peak = tracemalloc.get_traced_memory()
+                _open_stages -= 1
+                if not _open_stages and _started_tracing:
+                    tracemalloc.stop()
+                    _started_tracing = False
+            self._open.pop()
+            peak = max(entry["peak"], peak)
+            if self._open:
+                self._open[-1]["peak"] = max(self._open[-1]["peak"], peak)
+            self.records.append({
+                "stage": name,
+                "depth": len(self._open),
+                "wall_seconds": wall,
+                "cpu_seconds": cpu,
+                "peak_bytes": peak - entry["start_bytes"],
+                "allocated_bytes": current - entry["start_bytes"],
+            })
+
+    def total_wall_seconds(self):
+        """Wall time of the top-level stages"""
+        return sum(record["wall_seconds"] for record in self.records if record["depth"] == 0)
+
+    def write_jsonl(self, path, **labels):
+        """
+        Append one JSON line per recorded stage.
+
+        Args:
+            path: JSON lines file
+            **labels: Extra fields written on every line (e.g. location_name)
+        """
+        timestamp = time.time()
+        with open(path, "a", encoding="utf-8") as f:
+            for record in self.records:
+                f.write(json.dumps({"timestamp": timestamp, **labels, **record}) + "\n")
+
+    def write_prometheus(self, path):
+        """
+        Write the stages as Prometheus text-format gauges.
+
+        The file is replaced atomically so a scraper never reads a partial
+        file. Repeated stage names (e.g. nested calls) are summed.
+        """
+        totals = {}
+        for record in self.records:
+            stage_totals = totals.setdefault(record["stage"], dict.fromkeys(PROMETHEUS_METRICS, 0))
+            for field in PROMETHEUS_METRICS:
+                stage_totals[field] += record[field]
+
+        lines = []
+        for field, (metric, help_text) in PROMETHEUS_METRICS.items():
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} gauge")
+            for stage, stage_totals in totals.items():
+                lines.append(f'{metric}{{stage="{stage}"}} {stage_totals[field]:.6g}')
+
+        # A unique temporary name, so profilers exporting at the same time do not share it;
+        # mkstemp makes it owner-only, but the collector may run as another user
+        fd, temporary_path = tempfile.mkstemp(
+            dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".", suffix=".tmp")
+        try:
+            os.fchmod(fd, 0o644)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+    def export(self, directory=METRICS_DIRECTORY, **labels):
+        """Append the JSON lines log and rewrite the Prometheus file in directory"""
+        if not self.records:
+            return
+        os.makedirs(directory, exist_ok=True)
+        self.write_jsonl(os.path.join(directory, METRICS_JSONL), **labels)
+        self.write_prometheus(os.path.join(directory, METRICS_PROM))
+
+
+def set_profiler(profiler):
+    """Make profiler the one used by profile_stage() in the current context"""
+    return _active_profiler.set(profiler)
+
+
+def profile_stage(name):
+    """
+    Measure a stage with the active profiler, if any.
+
+    Library code wraps its stages with this so that profiling is decided by
+    the caller (the app or a CLI) without passing a profiler around.
+    """
+    profiler = _active_profiler.get()
+    if profiler is None:
+        return _NULL_STAGE
+    return profiler.stage(name)
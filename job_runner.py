@@ -0,0 +1,222 @@
+"""
+Background analysis jobs.
+
+Jobs run on a thread pool (NumPy releases the GIL in the heavy array work)
+with a JobProgress installed as their profiler, so the profile_stage() calls
+already in the pipeline report the running stage and are where a cancelled
+job stops. Finished jobs stay in an LRU keyed by their inputs, so rerunning
+with the same inputs returns the result without recomputing.
+"""
+import concurrent.futures
+import contextvars
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from instrumentation import StageProfiler, set_profiler
+
+# Jobs computed at the same time across all sessions
+JOB_WORKERS = 2
+
+# Finished jobs kept for instant re-rendering
+RESULT_CACHE_SIZE = 8
+
+
+class JobCancelled(Exception):
+    """Raised inside a job at the next stage boundary after it was cancelled"""
+
+
+def job_key(inputs):
+    """Stable key of a job's inputs (any JSON-serializable structure)"""
+    encoded = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
+class JobProgress(StageProfiler):
+    """
+    Profiler of a background job that tracks the running stage.
+
+    Entering a stage raises JobCancelled once the job was cancelled. Stage
+    timings are only recorded when profiling is enabled.
+    """
+
+    def __init__(self, stage_labels, enabled=False):
+        """
+        Args:
+            stage_labels: Ordered mapping of the pipeline's stage names to
+                user-facing labels; other stages do not move the progress
+            enabled: Whether to record stage timings and memory
+        """
+        super().__init__(enabled)
+        self.stage_labels = stage_labels
+        self.cancel_event = threading.Event()
+        self.current_stage = None
+
+    def stage(self, name):
+        if self.cancel_event.is_set():
+            raise JobCancelled(name)
+        if name in self.stage_labels:
+            self.current_stage = name
+        return super().stage(name)
+
+    @property
+    def fraction(self):
+        """Share of the pipeline's stages started so far"""
+        if self.current_stage is None:
+            return 0.0
+        return list(self.stage_labels).index(self.current_stage) / len(self.stage_labels)
+
+    @property
+    def label(self):
+        """Label of the running stage"""
+        return self.stage_labels.get(self.current_stage, "Starting")
+
+
+class AnalysisJob:
+    """One submitted job: its future, progress and the owners waiting for it"""
+
+    def __init__(self, key, owner, progress):
+        self.key = key
+        self.owners = {owner}
+        self.progress = progress
+        self.submitted = time.time()
+        self.future = None
+
+    def done(self):
+        return self.future.done()
+
+    def cancelled(self):
+        """Whether the job was cancelled before it finished"""
+        if self.future.cancelled():
+            return True
+        return self.future.done() and isinstance(self.future.exception(), JobCancelled)
+
+    def failed(self):
+        """Whether the job ended with an error other than cancellation"""
+        return self.future.done() and not self.cancelled() and self.future.exception() is not None
+
+    def cancel(self):
+        """Stop the job at its next stage boundary (or before it starts)"""
+        self.progress.cancel_event.set()
+        self.future.cancel()
+
+    def result(self):
+        """The job's return value; raises its exception if it failed"""
+        return self.future.result()
+
+
+class JobRunner:
+    """
+    Runs jobs in the background and keeps finished ones by input key.
+
+    Each session passes an owner id; sessions submitting the same inputs
+    share one job. Submitting a job, or calling cancel_stale() with the key of
+    the current inputs, withdraws the owner from its other unfinished jobs,
+    and a job is cancelled once no owner wants it any more.
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS, cache_size=RESULT_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, owner, key, function, *args, stage_labels=None, profile=False, **kwargs):
+        """
+        Start function(*args, **kwargs) in the background, or reuse the job for key.
+
+        A finished or running job with the same key is returned as is, with
+        owner added to the owners waiting for it; failed and cancelled jobs
+        are replaced.
+
+        Args:
+            owner: Id of the session submitting the job
+            key: Key of the job's inputs (see job_key())
+            function: Job function
+            stage_labels: Ordered stage name to label mapping for progress
+            profile: Whether to record stage timings in job.progress.records
+
+        Returns:
+            AnalysisJob
+        """
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and not (job.cancelled() or job.failed()):
+                self._jobs.move_to_end(key)
+                job.owners.add(owner)
+            else:
+                job = AnalysisJob(key, owner, JobProgress(stage_labels or {}, enabled=profile))
+                # A fresh context per job so the profiler is only seen by this job
+                job.future = self._executor.submit(
+                    contextvars.Context().run, self._run, job, function, args, kwargs)
+                self._jobs[key] = job
+                self._evict()
+        self.cancel_stale(owner, key)
+        return job
+
+    @staticmethod
+    def _run(job, function, args, kwargs):
+        set_profiler(job.progress)
+        return function(*args, **kwargs)
+
+    def _evict(self):
+        """Drop the oldest finished jobs beyond the cache size"""
+        finished = [key for key, job in self._jobs.items() if job.done()]
+        for key in finished[:max(0, len(finished) - self.cache_size)]:
+            del self._jobs[key]
+
+    def get(self, key):
+        """Job for key, if one was submitted and is still kept"""
+        with self._lock:
+            return self._jobs.get(key)
+
+    @staticmethod
+    def _withdraw(job, owner):
+        """Remove owner from an unfinished job and cancel it if nobody else wants it; True if cancelled"""
+        job.owners.discard(owner)
+        if job.owners:
+            return False
+        job.cancel()
+        return True
+
+    def withdraw(self, owner, key):
+        """
+        Withdraw the owner from the unfinished job for key.
+
+        The job is cancelled unless another owner still waits for it; a
+        cancelled job is kept so that job.cancelled() can be shown.
+
+        Returns:
+            True if the job was cancelled
+        """
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is None or job.done() or owner not in job.owners:
+                return False
+            return self._withdraw(job, owner)
+
+    def cancel_stale(self, owner, current_key):
+        """
+        Withdraw the owner from its unfinished jobs whose inputs are no longer current.
+
+        Jobs that another owner still waits for keep running.
+
+        Returns:
+            Number of jobs cancelled
+        """
+        with self._lock:
+            stale = [job for key, job in self._jobs.items()
+                     if owner in job.owners and key != current_key and not job.done()]
+            cancelled = 0
+            for job in stale:
+                if self._withdraw(job, owner):
+                    del self._jobs[job.key]
+                    cancelled += 1
+        return cancelled
+
+    def wait(self, job, timeout):
+        """Wait up to timeout seconds for a job; True once it is done"""
+        concurrent.futures.wait([job.future], timeout=timeout)
+        return job.done()
@@ -1,91 +1,65 @@
 import streamlit as st
+import copy
+import os
+import sqlite3
+import uuid
 import numpy as np
-from PIL import Image
-import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
 import folium
-from folium.plugins import Draw, MousePosition
-from streamlit_folium import st_folium, folium_static
+from streamlit_folium import st_folium
 import json
-from matplotlib.colors import LinearSegmentedColormap
-import matplotlib.patches as mpatches
-import pandas as pd
-from scipy import ndimage
+from ndvi_rendering import NDVI_PALETTE, NODATA_PALETTE_INDEX, paletted_image
+from ndvi_classification import CLOUD_COLOR
+from crop_analysis import LOCATION_OPTIONS, NDVI_CLASSES, NDVI_CLASS_LUT, CLOUD_HANDLING_METHODS, get_health_status, circle_bounds, feature_bounds
+from sentinel_ingest import aoi_row_reader, aoi_window_bounds, load_scene_manifest, read_aoi
+from aoi_mask import geometry_key, rasterize_feature
+from ndvi_charts import health_history_chart, ndvi_histogram_chart
+from tile_server import TileServer
+from pipeline_cache import AnalysisPipeline
+from job_runner import JobRunner, job_key
+from spatial_index import FieldIndex, Region, viewport_bounds
+from result_store import ResultStore, area_feature, make_thumbnail
+from instrumentation import METRICS_DIRECTORY, StageProfiler, profile_stage, set_profiler
+from gap_filling import GAP_FILL_METHODS, DEFAULT_GAP_FILL_METHOD
+from management_zones import ZONE_METHODS, zones_geojson
+from change_detection import CHANGE_CATEGORIES, CHANGE_NODATA_INDEX, CHANGE_PALETTE, detect_change
+from synthetic_scene import SyntheticScene
+from temporal_composite import COMPOSITE_METHODS, SceneStack, acquisition_dates, collect_scenes, location_seed, simulate_scene_for_date, stack_directory
 
-# Define India's outline coordinates - simplified version
+# Simplified outline of India in GeoJSON [lon, lat] order
 INDIA_OUTLINE = [
-    [77.8369140625, 35.6037187406973],
-    [78.9111328125, 35.53222622770337],
-    [80.7275390625, 34.08877366134954],
-    [79.1455078125, 32.99023555965106],
-    [78.6767578125, 31.57853542647338],
-    [79.3798828125, 30.713503990354965],
-    [80.7275390625, 29.954934549656144],
-    [81.3720703125, 30.107117887092357],
-    [82.353515625, 30.107117887092357],
-    [83.583984375, 29.458731185355344],
-    [84.462890625, 28.613459424004414],
-    [85.869140625, 28.304380682962783],
-    [86.923828125, 27.994401411046148],
-    [88.2421875, 27.916766641249065],
-    [89.296875, 28.14950321154457],
-    [90.3515625, 28.14950321154457],
-    [91.58203125, 27.994401411046148],
-    [92.28515625, 27.059125784374068],
-    [93.251953125, 26.902476886279832],
-    [94.21875, 27.371767300523047],
-    [95.44921875, 26.902476886279832],
-    [96.15234375, 27.371767300523047],
-    [97.03125, 27.683528083787763],
-    [97.3828125, 28.613459424004414],
-    [98.876953125, 27.059125784374068],
-    [97.734375, 24.367113562651276],
-    [98.173828125, 23.885837699862005],
-    [98.876953125, 22.431340156360684],
-    [96.50390625, 21.94304553343818],
-    [95.625, 19.973348786110602],
-    [94.833984375, 17.644022027872712],
-    [94.7412109375, 15.961329081596647],
-    [93.8623046875, 15.282400104387573],
-    [92.8759765625, 12.382928338487396],
-    [93.1982421875, 10.833305983642491],
-    [94.482421875, 8.059229627200192],
-    [95.2734375, 8.407168163601076],
-    [95.361328125, 9.795677582829743],
-    [96.416015625, 8.754794702435618],
-    [96.767578125, 7.36246686553575],
-    [94.39453125, 6.751896464843375],
-    [92.197265625, 8.189742344299745],
-    [91.0986328125, 9.622414142924805],
-    [88.9013671875, 10.660607953624762],
-    [87.5927734375, 12.82866505819387],
-    [87.5927734375, 14.519780046326085],
-    [88.7109375, 15.961329081596647],
-    [88.4326171875, 17.14079039331665],
-    [87.1826171875, 17.56024650540857],
-    [85.1220703125, 19.394067895396613],
-    [83.1494140625, 20.715015145512098],
-    [81.82617187499999, 21.248422235627014],
-    [78.2666015625, 22.998851594142913],
-    [77.5634765625, 25.48295117535531],
-    [78.0322265625, 27.371767300523047],
-    [77.4609375, 29.916852233070173],
-    [76.9921875, 30.713503990354965],
-    [73.828125, 31.95216223802496],
-    [74.35546875, 33.65120829920497],
-    [74.8828125, 34.813802729634], 
-    [77.8369140625, 35.6037187406973]
+    # Western border from the Rann of Kutch to Kashmir
+    [68.2, 23.7], [68.8, 24.3], [70.0, 24.2], [71.0, 24.4], [70.6, 25.7], [70.1, 26.6],
+    [69.5, 27.0], [70.3, 27.8], [71.9, 27.9], [72.9, 29.0], [73.4, 29.9], [74.5, 30.9],
+    [74.55, 31.7], [75.3, 32.3], [74.6, 32.8], [74.1, 33.2], [73.8, 34.4], [74.3, 34.8],
+    [75.7, 34.6], [76.8, 35.3], [77.8, 35.5],
+    # Ladakh and the Himalayan border down to Nepal
+    [78.9, 35.5], [80.2, 35.2], [80.3, 34.1], [79.1, 33.0], [78.7, 31.6], [79.4, 30.7],
+    [81.0, 30.2],
+    # Southern border of Nepal, then Sikkim
+    [80.05, 28.85], [81.6, 27.9], [83.3, 27.35], [84.2, 27.5], [85.0, 26.9], [86.0, 26.6],
+    [87.1, 26.4], [88.1, 26.4], [88.1, 27.9], [88.8, 28.1], [88.9, 27.3],
+    # Bhutan and Arunachal Pradesh
+    [88.9, 26.9], [89.8, 26.7], [91.0, 26.8], [92.1, 26.9], [92.1, 27.8], [92.5, 27.9],
+    [93.9, 28.7], [95.4, 29.1], [96.2, 29.4], [97.3, 28.3], [97.4, 27.9], [96.9, 27.3],
+    # Border with Myanmar
+    [95.2, 26.6], [94.7, 25.5], [94.15, 23.85], [93.4, 23.2], [93.1, 22.2], [92.6, 21.98],
+    # Around Bangladesh
+    [92.25, 23.2], [91.6, 22.95], [91.15, 23.6], [91.2, 24.15], [92.3, 24.25], [92.0, 24.95],
+    [91.0, 25.2], [89.85, 25.3], [89.85, 25.95], [89.1, 26.4], [88.6, 26.4], [88.1, 25.9],
+    [88.1, 24.8], [88.7, 24.2], [88.75, 23.2], [88.9, 22.4], [89.05, 21.75],
+    # East coast
+    [88.0, 21.6], [86.9, 21.3], [86.8, 20.5], [86.4, 19.9], [85.1, 19.3], [84.1, 18.3],
+    [82.3, 16.6], [81.3, 16.3], [80.3, 15.4], [80.4, 13.8], [80.3, 12.5], [79.85, 11.5],
+    [79.87, 10.3], [79.3, 9.3], [78.2, 8.8], [77.54, 8.08], [76.9, 8.4],
+    # West coast
+    [76.5, 8.9], [76.0, 10.5], [75.6, 11.8], [74.8, 12.9], [74.1, 14.5], [73.65, 15.9],
+    [73.3, 17.3], [72.7, 19.3], [72.7, 20.5], [72.6, 21.0], [71.0, 20.7], [70.0, 21.2],
+    [69.0, 22.3], [69.6, 22.9], [68.4, 23.5], [68.2, 23.7],
 ]
 
-# Predefined locations for easy selection
-LOCATION_OPTIONS = {
-    "Select a location": {"lat": 20.5937, "lon": 78.9629, "zoom": 5},  # Default - India
-    "Punjab (Wheat Belt)": {"lat": 30.9010, "lon": 75.8573, "zoom": 8},
-    "Karnataka (Coffee Region)": {"lat": 12.9716, "lon": 75.6099, "zoom": 9},
-    "Maharashtra (Cotton Belt)": {"lat": 20.7128, "lon": 77.0020, "zoom": 8},
-    "Tamil Nadu (Rice Fields)": {"lat": 11.1271, "lon": 78.6569, "zoom": 8},
-    "Uttar Pradesh (Sugarcane Region)": {"lat": 28.0000, "lon": 79.0000, "zoom": 8},
-}
+# Used to check that selections are in India
+INDIA_REGION = Region(INDIA_OUTLINE)
 
 # Major cities for reference
 MAJOR_CITIES = {
@@ -97,117 +71,422 @@ MAJOR_CITIES = {
     "Hyderabad": (17.3850, 78.4867)
 }
 
-# Define NDVI classification thresholds and categories
-NDVI_CLASSES = {
-    (-0.2, 0.0): {"label": "Water/Non-Vegetation", "color": [0, 0, 128], "description": "Bodies of water, bare soil, or artificial surfaces"},
-    (0.0, 0.2): {"label": "Sparse Vegetation", "color": [255, 165, 0], "description": "Very sparse vegetation, stressed crops, or barren areas"},
-    (0.2, 0.4): {"label": "Moderate Vegetation", "color": [255, 255, 0], "description": "Moderate vegetation, potentially with mild stress or early growth stages"},
-    (0.4, 0.6): {"label": "Good Vegetation", "color": [144, 238, 144], "description": "Healthy vegetation with good leaf area coverage"},
-    (0.6, 0.9): {"label": "Dense Vegetation", "color": [0, 128, 0], "description": "Very healthy, dense vegetation with optimal photosynthetic activity"}
+# Pipeline stages shown as analysis progress, in the order they run
+ANALYSIS_STAGE_LABELS = {
+    "source": "Loading the scene",
+    "read_aoi": "Reading Sentinel-2 bands",
+    "composite": "Building the temporal composite",
+    "cloud_mask": "Preparing the QA60 cloud mask",
+    "scene": "Rasterizing the area",
+    "handled": "Handling clouds",
+    "classification": "Classifying vegetation",
+    "statistics": "Computing statistics",
+    "zones": "Delineating management zones",
+    "render": "Rendering maps",
+    "change_detection": "Comparing the two dates",
 }
 
-def simulate_qa60_cloud_mask(shape, cloud_coverage=0.2, cloud_size=10):
+# Pixel grid of the simulated single scenes and composite acquisitions
+SIMULATED_SHAPE = (100, 100)
+
+# How often a waiting run refreshes the progress bar (seconds)
+JOB_POLL_SECONDS = 0.25
+
+# Cloud mask display colors: light gray for clear pixels, cornflower blue for clouds
+CLOUD_MASK_PALETTE = np.array([[240, 240, 240], [100, 149, 237]], dtype=np.uint8)
+
+def legend_swatch_html(color, label, detail):
+    """Legend entry HTML: a colored box, a bold label and a detail line; the area share is filled in per run"""
+    color = 'rgb({}, {}, {})'.format(*color)
+    return f"""
+                    <div style="
+                        background-color: {color}; 
+                        width: 20px; 
+                        height: 20px; 
+                        display: inline-block;
+                        margin-right: 5px;
+                        "></div>
+                    <span><b>{label}</b></span>
+                    <br><span>{detail}</span>
+                    <br><span style="font-size: 0.8em;">{{percentage:.1f}}% of area</span>
+                    """
+
+# Classification legend entries in NDVI order, built once per process
+CLASS_LEGEND = [
+    (class_info["label"], legend_swatch_html(class_info["color"], class_info["label"], f"NDVI: {min_val:.1f} to {max_val:.1f}"),
+     class_info["description"])
+    for (min_val, max_val), class_info in sorted(NDVI_CLASSES.items())
+]
+CLOUD_LEGEND_HTML = legend_swatch_html(CLOUD_COLOR, "Clouds", "QA60 Band")
+
+def change_category_detail(lower, upper):
+    """ΔNDVI range of a change category for its legend entry"""
+    if lower is None:
+        return f"ΔNDVI below {upper:+.2f}"
+    if not np.isfinite(upper):
+        return f"ΔNDVI {lower:+.2f} and above"
+    return f"ΔNDVI {lower:+.2f} to {upper:+.2f}"
+
+# Change category legend entries from loss to gain
+CHANGE_LEGEND = [
+    (label, legend_swatch_html(color, label, change_category_detail(lower, upper)))
+    for (label, upper, color), lower in zip(CHANGE_CATEGORIES, [None] + [upper for _, upper, _ in CHANGE_CATEGORIES[:-1]])
+]
+
+@st.cache_resource
+def build_base_map(drawing_tools=False):
     """
-    Simulate QA60 band from Sentinel-2 for cloud masking.
+    Build the static base map once per process.
+    
+    The India outline, city markers and (optionally) the drawing plugins never
+    change between reruns, so the map is cached and only per-run overlays are
+    passed to st_folium as a separate feature group.
     
     Args:
-        shape: Tuple, shape of the image (height, width)
-        cloud_coverage: Float, percentage of the image covered by clouds (0-1)
-        cloud_size: Int, approximate size of cloud clusters in pixels
+        drawing_tools: Whether to add the Draw and MousePosition plugins
         
     Returns:
-        Binary mask where 1 = cloud, 0 = clear
+        folium.Map with the static layers
     """
-    height, width = shape
-    # Start with all clear
-    mask = np.zeros(shape, dtype=np.uint8)
-    
-    # Number of cloud clusters
-    num_clusters = int((height * width * cloud_coverage) / (cloud_size * cloud_size))
-    
-    # Create random cloud clusters
-    for _ in range(num_clusters):
-        # Random center for cloud cluster
-        center_y = np.random.randint(0, height)
-        center_x = np.random.randint(0, width)
-        
-        # Create cloud cluster with random radius
-        cluster_radius = np.random.randint(cloud_size//2, cloud_size)
-        
-        # Add cloud to mask
-        y_indices, x_indices = np.ogrid[:height, :width]
-        dist_from_center = np.sqrt((y_indices - center_y)**2 + (x_indices - center_x)**2)
+    m = folium.Map(
+        location=[20.5937, 78.9629],
+        zoom_start=5,
+        tiles="CartoDB positron"
+    )
+    
+    # Add India outline as a polygon
+    folium.Polygon(
+        locations=[[lat, lon] for lon, lat in INDIA_OUTLINE],
+        color='blue',
+        weight=2,
+        fill=True,
+        fill_color='#86c67c',
+        fill_opacity=0.2,
+        tooltip="India"
+    ).add_to(m)
+    
+    # Add major cities as markers
+    for city, (lat, lon) in MAJOR_CITIES.items():
+        folium.Marker(
+            [lat, lon],
+            tooltip=city,
+            icon=folium.Icon(icon="info", prefix="fa", color="blue")
+        ).add_to(m)
+    
+    # Add drawing tools for map selection
+    if drawing_tools:
+        from folium.plugins import Draw, MousePosition
         
-        # Core clouds (always cloudy)
-        core_cloud = dist_from_center <= cluster_radius * 0.7
-        mask[core_cloud] = 1
+        draw = Draw(
+            draw_options={
+                'polyline': False,
+                'circle': True,
+                'rectangle': True,
+                'polygon': True,
+                'marker': False,
+                'circlemarker': False,
+            },
+            edit_options={
+                'poly': {'allowIntersection': False}
+            }
+        )
+        draw.add_to(m)
         
-        # Cloud edges (partially cloudy with gradient)
-        cloud_edge = (dist_from_center > cluster_radius * 0.7) & (dist_from_center <= cluster_radius)
+        # Add mouse position display
+        MousePosition().add_to(m)
+    
+    return m
+
+
+def base_map(drawing_tools=False):
+    """
+    Copy of the cached base map for one run.
+    
+    st_folium adds the feature group it is given to the map itself, so the
+    cached map must never be passed to it: the run's layers (which may be
+    another session's) would end up in every later copy. A deep copy keeps
+    the element ids, so its HTML is the same on every rerun.
+    """
+    return copy.deepcopy(build_base_map(drawing_tools))
+
+
+@st.cache_resource
+def get_tile_server():
+    """Start the result tile server once per process"""
+    return TileServer().start()
+
+
+def warn_if_tiles_local(tile_server):
+    """Warn that result tiles will not load in a browser on another machine"""
+    if tile_server.local_only():
+        st.warning(
+            f"Map tiles are served from {tile_server.host}:{tile_server.port}, which only a browser on the "
+            "machine running the app can reach. If the result layers stay empty, set CROP_HEALTH_TILE_URL "
+            "to the tile server's public base URL, or CROP_HEALTH_TILE_HOST to an interface the browser can reach."
+        )
+
+
+def add_result_overlays(target, overlays, names=None):
+    """
+    Add served result rasters to a map or feature group as tile layers.
+    
+    Args:
+        target: folium.Map or FeatureGroup
+        overlays: Mapping of layer name to tile URL template
+        names: Layer names to add (all by default); the first one is shown
+    """
+    for i, name in enumerate(names or list(overlays)):
+        folium.TileLayer(
+            tiles=overlays[name],
+            attr="Crop health analysis",
+            name=name,
+            overlay=True,
+            control=True,
+            show=i == 0,
+            opacity=0.8,
+            max_zoom=19
+        ).add_to(target)
+
+
+@st.cache_resource
+def load_field_index(geojson_bytes):
+    """Spatial index of the fields in an uploaded GeoJSON FeatureCollection"""
+    return FieldIndex(json.loads(geojson_bytes)["features"])
+
+
+@st.cache_resource
+def get_analysis_pipeline():
+    """Memoized analysis stages shared by all sessions, bounded by PIPELINE_CACHE_BYTES"""
+    return AnalysisPipeline()
+
+
+@st.cache_resource
+def get_job_runner():
+    """Background analysis jobs shared by all sessions of the process"""
+    return JobRunner()
+
+
+@st.cache_resource
+def get_result_store():
+    """Local store of past analyses"""
+    return ResultStore()
+
+
+def run_change_detection(inputs):
+    """
+    Compare the scenes at the start and end of the date range over the selected area.
+    
+    Both scenes are read a chunk of rows at a time, so the area is not limited
+    by memory. Runs as a background job, so it must not call Streamlit.
+    
+    Args:
+        inputs: Analysis inputs collected from the sidebar and the map (see main())
         
-        # Random scatter at edges to make it look more natural
-        edge_rand = np.random.random(shape) < 0.7
-        mask[cloud_edge & edge_rand] = 1
+    Returns:
+        Dictionary with the ChangeResult, the bounds of the compared grid, the
+        AOI mask (or None) and a list of warnings to show
+    """
+    warnings = []
+    selected_area = inputs["selected_area"]
+    aoi_bounds = inputs["aoi_bounds"]
+    if inputs["data_source"] == "Sentinel-2 Files":
+        readers = []
+        for manifest_path in (inputs["start_scene_manifest"], inputs["scene_manifest"]):
+            manifest = load_scene_manifest(manifest_path)
+            if not manifest.get("qa60") and inputs["enable_cloud_masking"]:
+                warnings.append(f"{manifest_path} has no QA60 band, so no clouds are masked on its date.")
+            readers.append(aoi_row_reader(manifest, aoi_bounds))
+        (shape, _, read_before), (after_shape, scene_bounds, read_after) = readers
+        if shape != after_shape:
+            raise ValueError(f"The two scenes cover the area with different grids ({shape} and {after_shape} pixels)")
+    else:
+        # Simulated at 10 m, or coarser for large areas; the fields are seeded by location
+        scene = SyntheticScene.covering(aoi_bounds, seed=location_seed(selected_area["center"]))
+        shape, scene_bounds = scene.shape, scene.bounds
+        read_before = scene.row_reader(inputs["start_date"], inputs["cloud_coverage"], inputs["cloud_size"])
+        read_after = scene.row_reader(inputs["end_date"], inputs["cloud_coverage"], inputs["cloud_size"])
+    
+    if not inputs["enable_cloud_masking"]:
+        read_before, read_after = [lambda rows, read=read: (read(rows)[0], None) for read in (read_before, read_after)]
+    
+    aoi = None
+    if selected_area["type"] == "drawn":
+        try:
+            aoi = rasterize_feature(selected_area["drawn_features"], scene_bounds, shape)
+        except (KeyError, ValueError) as e:
+            warnings.append(f"Could not rasterize the drawn shape, comparing its bounding box: {e}")
     
-    return mask
+    with profile_stage("change_detection"):
+        # The change map is served as tiles, so it is kept in memory (one byte per pixel)
+        change = detect_change(shape, read_before, read_after, NDVI_CLASS_LUT, aoi_mask=aoi, change_map=True)
+    return {"change": change, "bounds": scene_bounds, "aoi": aoi, "warnings": warnings}
 
-def apply_cloud_mask(ndvi, cloud_mask, mask_value=-0.3):
+
+def show_change_detection(analysis, location_name, start_date, end_date):
+    """Show a change detection result: metrics, change categories, class transitions and the change map"""
+    change = analysis["change"]
+    for message in analysis["warnings"]:
+        st.warning(message)
+    
+    st.subheader(f"NDVI Change for {location_name}")
+    st.write(f"From {start_date} to {end_date}; pixels cloudy on either date are not compared")
+    if change.valid_pixels == 0:
+        st.warning("No pixel is clear on both dates, so nothing could be compared.")
+        return
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Mean ΔNDVI", f"{change.delta_stats['mean']:+.3f}")
+    with col2:
+        st.metric("Std Dev", f"{change.delta_stats['std']:.3f}")
+    with col3:
+        st.metric("Compared Pixels", f"{change.valid_pixels:,}")
+    with col4:
+        st.metric("Cloudy on Either Date", f"{change.cloud_percentage:.1f}%")
+    
+    category_percentages = change.category_percentages
+    legend_cols = st.columns(len(CHANGE_LEGEND))
+    for col, (label, html) in zip(legend_cols, CHANGE_LEGEND):
+        with col:
+            st.markdown(html.format(percentage=category_percentages[label]), unsafe_allow_html=True)
+    
+    with profile_stage("render_change_map"):
+        change_image = paletted_image(change.change_indices, CHANGE_PALETTE)
+    st.image(change_image, caption="NDVI Change (Red = Loss, Green = Gain, Blue = Cloud on Either Date)",
+             use_container_width=True)
+    
+    st.subheader("Class Transitions")
+    st.caption("Share of each start-date class (rows) found in each end-date class (columns), in percent")
+    st.dataframe(change.transition_table(), use_container_width=True)
+    
+    # Served as tiles like the single-date results; pixels outside the area stay transparent
+    tile_server = get_tile_server()
+    change_overlays = {"NDVI Change": tile_server.tile_url(tile_server.add_layer(
+        change.change_indices, CHANGE_PALETTE, analysis["bounds"], CHANGE_NODATA_INDEX))}
+    min_lon, min_lat, max_lon, max_lat = analysis["bounds"]
+    warn_if_tiles_local(tile_server)
+    change_map = folium.Map(tiles="CartoDB positron")
+    change_map.fit_bounds([[min_lat, min_lon], [max_lat, max_lon]])
+    add_result_overlays(change_map, change_overlays)
+    folium.LayerControl(collapsed=False).add_to(change_map)
+    st_folium(change_map, width=700, height=450, returned_objects=[], key="change_map")
+
+
+def show_performance(profiler, location_name):
+    """Export the run's stage profile and show it in a Performance panel"""
+    if not profiler.enabled:
+        return
+    # Also appended as JSON lines and exported for a local Prometheus scraper
+    profiler.export(location_name=location_name)
+    with st.expander("Performance"):
+        st.write(f"Total: {profiler.total_wall_seconds() * 1000:.1f} ms in top-level stages")
+        st.table([
+            {
+                "Stage": "  " * record["depth"] + record["stage"],
+                "Wall (ms)": f"{record['wall_seconds'] * 1000:.1f}",
+                "CPU (ms)": f"{record['cpu_seconds'] * 1000:.1f}",
+                "Peak (MB)": f"{record['peak_bytes'] / 2**20:.2f}",
+                "Allocated (MB)": f"{record['allocated_bytes'] / 2**20:.2f}",
+            }
+            for record in profiler.records
+        ])
+        st.caption(f"Metrics written to {METRICS_DIRECTORY}")
+
+
+def run_analysis(inputs):
     """
-    Apply cloud mask to NDVI data
+    Load the scene for the selected area and analyze it.
+    
+    Runs as a background job, so it must not call Streamlit; messages for the
+    user are returned instead.
     
     Args:
-        ndvi: NDVI data array
-        cloud_mask: Binary mask (1 = cloud, 0 = clear)
-        mask_value: Value to assign to cloudy pixels
+        inputs: Analysis inputs collected from the sidebar and the map (see main())
         
     Returns:
-        Masked NDVI array
+        Dictionary with the AnalysisResult, its rendered maps (see
+        AnalysisPipeline.run()), the bounds of the analyzed grid, the AOI mask
+        (or None), the composite dates (or None) and a list of warnings to show
     """
-    # Make a copy to avoid modifying the original
-    masked_ndvi = ndvi.copy()
-    
-    # Set cloudy pixels to mask_value
-    masked_ndvi[cloud_mask == 1] = mask_value
-    
-    return masked_ndvi
-
-def classify_ndvi(ndvi_value):
-    """Classify NDVI value into vegetation categories"""
-    for (min_val, max_val), class_info in NDVI_CLASSES.items():
-        if min_val <= ndvi_value < max_val:
-            return class_info
-    # Default fallback - use the last class if the value is above our highest threshold
-    if ndvi_value >= 0.9:
-        return NDVI_CLASSES[(0.6, 0.9)]
-    # Or the first class if it's below our lowest threshold
-    return NDVI_CLASSES[(-0.2, 0.0)]
-
-def create_ndvi_colormap():
-    """Create a custom colormap for NDVI visualization"""
-    colors = []
-    positions = []
-    
-    # Sort thresholds
-    sorted_thresholds = sorted(NDVI_CLASSES.items())
-    
-    # Create normalized positions and corresponding colors
-    min_ndvi = -0.2
-    max_ndvi = 0.9
-    ndvi_range = max_ndvi - min_ndvi
-    
-    for (min_val, max_val), class_info in sorted_thresholds:
-        # Normalize the threshold values to [0, 1]
-        pos_min = (min_val - min_ndvi) / ndvi_range
-        pos_max = (max_val - min_ndvi) / ndvi_range
+    if inputs["analysis_mode"] == "Change Detection":
+        return run_change_detection(inputs)
+    
+    warnings = []
+    selected_area = inputs["selected_area"]
+    aoi_bounds = inputs["aoi_bounds"]
+    area_center = selected_area["center"]
+    cloud_coverage, cloud_size = inputs["cloud_coverage"], inputs["cloud_size"]
+    load_scene = source_key = composite_dates = None
+    # Simulated scenes cover the selected area exactly
+    scene_bounds = aoi_bounds
+    if inputs["data_source"] == "Sentinel-2 Files":
+        manifest = inputs["scene_manifest"]
+        # The window read is snapped to scene pixels; everything is placed by its bounds
+        scene_bounds = aoi_window_bounds(manifest, aoi_bounds)
+        
+        def read_scene():
+            # Read only the window covering the selected area
+            with profile_stage("read_aoi"):
+                scene_ndvi, scene_cloud_mask, _ = read_aoi(manifest, aoi_bounds)
+            if scene_cloud_mask is None and inputs["enable_cloud_masking"]:
+                warnings.append("The scene has no QA60 band, so no clouds are masked.")
+                scene_cloud_mask = np.zeros(scene_ndvi.shape, dtype=np.uint8)
+            return scene_ndvi, scene_cloud_mask
         
-        # Convert RGB [0-255] to [0-1] for matplotlib
-        color = [c/255 for c in class_info["color"]]
+        load_scene = read_scene
+        source_key = ["sentinel", manifest, os.path.getmtime(manifest), aoi_bounds]
+    elif inputs["analysis_mode"] == "Temporal Composite":
+        composite_dates = acquisition_dates(inputs["start_date"], inputs["end_date"])
         
-        if len(colors) == 0:
-            positions.append(pos_min)
-            colors.append(color)
+        def build_composite():
+            # Stack every acquisition in the date range on disk; only new dates are simulated.
+            # The stack takes its shape from the scenes and may be shared with concurrent jobs
+            stack = SceneStack(stack_directory(center=area_center, shape=SIMULATED_SHAPE,
+                                               cloud_coverage=cloud_coverage, cloud_size=cloud_size))
+            with profile_stage("composite"):
+                collect_scenes(stack, composite_dates, lambda d: simulate_scene_for_date(
+                    SIMULATED_SHAPE, d, location_seed(area_center), cloud_coverage, cloud_size))
+                
+                # Pixels that were never clear remain as clouds in the composite
+                scene_ndvi = stack.composite(inputs["composite_method"], composite_dates)
+            return scene_ndvi, np.isnan(scene_ndvi).astype(np.uint8)
+        
+        load_scene = build_composite
+        source_key = ["composite", inputs["composite_method"], composite_dates, area_center, cloud_coverage, cloud_size]
+    
+    # Restrict the analysis to the pixels inside a drawn shape
+    aoi = aoi_key = None
+    if selected_area["type"] == "drawn":
+        def rasterize_aoi(scene_shape):
+            try:
+                return rasterize_feature(selected_area["drawn_features"], scene_bounds, scene_shape)
+            except (KeyError, ValueError) as e:
+                warnings.append(f"Could not rasterize the drawn shape, analyzing its bounding box: {e}")
+                return None
         
-        positions.append(pos_max)
-        colors.append(color)
+        aoi = rasterize_aoi
+        aoi_key = [geometry_key(selected_area["drawn_features"]), scene_bounds]
     
-    return LinearSegmentedColormap.from_list('ndvi_cmap', list(zip(positions, colors)))
\ No newline at end of file
+    # Stages whose inputs did not change (e.g. the scene and clouds when only the
+    # cloud handling changed) are reused; the simulated field is seeded by location
+    with profile_stage("analysis"):
+        analysis = get_analysis_pipeline().run(
+            center=area_center,
+            location_name=inputs["location_name"],
+            shape=SIMULATED_SHAPE,
+            cloud_masking=inputs["enable_cloud_masking"],
+            cloud_coverage=cloud_coverage,
+            cloud_size=cloud_size,
+            cloud_handling=inputs["cloud_handling"],
+            gap_fill_method=inputs["gap_fill_method"],
+            seed=location_seed(area_center),
+            load_scene=load_scene,
+            source_key=source_key,
+            aoi=aoi,
+            aoi_key=aoi_key,
+            zone_method=inputs["zone_method"],
+            bounds=scene_bounds
+        )
+    aoi_mask = analysis["result"].scene.aoi_mask if aoi is not None else None
+    return {**analysis, "bounds": scene_bounds, "aoi": aoi_mask, "composite_dates": composite_dates,
+            "warnings": warnings}
@@ -17,6 +17,10 @@ def main():
         initial_sidebar_state="expanded"
     )
     
+    # Per-stage timing and memory of this run, switched on from the sidebar
+    profiler = StageProfiler(enabled=st.session_state.get("profile_performance", False))
+    set_profiler(profiler)
+    
     # App header
     st.title("Crop Health Monitoring System")
     st.markdown("""
@@ -132,54 +136,23 @@ def main():
         st.session_state.drawn_features = None
         st.rerun()
     
+    # Field boundaries are indexed once; only the fields in the current view go to the map
+    field_file = st.sidebar.file_uploader("Field Boundaries (GeoJSON)", type=["geojson", "json"])
+    field_index = None
+    if field_file is not None:
+        try:
+            field_index = load_field_index(field_file.getvalue())
+        except (ValueError, KeyError, TypeError) as e:
+            st.sidebar.error(f"Could not read field boundaries: {e}")
+    
     # Map View section with Leaflet maps
     st.subheader("Map View")
     
-    # Create a folium map
-    m = folium.Map(
-        location=[center_lat, center_lon],
-        zoom_start=zoom,
-        tiles="CartoDB positron"
-    )
+    # Static base layers are built once per process; each rerun gets its own copy
+    m = base_map(selection_method == "Map Selection")
     
-    # Add India outline as a polygon
-    folium.Polygon(
-        locations=INDIA_OUTLINE,
-        color='blue',
-        weight=2,
-        fill=True,
-        fill_color='#86c67c',
-        fill_opacity=0.2,
-        tooltip="India"
-    ).add_to(m)
-    
-    # Add major cities as markers
-    for city, (lat, lon) in MAJOR_CITIES.items():
-        folium.Marker(
-            [lat, lon],
-            tooltip=city,
-            icon=folium.Icon(icon="info", prefix="fa", color="blue")
-        ).add_to(m)
-    
-    # Add drawing tools for map selection
-    if selection_method == "Map Selection":
-        draw = Draw(
-            draw_options={
-                'polyline': False,
-                'circle': True,
-                'rectangle': True,
-                'polygon': True,
-                'marker': False,
-                'circlemarker': False,
-            },
-            edit_options={
-                'poly': {'allowIntersection': False}
-            }
-        )
-        draw.add_to(m)
-        
-        # Add mouse position display
-        MousePosition().add_to(m)
+    # Per-run overlays are sent to the map as a small delta layer
+    selection_layer = folium.FeatureGroup(name="Selected Area")
     
     # For predefined locations, add circle marker showing selected area
     if selection_method == "Predefined Locations":
@@ -191,20 +164,18 @@ def main():
             fill_color='red',
             fill_opacity=0.2,
             tooltip=f"{location_name}: {area_radius}° radius"
-        ).add_to(m)
+        ).add_to(selection_layer)
         
         # Add marker at center
         folium.Marker(
             [center_lat, center_lon],
             tooltip=f"Center: {center_lat:.4f}, {center_lon:.4f}",
             icon=folium.Icon(color="red", icon="info")
-        ).add_to(m)
+        ).add_to(selection_layer)
     
     # If we have drawn features, display them on the map
     if selection_method == "Map Selection" and st.session_state.drawn_features:
         try:
-            feature_group = folium.FeatureGroup(name="Selected Area")
-            
             # Add the drawn features as GeoJSON
             folium.GeoJson(
                 st.session_state.drawn_features,
@@ -214,25 +185,64 @@ def main():
                     'weight': 2,
                     'fillOpacity': 0.2
                 }
-            ).add_to(feature_group)
-            
-            feature_group.add_to(m)
+            ).add_to(selection_layer)
         except Exception as e:
             st.warning(f"Error displaying drawn area: {e}")
     
-    # Display the map with streamlit-folium
-    map_data = st_folium(
-        m, 
-        width=700,
-        height=500,
-        returned_objects=["last_active_drawing"],
-        key="map"
-    )
+    # Fields intersecting the last reported view (or an estimate of it before the first report)
+    if field_index is not None:
+        map_bounds = st.session_state.get("map_bounds") or viewport_bounds(center_lat, center_lon, zoom)
+        visible_fields, fields_in_view = field_index.in_view(map_bounds)
+        if visible_fields:
+            folium.GeoJson(
+                {"type": "FeatureCollection", "features": visible_fields},
+                style_function=lambda x: {
+                    'fillColor': '#ffd700',
+                    'color': '#b8860b',
+                    'weight': 1,
+                    'fillOpacity': 0.1
+                }
+            ).add_to(selection_layer)
+    
+    # The latest analysis result is drawn from the tile server
+    if st.session_state.get("result_overlays"):
+        add_result_overlays(selection_layer, st.session_state.result_overlays, ["Colorized NDVI"])
+    
+    # Display the map with streamlit-folium; the base map HTML is unchanged between
+    # reruns, so only the view and the selection layer are sent to the browser
+    with profile_stage("map"):
+        map_data = st_folium(
+            m, 
+            center=[center_lat, center_lon],
+            zoom=zoom,
+            feature_group_to_add=selection_layer,
+            width=700,
+            height=500,
+            returned_objects=["last_active_drawing"] + (["bounds"] if field_index is not None else []),
+            key="map"
+        )
+    
+    if field_index is not None:
+        if fields_in_view > len(visible_fields):
+            st.caption(f"Showing {len(visible_fields)} of {fields_in_view} fields in view ({len(field_index)} loaded). Zoom in to see them all.")
+        else:
+            st.caption(f"{fields_in_view} of {len(field_index)} fields in view.")
+        
+        # Load the fields of a new view
+        reported = (map_data or {}).get("bounds") or {}
+        south_west, north_east = reported.get("_southWest") or {}, reported.get("_northEast") or {}
+        if south_west.get("lat") is not None and north_east.get("lat") is not None:
+            view = (south_west["lng"], south_west["lat"], north_east["lng"], north_east["lat"])
+            if view != st.session_state.get("map_bounds"):
+                st.session_state.map_bounds = view
+                st.rerun()
     
     # Process map interactions
     if selection_method == "Map Selection" and map_data and "last_active_drawing" in map_data and map_data["last_active_drawing"]:
-        st.session_state.drawn_features = map_data["last_active_drawing"]
-        st.rerun()
+        # Only rerun when the drawing actually changed
+        if map_data["last_active_drawing"] != st.session_state.drawn_features:
+            st.session_state.drawn_features = map_data["last_active_drawing"]
+            st.rerun()
     
     # Map selection instructions
     if selection_method == "Map Selection":
@@ -264,6 +274,29 @@ def main():
     start_date = st.sidebar.date_input("Start Date", value=today - timedelta(days=30))
     end_date = st.sidebar.date_input("End Date", value=today)
     
+    # Data source: simulated scene or local Sentinel-2 band files
+    data_source = st.sidebar.radio("Data Source", ["Simulated", "Sentinel-2 Files"])
+    if data_source == "Sentinel-2 Files":
+        scene_manifest = st.sidebar.text_input(
+            "Scene manifest (JSON)",
+            help="JSON file listing the B4, B8 and QA60 band files (.npy, raw or GeoTIFF)"
+        )
+    
+    # Single scene, a cloud-free composite of every acquisition in the date range (simulated),
+    # or the change between the scenes at the start and end of the range
+    analysis_mode = st.sidebar.radio(
+        "Analysis Mode",
+        ["Single Scene", "Temporal Composite", "Change Detection"] if data_source == "Simulated"
+        else ["Single Scene", "Change Detection"]
+    )
+    if analysis_mode == "Temporal Composite":
+        composite_method = st.sidebar.selectbox("Composite Method", COMPOSITE_METHODS)
+    if analysis_mode == "Change Detection" and data_source == "Sentinel-2 Files":
+        start_scene_manifest = st.sidebar.text_input(
+            "Start date scene manifest (JSON)",
+            help="Scene compared against the one above, on the same grid"
+        )
+    
     # Add NDVI visualization options
     viz_options = st.sidebar.radio(
         "Visualization Type",
@@ -276,33 +309,135 @@ def main():
     enable_cloud_masking = st.sidebar.checkbox("Enable Cloud Masking (QA60)", value=True)
     
     if enable_cloud_masking:
-        cloud_coverage = st.sidebar.slider("Simulated Cloud Coverage", 0.0, 1.0, 0.2, 0.05)
-        cloud_size = st.sidebar.slider("Simulated Cloud Size", 5, 30, 10, 1)
+        if data_source == "Simulated":
+            cloud_coverage = st.sidebar.slider("Simulated Cloud Coverage", 0.0, 1.0, 0.2, 0.05)
+            cloud_size = st.sidebar.slider("Simulated Cloud Size", 5, 30, 10, 1)
+        else:
+            # Real scenes take their clouds from the QA60 band
+            cloud_coverage, cloud_size = 0.0, 10
         cloud_handling = st.sidebar.radio(
             "Cloud Handling Method",
-            ["Mask Clouds (Show)", "Remove Clouds (Hide)", "Interpolate"]
+            CLOUD_HANDLING_METHODS
         )
+    else:
+        cloud_coverage, cloud_size, cloud_handling = 0.0, 10, None
+    
+    gap_fill_method = DEFAULT_GAP_FILL_METHOD
+    if cloud_handling == "Interpolate":
+        gap_fill_method = st.sidebar.selectbox("Interpolation Method", list(GAP_FILL_METHODS.keys()))
+    
+    zone_method = st.sidebar.selectbox(
+        "Management Zones",
+        ZONE_METHODS,
+        help="Connected regions of each vegetation class, or a regular grid of cells over the area"
+    )
+    
+    st.sidebar.checkbox(
+        "Profile performance",
+        key="profile_performance",
+        help="Record time and memory of each analysis stage and show them in a Performance panel"
+    )
+    
+    # The area to analyze
+    if selection_method == "Predefined Locations":
+        selected_area = {
+            "center": {"lat": center_lat, "lon": center_lon},
+            "radius": area_radius,
+            "location_name": location_name,
+            "type": "circle"
+        }
+        aoi_bounds = circle_bounds(selected_area["center"], area_radius)
+    elif st.session_state.drawn_features:
+        selected_area = {
+            "drawn_features": st.session_state.drawn_features,
+            "center": {"lat": center_lat, "lon": center_lon},
+            "location_name": location_name,
+            "type": "drawn"
+        }
+        aoi_bounds = feature_bounds(st.session_state.drawn_features)
+    else:
+        selected_area = aoi_bounds = None
+    
+    # The outline is simplified, so selections outside it are flagged rather than refused
+    if selected_area is not None and not INDIA_REGION.contains_feature(area_feature(selected_area)):
+        st.sidebar.warning("The selected area lies (at least partly) outside India.")
+    
+    # Everything the analysis depends on; results are kept under the key of these inputs
+    analysis_inputs = {
+        "selected_area": selected_area,
+        "aoi_bounds": aoi_bounds,
+        "location_name": location_name,
+        "data_source": data_source,
+        "scene_manifest": scene_manifest if data_source == "Sentinel-2 Files" else None,
+        "start_scene_manifest": start_scene_manifest if analysis_mode == "Change Detection" and data_source == "Sentinel-2 Files" else None,
+        "analysis_mode": analysis_mode,
+        "composite_method": composite_method if analysis_mode == "Temporal Composite" else None,
+        "start_date": start_date,
+        "end_date": end_date,
+        "enable_cloud_masking": enable_cloud_masking,
+        "cloud_coverage": cloud_coverage,
+        "cloud_size": cloud_size,
+        "cloud_handling": cloud_handling,
+        "gap_fill_method": gap_fill_method,
+        "zone_method": zone_method,
+    }
+    analysis_key = job_key(analysis_inputs)
+    job_runner = get_job_runner()
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
     
     if st.sidebar.button("Analyze Area"):
-        # Save the selected area for analysis
-        if selection_method == "Predefined Locations":
-            selected_area = {
-                "center": {"lat": center_lat, "lon": center_lon},
-                "radius": area_radius,
-                "location_name": location_name,
-                "type": "circle"
-            }
-        else:
-            if not st.session_state.drawn_features:
-                st.sidebar.error("Please select an area on the map first")
-                return
-            
-            selected_area = {
-                "drawn_features": st.session_state.drawn_features,
-                "center": {"lat": center_lat, "lon": center_lon},
-                "location_name": location_name,
-                "type": "drawn"
-            }
+        if selected_area is None:
+            st.sidebar.error("Please select an area on the map first")
+            return
         
         # Store in session state
-        st.session_state.selected_area = selected_area
\ No newline at end of file
+        st.session_state.selected_area = selected_area
+        
+        # Runs in the background; an unchanged finished analysis is reused as is
+        st.session_state.withdrawn_key = None
+        job_runner.submit(
+            st.session_state.session_id, analysis_key, run_analysis, analysis_inputs,
+            stage_labels=ANALYSIS_STAGE_LABELS, profile=profiler.enabled
+        )
+    
+    # Inputs changed since the last submission: that analysis is no longer wanted
+    job_runner.cancel_stale(st.session_state.session_id, analysis_key)
+    
+    job = job_runner.get(analysis_key)
+    if job is not None:
+        # This session cancelled the job, which may still run for other sessions with the same inputs
+        withdrawn = st.session_state.get("withdrawn_key") == analysis_key
+        if not job.done() and not withdrawn:
+            # Widget changes rerun the script right away, which cancels the job if its inputs changed
+            progress_bar = st.progress(job.progress.fraction, text=job.progress.label)
+            if st.button("Cancel Analysis"):
+                job_runner.withdraw(st.session_state.session_id, analysis_key)
+                st.session_state.withdrawn_key = analysis_key
+                withdrawn = True
+            else:
+                while not job_runner.wait(job, JOB_POLL_SECONDS):
+                    progress_bar.progress(job.progress.fraction, text=job.progress.label)
+            progress_bar.empty()
+        
+        if job.cancelled() or (withdrawn and not job.done()):
+            st.info("Analysis cancelled. Click 'Analyze Area' to run it again.")
+            return
+        if job.failed():
+            error = job.future.exception()
+            if data_source == "Sentinel-2 Files":
+                st.error(f"Could not read Sentinel-2 bands: {error}")
+            else:
+                st.error(f"Analysis failed: {error}")
+            return
+        
+        # The job's stage timings join this run's the first time its result is shown
+        if job.progress.enabled and st.session_state.get("profiled_job") != job.key:
+            profiler.records.extend(job.progress.records)
+            st.session_state.profiled_job = job.key
+        
+        if analysis_mode == "Change Detection":
+            show_change_detection(job.result(), location_name, start_date, end_date)
+            show_performance(profiler, location_name)
+            return
+        
@@ -0,0 +1,238 @@
+"""
+Management zones: where each vegetation class is, not just how much of it.
+
+Zones are either the connected regions of each class (8-connected, labelled
+with scipy.ndimage.label) or the cells of a regular grid over the AOI. Pixel
+counts, NDVI sums, centroids and class counts of all zones come from a few
+bincount calls over the labelled pixels, so the cost stays linear in the
+pixel count however many zones there are. Zones are ranked by how much
+attention they need, and the top ones are listed and cited by the
+recommendations.
+"""
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from crop_analysis import HEALTH_WEIGHTS
+
+ZONE_METHODS = ["Connected Regions", "Grid Cells"]
+
+DEFAULT_ZONE_METHOD = "Connected Regions"
+
+# Cells per side of the AOI for the "Grid Cells" method
+GRID_CELLS_PER_SIDE = 8
+
+# Zones smaller than this are speckle and are not listed
+MIN_ZONE_PIXELS = 9
+
+# Zones of each class listed in the ranked table and the GeoJSON
+ZONES_PER_CLASS = 5
+
+# Diagonal neighbours belong to the same region
+_CONNECTIVITY = np.ones((3, 3), dtype=bool)
+
+_METERS_PER_DEGREE = 111000
+
+
+def label_class_zones(class_index, num_classes):
+    """
+    Label the connected regions of every vegetation class.
+
+    Args:
+        class_index: uint8 class index array; indices >= num_classes (clouds,
+            no-data) belong to no zone
+        num_classes: Number of vegetation classes
+
+    Returns:
+        (int32 labels with 0 = no zone and zones of class 0 first, zone count)
+    """
+    # Imported here so the app does not load scipy at startup
+    from scipy import ndimage
+
+    labels = np.zeros(class_index.shape, dtype=np.int32)
+    count = 0
+    # One labelling pass per class, however many regions each has
+    for class_id in range(num_classes):
+        class_labels, class_count = ndimage.label(class_index == class_id, structure=_CONNECTIVITY,
+                                                  output=np.int32)
+        np.add(class_labels, count, out=labels, where=class_labels > 0)
+        count += class_count
+    return labels, count
+
+
+def label_grid_cells(class_index, num_classes, cells_per_side=GRID_CELLS_PER_SIDE):
+    """
+    Label a cells_per_side x cells_per_side grid over the raster.
+
+    Returns:
+        (int32 labels with 0 for pixels without a vegetation class, cell count)
+    """
+    height, width = class_index.shape
+    row_cells = np.arange(height) * cells_per_side // height
+    col_cells = np.arange(width) * cells_per_side // width
+    labels = (row_cells[:, None] * cells_per_side + col_cells[None, :] + 1).astype(np.int32)
+    labels[class_index >= num_classes] = 0
+    return labels, cells_per_side * cells_per_side
+
+
+@dataclass
+class ManagementZones:
+    """Per-zone statistics in pixel space, indexed by zone label - 1"""
+    method: str
+    shape: tuple
+    class_labels: list
+    pixels: np.ndarray = field(repr=False)
+    ndvi_mean: np.ndarray = field(repr=False)
+    centroid_row: np.ndarray = field(repr=False)
+    centroid_col: np.ndarray = field(repr=False)
+    class_counts: np.ndarray = field(repr=False)
+
+    def __len__(self):
+        return len(self.pixels)
+
+    @property
+    def dominant_class(self):
+        """Index of the most frequent class of every zone"""
+        return self.class_counts.argmax(axis=1)
+
+    @property
+    def health(self):
+        """Health weight of every zone, averaged over its class mix (0-1)"""
+        weights = np.array([HEALTH_WEIGHTS[label] for label in self.class_labels])
+        return self.class_counts @ weights / np.maximum(self.pixels, 1)
+
+
+def zone_statistics(labels, count, ndvi, class_index, num_classes):
+    """
+    Area, mean NDVI, centroid and class counts of every zone in one pass.
+
+    Args:
+        labels: int32 zone labels (0 = no zone) from label_class_zones() or label_grid_cells()
+        count: Number of zones
+        ndvi: NDVI array of the same shape
+        class_index: Class index array of the same shape
+
+    Returns:
+        Dict of per-zone arrays (pixels, ndvi_mean, centroid_row,
+        centroid_col, class_counts)
+    """
+    flat_labels = labels.ravel()
+    inside = np.flatnonzero(flat_labels)
+    zone = flat_labels[inside] - 1
+    rows, cols = np.divmod(inside, labels.shape[1])
+
+    pixels = np.bincount(zone, minlength=count)
+    divisor = np.maximum(pixels, 1)
+    ndvi_sum = np.bincount(zone, weights=ndvi.ravel()[inside], minlength=count)
+    row_sum = np.bincount(zone, weights=rows, minlength=count)
+    col_sum = np.bincount(zone, weights=cols, minlength=count)
+    # Zone x class counts with a single bincount on combined indices
+    combined = zone.astype(np.int64) * num_classes + class_index.ravel()[inside]
+    class_counts = np.bincount(combined, minlength=count * num_classes).reshape(count, num_classes)
+    return {
+        "pixels": pixels,
+        "ndvi_mean": ndvi_sum / divisor,
+        "centroid_row": row_sum / divisor,
+        "centroid_col": col_sum / divisor,
+        "class_counts": class_counts,
+    }
+
+
+def delineate_zones(ndvi, class_index, class_lut, method=DEFAULT_ZONE_METHOD, cells_per_side=GRID_CELLS_PER_SIDE):
+    """
+    Split the classified raster into management zones.
+
+    Args:
+        ndvi: Cloud-handled NDVI array
+        class_index: Class index array (see Scene.class_index())
+        class_lut: Compiled class table (see ndvi_classification.compile_ndvi_classes())
+        method: One of ZONE_METHODS
+        cells_per_side: Grid size for "Grid Cells"
+
+    Returns:
+        ManagementZones
+    """
+    num_classes = len(class_lut["labels"])
+    if method == "Connected Regions":
+        labels, count = label_class_zones(class_index, num_classes)
+    elif method == "Grid Cells":
+        labels, count = label_grid_cells(class_index, num_classes, cells_per_side)
+    else:
+        raise ValueError(f"Unknown zone method: {method}")
+    stats = zone_statistics(labels, count, ndvi, class_index, num_classes)
+    return ManagementZones(method, class_index.shape, list(class_lut["labels"]), **stats)
+
+
+def pixel_area_ha(bounds, shape):
+    """Ground area of one pixel in hectares for a raster covering bounds"""
+    min_lon, min_lat, max_lon, max_lat = bounds
+    height_m = (max_lat - min_lat) * _METERS_PER_DEGREE
+    width_m = (max_lon - min_lon) * _METERS_PER_DEGREE * np.cos(np.radians((min_lat + max_lat) / 2))
+    return abs(height_m * width_m) / (shape[0] * shape[1]) / 10000
+
+
+def rank_zones(zones, bounds, min_pixels=MIN_ZONE_PIXELS, per_class=ZONES_PER_CLASS):
+    """
+    Zones most in need of attention, as records numbered by rank.
+
+    The largest zones of every (dominant) class are kept, so each class can
+    be cited. They are ordered by priority, the zone's area times its
+    shortfall from full health, so large stressed zones come first; ties go
+    to the lower mean NDVI.
+
+    Args:
+        zones: ManagementZones
+        bounds: (min_lon, min_lat, max_lon, max_lat) covered by the raster
+        min_pixels: Smallest zone listed
+        per_class: Zones kept per class
+
+    Returns:
+        List of dicts with zone (rank), class, class_pct, area_ha, area_pct,
+        mean_ndvi, lat and lon
+    """
+    eligible = np.flatnonzero(zones.pixels >= min_pixels)
+    dominant = zones.dominant_class[eligible]
+    kept = []
+    for class_id in range(len(zones.class_labels)):
+        candidates = eligible[dominant == class_id]
+        if len(candidates) > per_class:
+            # Selecting the largest is linear; only the kept zones get sorted
+            candidates = candidates[np.argpartition(-zones.pixels[candidates], per_class - 1)[:per_class]]
+        kept.append(candidates)
+    kept = np.concatenate(kept)
+    priority = zones.pixels[kept] * (1 - zones.health[kept])
+    order = kept[np.lexsort((zones.ndvi_mean[kept], -priority))]
+
+    min_lon, min_lat, max_lon, max_lat = bounds
+    height, width = zones.shape
+    area_ha = pixel_area_ha(bounds, zones.shape)
+    zoned_pixels = max(int(zones.pixels.sum()), 1)
+    dominant = zones.dominant_class[order]
+    records = []
+    for rank, (zone, class_id) in enumerate(zip(order, dominant), start=1):
+        records.append({
+            "zone": rank,
+            "class": zones.class_labels[class_id],
+            "class_pct": float(zones.class_counts[zone, class_id] / zones.pixels[zone] * 100),
+            "area_ha": float(zones.pixels[zone] * area_ha),
+            "area_pct": float(zones.pixels[zone] / zoned_pixels * 100),
+            "mean_ndvi": float(zones.ndvi_mean[zone]),
+            "lat": float(max_lat - (zones.centroid_row[zone] + 0.5) / height * (max_lat - min_lat)),
+            "lon": float(min_lon + (zones.centroid_col[zone] + 0.5) / width * (max_lon - min_lon)),
+        })
+    return records
+
+
+def zones_geojson(records):
+    """GeoJSON FeatureCollection of ranked zones as centroid points"""
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [record["lon"], record["lat"]]},
+                "properties": {key: value for key, value in record.items() if key not in ("lat", "lon")},
+            }
+            for record in records
+        ],
+    }
@@ -0,0 +1,174 @@
+import copy
+from functools import lru_cache
+
+import numpy as np
+
+from crop_analysis import NDVI_CLASSES
+from ndvi_classification import CLOUD_COLOR
+from ndvi_statistics import HISTOGRAM_EDGES
+
+# NDVI range spanned by the histogram color ramp
+NDVI_DISPLAY_RANGE = (-0.2, 0.9)
+
+HISTOGRAM_TITLE = "Distribution of NDVI Values (Excluding Clouds)"
+
+
+def rgb_to_hex(rgb):
+    """Convert an [r, g, b] color (0-255) to a "#rrggbb" string"""
+    return "#{:02x}{:02x}{:02x}".format(*(int(c) for c in rgb))
+
+
+def ndvi_ramp_colors(values):
+    """
+    Colors of NDVI values on the class color ramp.
+
+    Each class interval blends linearly from the previous class color at its
+    lower bound to its own color at its upper bound; values below the display
+    range are drawn in the cloud color.
+
+    Args:
+        values: Array of NDVI values
+
+    Returns:
+        List of "#rrggbb" strings
+    """
+    sorted_classes = sorted(NDVI_CLASSES.items())
+    positions = [sorted_classes[0][0][0]] + [max_val for (_, max_val), _ in sorted_classes]
+    colors = np.array([sorted_classes[0][1]["color"]] + [info["color"] for _, info in sorted_classes], dtype=float)
+
+    values = np.clip(np.asarray(values, dtype=float), None, NDVI_DISPLAY_RANGE[1])
+    rgb = np.stack([np.interp(values, positions, colors[:, channel]) for channel in range(3)], axis=1)
+    rgb[values < NDVI_DISPLAY_RANGE[0]] = CLOUD_COLOR
+    return [rgb_to_hex(np.round(color)) for color in rgb]
+
+
+# Bar colors are fixed by the bin edges, so they are computed once per process
+HISTOGRAM_BAR_COLORS = ndvi_ramp_colors(0.5 * (HISTOGRAM_EDGES[:-1] + HISTOGRAM_EDGES[1:]))
+
+
+@lru_cache(maxsize=None)
+def _static_histogram_layers(show_clouds):
+    """Threshold rules, their labels and the class legend; built once per setting"""
+    thresholds = [{"threshold": min_val} for (min_val, _) in sorted(NDVI_CLASSES) if min_val > NDVI_DISPLAY_RANGE[0]]
+    labels = [info["label"] for _, info in sorted(NDVI_CLASSES.items())]
+    colors = [rgb_to_hex(info["color"]) for _, info in sorted(NDVI_CLASSES.items())]
+    if show_clouds:
+        labels.append("Clouds (excluded)")
+        colors.append(rgb_to_hex(CLOUD_COLOR))
+
+    rules = {
+        "data": {"values": thresholds},
+        "mark": {"type": "rule", "color": "gray", "strokeDash": [4, 4], "opacity": 0.7},
+        "encoding": {"x": {"field": "threshold", "type": "quantitative"}},
+    }
+    rule_labels = {
+        "data": {"values": thresholds},
+        "mark": {"type": "text", "angle": 270, "align": "right", "baseline": "bottom", "y": 4, "dx": -2, "color": "gray"},
+        "encoding": {
+            "x": {"field": "threshold", "type": "quantitative"},
+            "text": {"field": "threshold", "type": "quantitative"},
+        },
+    }
+    # Invisible marks whose only purpose is the class color legend
+    legend = {
+        "data": {"values": [{"label": label} for label in labels]},
+        "mark": {"type": "square", "opacity": 0},
+        "encoding": {
+            "color": {
+                "field": "label",
+                "type": "nominal",
+                "scale": {"domain": labels, "range": colors},
+                "legend": {"title": None, "orient": "top-right", "symbolOpacity": 1},
+            },
+        },
+    }
+    return [rules, rule_labels, legend]
+
+
+def ndvi_histogram_chart(histogram, edges=HISTOGRAM_EDGES, show_clouds=False, height=300):
+    """
+    Vega-Lite spec of the NDVI histogram for st.vega_lite_chart().
+
+    The data is already binned (see NDVIStatistics.histogram()), so the chart
+    only carries one row per bin; everything else is reused between calls.
+
+    Args:
+        histogram: Pixel counts per bin
+        edges: Bin edges, HISTOGRAM_EDGES by default
+        show_clouds: Whether to list the cloud color in the legend
+        height: Chart height in pixels
+
+    Returns:
+        Dict with the chart spec
+    """
+    bar_colors = HISTOGRAM_BAR_COLORS if edges is HISTOGRAM_EDGES else ndvi_ramp_colors(0.5 * (edges[:-1] + edges[1:]))
+    bins = [
+        {"start": float(edges[i]), "end": float(edges[i + 1]), "count": int(count), "color": bar_colors[i]}
+        for i, count in enumerate(histogram)
+    ]
+    bars = {
+        "data": {"values": bins},
+        "mark": {"type": "bar", "opacity": 0.7},
+        "encoding": {
+            "x": {"field": "start", "type": "quantitative", "title": "NDVI Value",
+                  "scale": {"domain": [float(edges[0]), float(edges[-1])]}},
+            "x2": {"field": "end"},
+            "y": {"field": "count", "type": "quantitative", "title": "Pixel Count"},
+            "color": {"field": "color", "type": "nominal", "scale": None, "legend": None},
+            "tooltip": [
+                {"field": "start", "type": "quantitative", "title": "From", "format": ".3f"},
+                {"field": "end", "type": "quantitative", "title": "To", "format": ".3f"},
+                {"field": "count", "type": "quantitative", "title": "Pixels"},
+            ],
+        },
+    }
+    return {
+        "$schema": "https://vega.github.io/schema/vega-lite/v5.json",
+        "title": HISTOGRAM_TITLE,
+        "height": height,
+        # Bars carry literal colors while the legend uses the class scale
+        "resolve": {"scale": {"color": "independent"}, "legend": {"color": "independent"}},
+        "layer": [bars] + copy.deepcopy(_static_histogram_layers(show_clouds)),
+    }
+
+
+def health_history_chart(records, height=250):
+    """
+    Vega-Lite spec of an area's health score over time for st.vega_lite_chart().
+
+    Args:
+        records: Stored analyses, oldest first (see ResultStore.history())
+        height: Chart height in pixels
+
+    Returns:
+        Dict with the chart spec
+    """
+    values = [
+        {
+            "date": record["end_date"],
+            "health_score": record["health_score"],
+            "ndvi_mean": record["ndvi_mean"],
+            "cloud_percentage": record["cloud_percentage"],
+            "dominant_class": record["dominant_class"],
+        }
+        for record in records if record["health_score"] is not None
+    ]
+    return {
+        "$schema": "https://vega.github.io/schema/vega-lite/v5.json",
+        "title": "Health Score History",
+        "height": height,
+        "data": {"values": values},
+        "mark": {"type": "line", "point": True},
+        "encoding": {
+            "x": {"field": "date", "type": "temporal", "title": "Analysis End Date"},
+            "y": {"field": "health_score", "type": "quantitative", "title": "Health Score (%)",
+                  "scale": {"domain": [0, 100]}},
+            "tooltip": [
+                {"field": "date", "type": "temporal", "title": "Date"},
+                {"field": "health_score", "type": "quantitative", "title": "Health Score", "format": ".1f"},
+                {"field": "ndvi_mean", "type": "quantitative", "title": "Mean NDVI", "format": ".2f"},
+                {"field": "cloud_percentage", "type": "quantitative", "title": "Cloud %", "format": ".1f"},
+                {"field": "dominant_class", "type": "nominal", "title": "Dominant Class"},
+            ],
+        },
+    }
@@ -0,0 +1,94 @@
+import numpy as np
+
+# Value written into NDVI arrays for cloud pixels in "Mask Clouds (Show)" mode
+CLOUD_MASK_VALUE = -0.3
+
+# Display colors for the extra (non-vegetation) classes
+CLOUD_COLOR = [200, 200, 255]  # Light blue for shown clouds
+NODATA_COLOR = [255, 255, 255]  # White for removed clouds (NaN)
+
+# Number of pixels classified per block, keeps temporaries small on large scenes
+CLASSIFY_BLOCK_SIZE = 1 << 20
+
+
+def compile_ndvi_classes(ndvi_classes):
+    """
+    Compile an NDVI threshold scheme into a lookup table for array classification.
+
+    Args:
+        ndvi_classes: Dict mapping (min, max) NDVI intervals to class info dicts
+            with at least "label" and "color" keys (same layout as NDVI_CLASSES)
+
+    Returns:
+        Dict with the sorted bin edges, the bin-to-class table, class labels,
+        an RGB palette and the indices of the extra cloud and no-data classes
+    """
+    intervals = list(ndvi_classes.items())
+    num_classes = len(intervals)
+
+    # Values below every interval take the lowest class, values above every
+    # interval the highest
+    lowest_class = min(range(num_classes), key=lambda i: intervals[i][0])
+    highest_class = max(range(num_classes), key=lambda i: intervals[i][0])
+
+    # Every interval boundary becomes a bin edge
+    edges = np.array(sorted({bound for (min_val, max_val), _ in intervals for bound in (min_val, max_val)}))
+
+    # Bin k (from searchsorted with side="right") covers edges[k-1] <= x < edges[k]
+    bin_to_class = np.full(len(edges) + 1, lowest_class, dtype=np.uint8)
+    bin_to_class[-1] = highest_class
+    for k in range(1, len(edges)):
+        # Where intervals overlap, the first in ndvi_classes order wins
+        for i, ((min_val, max_val), _) in enumerate(intervals):
+            if min_val <= edges[k - 1] and edges[k] <= max_val:
+                bin_to_class[k] = i
+                break
+
+    palette = np.array(
+        [class_info["color"] for _, class_info in intervals] + [CLOUD_COLOR, NODATA_COLOR],
+        dtype=np.uint8
+    )
+
+    return {
+        "edges": edges,
+        "bin_to_class": bin_to_class,
+        "labels": [class_info["label"] for _, class_info in intervals],
+        "palette": palette,
+        "cloud_index": num_classes,
+        "nodata_index": num_classes + 1,
+    }
+
+
+def classify_ndvi_array(ndvi, class_lut, cloud_value=CLOUD_MASK_VALUE, out=None):
+    """
+    Classify a whole NDVI array using a compiled lookup table.
+
+    Args:
+        ndvi: NDVI data array (NaN = removed cloud, <= cloud_value = shown cloud)
+        class_lut: Lookup table from compile_ndvi_classes()
+        cloud_value: Values at or below this are treated as shown clouds
+        out: Optional preallocated uint8 array with the same shape as ndvi
+
+    Returns:
+        uint8 array of class indices; cloud and NaN pixels get the
+        class_lut["cloud_index"] and class_lut["nodata_index"] classes
+    """
+    if out is None:
+        out = np.empty(ndvi.shape, dtype=np.uint8)
+
+    flat_ndvi = ndvi.reshape(-1)
+    flat_out = out.reshape(-1)
+
+    for start in range(0, flat_ndvi.size, CLASSIFY_BLOCK_SIZE):
+        block = flat_ndvi[start:start + CLASSIFY_BLOCK_SIZE]
+        block_out = flat_out[start:start + CLASSIFY_BLOCK_SIZE]
+
+        bins = np.searchsorted(class_lut["edges"], block, side="right")
+        np.take(class_lut["bin_to_class"], bins, out=block_out)
+
+        # Extra classes for clouds; NaN compares False so it is handled separately
+        block_out[block <= cloud_value] = class_lut["cloud_index"]
+        block_out[np.isnan(block)] = class_lut["nodata_index"]
+
+    return out
+
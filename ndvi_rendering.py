@@ -0,0 +1,94 @@
+import io
+
+import numpy as np
+
+from ndvi_classification import CLOUD_MASK_VALUE, CLOUD_COLOR, NODATA_COLOR
+
+# Palette layout: 254 NDVI levels spanning 0..1, then two reserved entries
+NDVI_LEVELS = 254
+CLOUD_PALETTE_INDEX = 254
+NODATA_PALETTE_INDEX = 255
+
+# Number of pixels rendered per block, bounds the float temporaries
+RENDER_BLOCK_SIZE = 1 << 20
+
+
+def build_ndvi_palette():
+    """
+    Build the 256-entry RGB palette used for NDVI colorization.
+
+    Levels follow the original red/green ramp (red = 1 - NDVI, green = NDVI),
+    with the last two entries reserved for shown and removed clouds.
+
+    Returns:
+        uint8 array of shape (256, 3)
+    """
+    levels = np.arange(NDVI_LEVELS) / (NDVI_LEVELS - 1)
+    palette = np.zeros((256, 3), dtype=np.uint8)
+    palette[:NDVI_LEVELS, 0] = np.clip((1 - levels) * 255, 0, 255).astype(np.uint8)  # Red
+    palette[:NDVI_LEVELS, 1] = np.clip(levels * 255, 0, 255).astype(np.uint8)  # Green
+    palette[CLOUD_PALETTE_INDEX] = CLOUD_COLOR
+    palette[NODATA_PALETTE_INDEX] = NODATA_COLOR
+    return palette
+
+
+# Precomputed once per process
+NDVI_PALETTE = build_ndvi_palette()
+
+
+def quantize_ndvi(ndvi, cloud_value=CLOUD_MASK_VALUE, out=None):
+    """
+    Quantize NDVI values into palette indices.
+
+    Args:
+        ndvi: NDVI data array (NaN = removed cloud, <= cloud_value = shown cloud)
+        cloud_value: Values at or below this are treated as shown clouds
+        out: Optional preallocated uint8 array with the same shape as ndvi
+
+    Returns:
+        uint8 array of indices into NDVI_PALETTE
+    """
+    if out is None:
+        out = np.empty(ndvi.shape, dtype=np.uint8)
+
+    flat_ndvi = ndvi.reshape(-1)
+    flat_out = out.reshape(-1)
+    scaled = np.empty(min(flat_ndvi.size, RENDER_BLOCK_SIZE), dtype=np.float32)
+
+    for start in range(0, flat_ndvi.size, RENDER_BLOCK_SIZE):
+        block = flat_ndvi[start:start + RENDER_BLOCK_SIZE]
+        block_out = flat_out[start:start + RENDER_BLOCK_SIZE]
+        block_scaled = scaled[:block.size]
+
+        # Round to the nearest level; values outside 0..1 saturate like np.clip did
+        np.multiply(block, NDVI_LEVELS - 1, out=block_scaled)
+        block_scaled += 0.5
+        np.clip(block_scaled, 0, NDVI_LEVELS - 1, out=block_scaled)
+        with np.errstate(invalid="ignore"):
+            np.copyto(block_out, block_scaled, casting="unsafe")
+
+        block_out[block <= cloud_value] = CLOUD_PALETTE_INDEX
+        block_out[np.isnan(block)] = NODATA_PALETTE_INDEX
+
+    return out
+
+
+def paletted_image(indices, palette):
+    """
+    Wrap a uint8 index array as a "P" mode PIL image.
+
+    The index buffer is shared with the image rather than copied.
+    """
+    # PIL is imported on first render rather than at app startup
+    from PIL import Image
+
+    image = Image.fromarray(np.ascontiguousarray(indices))
+    image.putpalette(palette.reshape(-1).tobytes())
+    return image
+
+
+def image_to_png_bytes(image, compress_level=6):
+    """Encode a PIL image as PNG bytes for sending to the browser"""
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=compress_level)
+    return buffer.getvalue()
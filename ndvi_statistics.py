@@ -0,0 +1,161 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+
+# Fine histogram used for percentiles: 0.001 NDVI wide bins over the full NDVI range
+FINE_HISTOGRAM_RANGE = (-1.0, 1.0)
+FINE_HISTOGRAM_BINS = 2000
+
+# Display histogram bin edges over the NDVI display range; each bin is exactly
+# 55 fine bins, so it is summed from the fine histogram instead of binned again
+HISTOGRAM_EDGES = np.linspace(-0.2, 0.9, 21)
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+# Number of pixels reduced per block, keeps temporaries small on large scenes
+STATISTICS_BLOCK_SIZE = 1 << 18
+
+_FINE_BIN_WIDTH = (FINE_HISTOGRAM_RANGE[1] - FINE_HISTOGRAM_RANGE[0]) / FINE_HISTOGRAM_BINS
+_DISPLAY_FIRST_BIN = int(round((HISTOGRAM_EDGES[0] - FINE_HISTOGRAM_RANGE[0]) / _FINE_BIN_WIDTH))
+_DISPLAY_BIN_SPAN = int(round((HISTOGRAM_EDGES[1] - HISTOGRAM_EDGES[0]) / _FINE_BIN_WIDTH))
+
+
+@dataclass
+class NDVIStatistics:
+    """
+    Mergeable NDVI statistics gathered in one pass over the pixels.
+
+    Sums, extremes, a fine histogram (for percentiles and the display
+    histogram) and class counts are accumulated block by block, so a whole
+    scene, a tile or a worker's share of tiles can be reduced independently
+    and the partial results merged.
+    """
+    class_lut: dict = field(repr=False)
+    total_pixels: int = 0
+    cloud_pixels: int = 0
+    valid_count: int = 0
+    valid_sum: float = 0.0
+    valid_sum_sq: float = 0.0
+    valid_min: float = np.inf
+    valid_max: float = -np.inf
+    fine_histogram: np.ndarray = field(default=None, repr=False)
+    class_counts: np.ndarray = field(default=None, repr=False)
+
+    def __post_init__(self):
+        if self.fine_histogram is None:
+            self.fine_histogram = np.zeros(FINE_HISTOGRAM_BINS, dtype=np.int64)
+        if self.class_counts is None:
+            self.class_counts = np.zeros(len(self.class_lut["palette"]), dtype=np.int64)
+
+    def update(self, masked_ndvi, valid_mask, class_index=None, cloud_mask=None):
+        """
+        Accumulate pixels (a whole scene or one tile).
+
+        Args:
+            masked_ndvi: NDVI array after cloud handling
+            valid_mask: Boolean mask of the pixels counted in the NDVI statistics
+            class_index: Optional class index array from classify_ndvi_array()
+            cloud_mask: Optional binary cloud mask
+
+        Returns:
+            self
+        """
+        flat_ndvi = masked_ndvi.reshape(-1)
+        flat_valid = valid_mask.reshape(-1)
+        flat_class = None if class_index is None else class_index.reshape(-1)
+        flat_cloud = None if cloud_mask is None else cloud_mask.reshape(-1)
+        self.total_pixels += flat_ndvi.size
+
+        for start in range(0, flat_ndvi.size, STATISTICS_BLOCK_SIZE):
+            window = slice(start, start + STATISTICS_BLOCK_SIZE)
+            valid = flat_valid[window]
+            if flat_class is not None:
+                self.class_counts += np.bincount(flat_class[window], minlength=len(self.class_counts))
+            if flat_cloud is not None:
+                self.cloud_pixels += int(np.count_nonzero(flat_cloud[window]))
+
+            count = int(np.count_nonzero(valid))
+            if count == 0:
+                continue
+            # Invalid pixels are zeroed in a block-sized buffer instead of being
+            # gathered out with a boolean index
+            values = np.where(valid, flat_ndvi[window], 0.0).astype(np.float64, copy=False)
+            self.valid_count += count
+            self.valid_sum += float(values.sum())
+            self.valid_sum_sq += float(np.dot(values, values))
+            self.valid_min = min(self.valid_min, float(np.min(values, where=valid, initial=np.inf)))
+            self.valid_max = max(self.valid_max, float(np.max(values, where=valid, initial=-np.inf)))
+
+            # Out-of-range values land in the end bins; invalid pixels in an extra dropped bin
+            bins = np.floor((values - FINE_HISTOGRAM_RANGE[0]) / _FINE_BIN_WIDTH).astype(np.int64)
+            np.clip(bins, 0, FINE_HISTOGRAM_BINS - 1, out=bins)
+            bins[~valid] = FINE_HISTOGRAM_BINS
+            self.fine_histogram += np.bincount(bins, minlength=FINE_HISTOGRAM_BINS + 1)[:FINE_HISTOGRAM_BINS]
+        return self
+
+    def merge(self, other):
+        """Fold another accumulator (e.g. from a different tile or worker) into this one"""
+        self.total_pixels += other.total_pixels
+        self.cloud_pixels += other.cloud_pixels
+        self.valid_count += other.valid_count
+        self.valid_sum += other.valid_sum
+        self.valid_sum_sq += other.valid_sum_sq
+        self.valid_min = min(self.valid_min, other.valid_min)
+        self.valid_max = max(self.valid_max, other.valid_max)
+        self.fine_histogram += other.fine_histogram
+        self.class_counts += other.class_counts
+        return self
+
+    def percentiles(self, percentiles=PERCENTILES):
+        """
+        Percentiles interpolated within the fine histogram bins.
+
+        Accurate to the 0.001 bin width and clamped to the exact min and max.
+
+        Returns:
+            Dict mapping each percentile to its NDVI value
+        """
+        cumulative = np.cumsum(self.fine_histogram)
+        result = {}
+        for q in percentiles:
+            rank = q / 100 * self.valid_count
+            i = min(int(np.searchsorted(cumulative, rank, side="left")), FINE_HISTOGRAM_BINS - 1)
+            below = cumulative[i - 1] if i > 0 else 0
+            fraction = (rank - below) / max(self.fine_histogram[i], 1)
+            value = FINE_HISTOGRAM_RANGE[0] + (i + fraction) * _FINE_BIN_WIDTH
+            result[q] = float(min(max(value, self.valid_min), self.valid_max))
+        return result
+
+    def histogram(self):
+        """Pixel counts over HISTOGRAM_EDGES, values outside the edges clipped into the end bins"""
+        fine = self.fine_histogram
+        first = _DISPLAY_FIRST_BIN
+        last = first + _DISPLAY_BIN_SPAN * (len(HISTOGRAM_EDGES) - 1)
+        histogram = fine[first:last].reshape(-1, _DISPLAY_BIN_SPAN).sum(axis=1)
+        histogram[0] += fine[:first].sum()
+        histogram[-1] += fine[last:].sum()
+        return histogram
+
+    def ndvi_stats(self):
+        """
+        Dict with "min", "mean", "max", "std" and "percentiles", or None if
+        no valid pixels were seen.
+        """
+        if self.valid_count == 0:
+            return None
+        mean = self.valid_sum / self.valid_count
+        variance = max(self.valid_sum_sq / self.valid_count - mean**2, 0.0)
+        return {
+            "min": self.valid_min,
+            "mean": mean,
+            "max": self.valid_max,
+            "std": float(np.sqrt(variance)),
+            "percentiles": self.percentiles(),
+        }
+
+    def class_counts_by_label(self):
+        """Dict mapping vegetation class labels to pixel counts"""
+        return {label: int(self.class_counts[i]) for i, label in enumerate(self.class_lut["labels"])}
+
+    def cloud_percentage(self):
+        return (self.cloud_pixels / max(self.total_pixels, 1)) * 100
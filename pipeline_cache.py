@@ -0,0 +1,285 @@
+"""
+Stage-level memoization of the analysis pipeline.
+
+The analysis is a small dependency graph:
+
+    source -> cloud_mask -> scene -> handled -> classification -> statistics
+                                           \\-> zones
+                                           \\-> render
+
+Each stage's output is cached under a key built from its own parameters and
+the keys of the stages it reads, so a change only recomputes the stages
+downstream of it: a different cloud handling method reuses the scene and the
+cloud mask, and display-only changes reuse everything. Outputs live in one
+LRU bounded by their total size in bytes.
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from crop_analysis import (CLOUD_HANDLING_METHODS, NDVI_CLASS_LUT, build_analysis_result, scene_cloud_percentage,
+                           simulate_ndvi, simulate_qa60_cloud_mask, simulation_rngs)
+from gap_filling import DEFAULT_GAP_FILL_METHOD
+from instrumentation import profile_stage
+from management_zones import delineate_zones, rank_zones
+from ndvi_rendering import NDVI_PALETTE, image_to_png_bytes, paletted_image
+from ndvi_statistics import NDVIStatistics
+from scene import Scene
+
+# Total size of the cached stage outputs
+PIPELINE_CACHE_BYTES = int(os.environ.get("CROP_HEALTH_PIPELINE_CACHE_MB", 512)) * 2**20
+
+# Upstream stages and own parameters of every stage, in dependency order
+PIPELINE_STAGES = {
+    "source": ((), ("source_key", "shape", "ndvi_seed")),
+    "cloud_mask": (("source",), ("cloud_masking", "cloud_coverage", "cloud_size", "cloud_seed")),
+    "scene": (("source", "cloud_mask"), ("aoi_key",)),
+    "handled": (("scene",), ("cloud_handling", "gap_fill_method")),
+    "classification": (("handled",), ()),
+    "statistics": (("handled", "classification"), ()),
+    "zones": (("handled", "classification"), ("zone_method",)),
+    "render": (("handled", "classification"), ()),
+}
+
+
+def estimate_nbytes(value):
+    """Approximate memory held by a cached value (arrays, scenes, bytes and containers of them)"""
+    if value is None:
+        return 0
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, Scene):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(estimate_nbytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_nbytes(item) for item in value)
+    if hasattr(value, "__dict__"):
+        return sum(estimate_nbytes(item) for item in vars(value).values())
+    return sys.getsizeof(value)
+
+
+def freeze(value):
+    """
+    Mark the arrays in a stage output (arrays, scenes and containers of them) read-only.
+
+    Cached outputs are shared by every session and job thread of the
+    process, so none may be changed in place. Scenes protect their own state.
+    """
+    if isinstance(value, np.ndarray):
+        value.setflags(write=False)
+    elif isinstance(value, dict):
+        for item in value.values():
+            freeze(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            freeze(item)
+    return value
+
+
+class ByteBudgetCache:
+    """LRU cache evicting the least recently used entries once their total size exceeds a budget"""
+
+    def __init__(self, max_bytes=PIPELINE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value, nbytes=None):
+        """
+        Cache a value; values larger than the whole budget are not kept.
+
+        Args:
+            key: Hashable key
+            value: Value to cache
+            nbytes: Size to account for, estimated if None
+        """
+        nbytes = estimate_nbytes(value) if nbytes is None else nbytes
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.nbytes -= evicted_bytes
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+def stage_key(stage, params, upstream_keys):
+    """Key of a stage's output from its own parameters and its upstream stage keys"""
+    own = {name: params.get(name) for name in PIPELINE_STAGES[stage][1]}
+    payload = json.dumps([stage, own, upstream_keys], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class AnalysisPipeline:
+    """
+    analyze_area() as memoized stages.
+
+    The simulated NDVI and clouds come from their own seed streams (see
+    crop_analysis.simulation_rngs()), so a cached cloud mask matches what a
+    full recomputation with the same seed would produce.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache if cache is not None else ByteBudgetCache()
+
+    def _stage(self, stage, key, compute):
+        """Cached output of a stage, computing (and profiling) it on a miss"""
+        value = self.cache.get(key, _MISSING)
+        if value is _MISSING:
+            with profile_stage(stage):
+                value = freeze(compute())
+            self.cache.put(key, value)
+        return value
+
+    def run(self, center, location_name="", shape=(100, 100), cloud_masking=True, cloud_coverage=0.2,
+            cloud_size=10, cloud_handling="Mask Clouds (Show)", seed=None, gap_fill_method=DEFAULT_GAP_FILL_METHOD,
+            load_scene=None, source_key=None, aoi=None, aoi_key=None, zone_method=None, bounds=None):
+        """
+        Run the analysis, reusing every stage whose inputs are unchanged.
+
+        Takes the arguments of analyze_area(), except that a loaded scene and
+        the AOI mask are passed as functions so they are only computed on a
+        cache miss.
+
+        Args:
+            load_scene: Optional function returning (ndvi, cloud_mask or None);
+                the NDVI is simulated from seed when None
+            source_key: Value identifying what load_scene reads (e.g. file and
+                bounds); required with load_scene
+            aoi: Optional function of the scene shape returning the boolean
+                mask of the pixels inside the drawn shape (or None)
+            aoi_key: Value identifying the AOI (e.g. the geometry hash); required with aoi
+            zone_method: Optional management_zones.ZONE_METHODS entry; the
+                ranked zones are cited by the recommendations
+            bounds: (min_lon, min_lat, max_lon, max_lat) of the scene; required with zone_method
+            seed: Int seed; None draws a fresh scene that is never reused
+
+        Returns:
+            Dict with the AnalysisResult ("result"), the NDVI palette indices
+            ("ndvi_indices") and the NDVI and classification PNGs ("ndvi_png",
+            "classified_png")
+        """
+        if cloud_masking and cloud_handling not in CLOUD_HANDLING_METHODS:
+            raise ValueError(f"Unknown cloud handling method: {cloud_handling}")
+        if not cloud_masking:
+            cloud_handling = None
+        if load_scene is not None and source_key is None:
+            raise ValueError("source_key is required with load_scene")
+        if aoi is not None and aoi_key is None:
+            raise ValueError("aoi_key is required with aoi")
+        if zone_method is not None and bounds is None:
+            raise ValueError("bounds are required with zone_method")
+        if seed is None:
+            seed = int(np.random.SeedSequence().generate_state(1)[0])
+
+        params = {
+            # Loaded scenes do not depend on the simulation parameters
+            "source_key": source_key,
+            "shape": None if load_scene is not None else shape,
+            "ndvi_seed": None if load_scene is not None else seed,
+            "cloud_masking": cloud_masking,
+            "cloud_coverage": cloud_coverage,
+            "cloud_size": cloud_size,
+            "cloud_seed": seed,
+            "aoi_key": aoi_key,
+            "cloud_handling": cloud_handling,
+            "gap_fill_method": gap_fill_method,
+            "zone_method": zone_method,
+        }
+        keys = {}
+        for stage, (upstream, _) in PIPELINE_STAGES.items():
+            keys[stage] = stage_key(stage, params, [keys[name] for name in upstream])
+
+        ndvi_rng, cloud_rng = simulation_rngs(seed)
+
+        def source():
+            if load_scene is not None:
+                return load_scene()
+            return simulate_ndvi(shape, ndvi_rng), None
+
+        ndvi, loaded_cloud_mask = self._stage("source", keys["source"], source)
+
+        def cloud_mask():
+            if not cloud_masking:
+                return None
+            if loaded_cloud_mask is not None:
+                return loaded_cloud_mask
+            return simulate_qa60_cloud_mask(ndvi.shape, cloud_coverage, cloud_size, cloud_rng)
+
+        mask = self._stage("cloud_mask", keys["cloud_mask"], cloud_mask)
+        scene = self._stage("scene", keys["scene"],
+                            lambda: Scene(ndvi, mask, aoi(ndvi.shape) if aoi is not None else None))
+
+        def handled():
+            # The valid mask stands for the handled NDVI; Scene caches interpolated values itself,
+            # so the scene is accounted again at its new size
+            valid = scene.valid_mask(cloud_handling, gap_fill_method)
+            self.cache.put(keys["scene"], scene)
+            return valid
+
+        valid_mask = self._stage("handled", keys["handled"], handled)
+        class_index = self._stage("classification", keys["classification"],
+                                  lambda: scene.class_index(NDVI_CLASS_LUT, cloud_handling, gap_fill_method))
+        stats = self._stage("statistics", keys["statistics"], lambda: NDVIStatistics(NDVI_CLASS_LUT).update(
+            scene.data(cloud_handling, gap_fill_method), valid_mask, class_index))
+        zones = self._stage("zones", keys["zones"], lambda: None if zone_method is None else delineate_zones(
+            scene.data(cloud_handling, gap_fill_method), class_index, NDVI_CLASS_LUT, zone_method))
+
+        def render():
+            ndvi_indices = scene.palette_indices(cloud_handling, gap_fill_method)
+            return {
+                "ndvi_indices": ndvi_indices,
+                "ndvi_png": image_to_png_bytes(paletted_image(ndvi_indices, NDVI_PALETTE)),
+                "classified_png": image_to_png_bytes(paletted_image(class_index, NDVI_CLASS_LUT["palette"])),
+            }
+
+        rendered = self._stage("render", keys["render"], render)
+
+        result = build_analysis_result(
+            location_name, center, cloud_handling, scene_cloud_percentage(scene) if mask is not None else None,
+            stats.class_counts_by_label(), stats.ndvi_stats(),
+            zones=rank_zones(zones, bounds) if zones is not None else None,
+            scene=scene,
+            gap_fill_method=gap_fill_method,
+            class_index=class_index,
+            ndvi_histogram=stats.histogram(),
+        )
+        return {"result": result, **rendered}
+
+
+# Cache sentinel distinguishing a miss from a cached None (e.g. no cloud mask)
+_MISSING = object()
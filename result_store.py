@@ -0,0 +1,249 @@
+"""
+Local store of past analyses.
+
+Each analysis is one row in a SQLite database: the AOI geometry, date range,
+cloud parameters, class percentages, health score and a small paletted PNG
+thumbnail. Rows are indexed by the geohash of the AOI center and by date, and
+by an AOI key, so lookups for an area and a field's health history are index
+range scans instead of recomputations.
+"""
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+from datetime import date, datetime
+
+import numpy as np
+
+from aoi_mask import geometry_key
+from ndvi_rendering import image_to_png_bytes, paletted_image
+
+RESULT_STORE_PATH = os.environ.get(
+    "CROP_HEALTH_RESULTS_DB", os.path.join(os.path.expanduser("~"), ".crop_health", "results.sqlite"))
+
+# Geohash characters stored per row (~150 m cells); queries may use any shorter prefix
+GEOHASH_PRECISION = 7
+
+# Longest side of a stored thumbnail in pixels
+THUMBNAIL_SIZE = 128
+
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY,
+    input_key TEXT NOT NULL,
+    analyzed_at REAL NOT NULL,
+    aoi_key TEXT NOT NULL,
+    geohash TEXT NOT NULL,
+    location_name TEXT,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    geometry TEXT NOT NULL,
+    start_date TEXT,
+    end_date TEXT,
+    data_source TEXT,
+    analysis_mode TEXT,
+    cloud_masking INTEGER,
+    cloud_coverage REAL,
+    cloud_size INTEGER,
+    cloud_handling TEXT,
+    gap_fill_method TEXT,
+    cloud_percentage REAL,
+    health_score REAL,
+    dominant_class TEXT,
+    ndvi_mean REAL,
+    class_percentages TEXT NOT NULL,
+    thumbnail BLOB
+);
+CREATE UNIQUE INDEX IF NOT EXISTS analyses_run ON analyses (input_key, analyzed_at);
+CREATE INDEX IF NOT EXISTS analyses_geohash_date ON analyses (geohash, end_date);
+CREATE INDEX IF NOT EXISTS analyses_aoi_date ON analyses (aoi_key, end_date);
+"""
+
+# Columns returned by queries (the thumbnail is only read on request)
+_SUMMARY_COLUMNS = (
+    "id", "analyzed_at", "aoi_key", "geohash", "location_name", "lat", "lon", "start_date", "end_date",
+    "data_source", "analysis_mode", "cloud_handling", "cloud_percentage", "health_score",
+    "dominant_class", "ndvi_mean", "class_percentages",
+)
+
+
+def encode_geohash(lat, lon, precision=GEOHASH_PRECISION):
+    """Geohash of a point; nearby points share a prefix"""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        interval, coordinate = (lon_range, lon) if even else (lat_range, lat)
+        mid = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= mid:
+            value |= 1
+            interval[0] = mid
+        else:
+            interval[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return "".join(chars)
+
+
+def area_feature(selected_area):
+    """
+    GeoJSON feature of a selected area.
+
+    Drawn areas are returned as drawn; predefined circles become a Point with
+    a "radius" property in meters, the same form Leaflet.draw uses.
+    """
+    if selected_area["type"] == "drawn":
+        return selected_area["drawn_features"]
+    center = selected_area["center"]
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [center["lon"], center["lat"]]},
+        "properties": {"radius": selected_area["radius"] * 111000},
+    }
+
+
+def make_thumbnail(indices, palette, size=THUMBNAIL_SIZE):
+    """Paletted PNG of a palette index raster decimated to at most size pixels per side"""
+    step = max(1, int(np.ceil(max(indices.shape) / size)))
+    return image_to_png_bytes(paletted_image(np.ascontiguousarray(indices[::step, ::step]), palette), compress_level=9)
+
+
+def _date_text(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+class ResultStore:
+    """
+    SQLite store of analysis summaries.
+
+    A connection is opened per call, so one store can be shared by the app's
+    sessions and background jobs.
+    """
+
+    def __init__(self, path=RESULT_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(_SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """Connection committed on success and always closed"""
+        connection = sqlite3.connect(self.path, timeout=10)
+        connection.row_factory = sqlite3.Row
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def save(self, result, inputs, input_key, analyzed_at, thumbnail=None):
+        """
+        Store one analysis; saving the same run (input key and time) again is a no-op.
+
+        Args:
+            result: AnalysisResult
+            inputs: Analysis inputs (selected_area, dates, data source and cloud options)
+            input_key: Key of the inputs (see job_runner.job_key())
+            analyzed_at: Unix time of the analysis
+            thumbnail: Optional PNG bytes (see make_thumbnail())
+
+        Returns:
+            Row id, or None if the run was already stored
+        """
+        feature = area_feature(inputs["selected_area"])
+        center = inputs["selected_area"]["center"]
+        row = {
+            "input_key": input_key,
+            "analyzed_at": analyzed_at,
+            "aoi_key": geometry_key(feature),
+            "geohash": encode_geohash(center["lat"], center["lon"]),
+            "location_name": result.location_name,
+            "lat": center["lat"],
+            "lon": center["lon"],
+            "geometry": json.dumps(feature),
+            "start_date": _date_text(inputs.get("start_date")),
+            "end_date": _date_text(inputs.get("end_date")),
+            "data_source": inputs.get("data_source"),
+            "analysis_mode": inputs.get("analysis_mode"),
+            "cloud_masking": int(bool(inputs.get("enable_cloud_masking"))),
+            "cloud_coverage": inputs.get("cloud_coverage"),
+            "cloud_size": inputs.get("cloud_size"),
+            "cloud_handling": result.cloud_handling,
+            "gap_fill_method": inputs.get("gap_fill_method"),
+            "cloud_percentage": result.cloud_percentage,
+            "health_score": result.health_score,
+            "dominant_class": result.dominant_class,
+            "ndvi_mean": result.ndvi_stats["mean"] if result.ndvi_stats else None,
+            "class_percentages": json.dumps(result.class_percentages),
+            "thumbnail": thumbnail,
+        }
+        columns = ", ".join(row)
+        placeholders = ", ".join(f":{column}" for column in row)
+        with self._lock, self._connect() as connection:
+            cursor = connection.execute(
+                f"INSERT OR IGNORE INTO analyses ({columns}) VALUES ({placeholders})", row)
+            return cursor.lastrowid if cursor.rowcount else None
+
+    def _select(self, where, parameters, limit):
+        """The newest `limit` matching rows as records, oldest first"""
+        sql = (f"SELECT {', '.join(_SUMMARY_COLUMNS)} FROM analyses WHERE {where} "
+               f"ORDER BY end_date DESC, analyzed_at DESC LIMIT ?")
+        with self._connect() as connection:
+            rows = connection.execute(sql, (*parameters, limit)).fetchall()
+        records = []
+        for row in reversed(rows):
+            record = dict(row)
+            record["class_percentages"] = json.loads(record["class_percentages"])
+            records.append(record)
+        return records
+
+    def history(self, feature, limit=500):
+        """
+        Past analyses of one AOI, oldest first.
+
+        Args:
+            feature: GeoJSON feature of the AOI (see area_feature())
+            limit: Maximum number of rows; the most recent are kept
+        """
+        return self._select("aoi_key = ?", (geometry_key(feature),), limit)
+
+    def near(self, lat, lon, precision=5, start_date=None, end_date=None, limit=500):
+        """
+        Past analyses whose AOI center shares a geohash prefix with a point.
+
+        Args:
+            lat, lon: Query point
+            precision: Prefix length (5 is ~5 km cells, 6 ~1 km)
+            start_date, end_date: Optional range the analyses' end dates must fall in
+            limit: Maximum number of rows; the most recent are kept
+        """
+        prefix = encode_geohash(lat, lon, precision)
+        # A prefix match as a range, so it is answered from the geohash index
+        where = ["geohash >= ?", "geohash < ?"]
+        parameters = [prefix, prefix + "~"]
+        if start_date is not None:
+            where.append("end_date >= ?")
+            parameters.append(_date_text(start_date))
+        if end_date is not None:
+            where.append("end_date <= ?")
+            parameters.append(_date_text(end_date))
+        return self._select(" AND ".join(where), parameters, limit)
+
+    def thumbnail(self, row_id):
+        """PNG bytes of an analysis thumbnail, or None"""
+        with self._connect() as connection:
+            row = connection.execute("SELECT thumbnail FROM analyses WHERE id = ?", (row_id,)).fetchone()
+        return None if row is None else row["thumbnail"]
@@ -0,0 +1,143 @@
+import threading
+
+import numpy as np
+
+from gap_filling import DEFAULT_GAP_FILL_METHOD, fill_gaps
+from ndvi_classification import classify_ndvi_array
+from ndvi_rendering import CLOUD_PALETTE_INDEX, NODATA_PALETTE_INDEX, quantize_ndvi
+
+
+def pack_mask(mask):
+    """Pack a 2D boolean mask into bits, one packed row per image row"""
+    return np.packbits(np.asarray(mask, dtype=bool), axis=-1)
+
+
+def unpack_mask(bits, width):
+    """Unpack a mask packed with pack_mask()"""
+    return np.unpackbits(bits, axis=-1, count=width).view(bool)
+
+
+def _read_only(array):
+    """Mark an array read-only and return it"""
+    array.setflags(write=False)
+    return array
+
+
+class Scene:
+    """
+    One NDVI scene with its cloud and AOI masks stored as bitmaps.
+
+    NDVI is kept once as float32; clouds and the AOI are packed bits (1/32 of
+    the NDVI size each), so no values have to be overwritten to mark them.
+    NaN in the NDVI only means missing data. The cloud handling modes are
+    views over the same buffer: "Mask Clouds (Show)" and "Remove Clouds (Hide)"
+    only differ in how excluded pixels are drawn, and only "Interpolate"
+    materializes (and caches) a filled array per gap filling method.
+
+    Scenes are cached process-wide and shared by every session and job
+    thread: the NDVI, the bitmaps and the fills are read-only, and the fills
+    are computed under a lock.
+    """
+    __slots__ = ("ndvi", "shape", "_cloud_bits", "_aoi_bits", "_filled", "_lock")
+
+    def __init__(self, ndvi, cloud_mask=None, aoi_mask=None):
+        """
+        Args:
+            ndvi: 2D NDVI array (converted to float32 if needed)
+            cloud_mask: Optional binary cloud mask (1 = cloud)
+            aoi_mask: Optional boolean mask of the pixels to analyze
+        """
+        # A read-only view, so the caller's array keeps its own flags
+        self.ndvi = _read_only(np.asarray(ndvi, dtype=np.float32).view())
+        self.shape = self.ndvi.shape
+        self._cloud_bits = None if cloud_mask is None else _read_only(pack_mask(cloud_mask))
+        self._aoi_bits = None if aoi_mask is None else _read_only(pack_mask(aoi_mask))
+        # Gap filling method -> filled NDVI; scenes are shared by concurrent jobs, so the
+        # fills are looked up and computed under the lock, once per method
+        self._filled = {}
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        """Bytes held by the NDVI buffer, the bitmaps and any cached fill"""
+        total = self.ndvi.nbytes
+        for bits in (self._cloud_bits, self._aoi_bits):
+            total += 0 if bits is None else bits.nbytes
+        with self._lock:
+            total += sum(filled.nbytes for filled in self._filled.values())
+        return total
+
+    @property
+    def cloud_mask(self):
+        """Boolean cloud mask (all False without cloud masking)"""
+        if self._cloud_bits is None:
+            return np.zeros(self.shape, dtype=bool)
+        return unpack_mask(self._cloud_bits, self.shape[1])
+
+    @property
+    def aoi_mask(self):
+        """Boolean mask of the analyzed pixels (all True without an AOI)"""
+        if self._aoi_bits is None:
+            return np.ones(self.shape, dtype=bool)
+        return unpack_mask(self._aoi_bits, self.shape[1])
+
+    def data(self, cloud_handling=None, gap_fill_method=DEFAULT_GAP_FILL_METHOD):
+        """
+        NDVI values for a cloud handling mode.
+
+        The NDVI buffer itself, except for "Interpolate" where cloud and
+        missing pixels are filled once per gap filling method and cached.
+        """
+        if cloud_handling != "Interpolate" or self._cloud_bits is None:
+            return self.ndvi
+        with self._lock:
+            filled = self._filled.get(gap_fill_method)
+            if filled is None:
+                invalid = self.cloud_mask | np.isnan(self.ndvi)
+                source = np.where(invalid, np.float32(np.nan), self.ndvi)
+                filled = fill_gaps(source, invalid, gap_fill_method).astype(np.float32, copy=False)
+                self._filled[gap_fill_method] = _read_only(filled)
+        return filled
+
+    def valid_mask(self, cloud_handling=None, gap_fill_method=DEFAULT_GAP_FILL_METHOD):
+        """Boolean mask of the pixels counted in statistics for a cloud handling mode"""
+        data = self.data(cloud_handling, gap_fill_method)
+        valid = ~np.isnan(data)
+        if cloud_handling in ("Mask Clouds (Show)", "Remove Clouds (Hide)") and self._cloud_bits is not None:
+            valid &= ~self.cloud_mask
+        if self._aoi_bits is not None:
+            valid &= self.aoi_mask
+        return valid
+
+    def view(self, cloud_handling=None, gap_fill_method=DEFAULT_GAP_FILL_METHOD):
+        """Masked array over the NDVI data of a mode (no copy of the data), masked where not valid"""
+        return np.ma.MaskedArray(self.data(cloud_handling, gap_fill_method),
+                                 mask=~self.valid_mask(cloud_handling, gap_fill_method), copy=False)
+
+    def _excluded_masks(self, cloud_handling):
+        """Pixels drawn as clouds and pixels drawn as no-data for a mode"""
+        clouds = self.cloud_mask if cloud_handling in ("Mask Clouds (Show)", "Remove Clouds (Hide)") else None
+        outside = None if self._aoi_bits is None else ~self.aoi_mask
+        return clouds, outside
+
+    def class_index(self, class_lut, cloud_handling=None, gap_fill_method=DEFAULT_GAP_FILL_METHOD):
+        """Class index array; shown clouds get the cloud class, removed clouds and pixels outside the AOI no-data"""
+        class_index = classify_ndvi_array(self.data(cloud_handling, gap_fill_method), class_lut, cloud_value=-np.inf)
+        clouds, outside = self._excluded_masks(cloud_handling)
+        if clouds is not None:
+            shown = cloud_handling == "Mask Clouds (Show)"
+            np.copyto(class_index, class_lut["cloud_index"] if shown else class_lut["nodata_index"], where=clouds)
+        if outside is not None:
+            np.copyto(class_index, class_lut["nodata_index"], where=outside)
+        return class_index
+
+    def palette_indices(self, cloud_handling=None, gap_fill_method=DEFAULT_GAP_FILL_METHOD):
+        """NDVI_PALETTE indices for rendering, with the same cloud and AOI treatment as class_index()"""
+        indices = quantize_ndvi(self.data(cloud_handling, gap_fill_method), cloud_value=-np.inf)
+        clouds, outside = self._excluded_masks(cloud_handling)
+        if clouds is not None:
+            shown = cloud_handling == "Mask Clouds (Show)"
+            np.copyto(indices, CLOUD_PALETTE_INDEX if shown else NODATA_PALETTE_INDEX, where=clouds)
+        if outside is not None:
+            np.copyto(indices, NODATA_PALETTE_INDEX, where=outside)
+        return indices
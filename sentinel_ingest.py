@@ -0,0 +1,341 @@
+import json
+import os
+
+import numpy as np
+
+# QA60 bits flagging opaque clouds (10) and cirrus (11)
+QA60_CLOUD_BITS = (1 << 10) | (1 << 11)
+
+# Band file formats understood by open_band()
+RASTER_FORMATS = ("npy", "raw", "geotiff")
+
+# Rows of a scene band; chunked readers and writers use whole numbers of bands
+# (synthetic scenes seed their noise and clouds per band)
+BAND_ROWS = 16
+
+
+def load_scene_manifest(path):
+    """
+    Load a scene manifest describing where the bands of one acquisition live.
+
+    The manifest is a JSON object such as:
+
+        {
+            "format": "npy",
+            "red": "B04.npy", "nir": "B08.npy", "qa60": "QA60.npy",
+            "bounds": [min_lon, min_lat, max_lon, max_lat]
+        }
+
+    Raw files additionally need "dtype" and "shape" (and "qa60_shape" if QA60
+    is stored at its native 60 m resolution). GeoTIFFs carry their own
+    georeferencing, so "bounds" is not needed. Band paths are relative to the
+    manifest.
+
+    Returns:
+        Manifest dict with absolute band paths
+    """
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    if manifest.get("format", "npy") not in RASTER_FORMATS:
+        raise ValueError(f"Unsupported band format: {manifest['format']}")
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    for band in ("red", "nir", "qa60"):
+        if manifest.get(band):
+            manifest[band] = os.path.join(base_dir, manifest[band])
+    return manifest
+
+
+def open_band(path, fmt="npy", dtype=None, shape=None):
+    """
+    Open a band as a read-only memory map; no pixels are read until sliced.
+
+    Args:
+        path: Band file path
+        fmt: "npy" or "raw"
+        dtype: Pixel dtype (raw only)
+        shape: Tuple (height, width) (raw only)
+
+    Returns:
+        np.memmap
+    """
+    if fmt == "npy":
+        return np.load(path, mmap_mode="r")
+    if fmt == "raw":
+        return np.memmap(path, dtype=np.dtype(dtype), mode="r", shape=tuple(shape))
+    raise ValueError(f"Cannot memory-map band format: {fmt}")
+
+
+def bounds_to_window(scene_bounds, scene_shape, aoi_bounds):
+    """
+    Pixel window covering an AOI on a north-up lat/lon grid.
+
+    Args:
+        scene_bounds: (min_lon, min_lat, max_lon, max_lat) of the whole grid
+        scene_shape: Tuple (height, width) of the grid
+        aoi_bounds: (min_lon, min_lat, max_lon, max_lat) of the AOI
+
+    Returns:
+        Tuple of (row_slice, col_slice)
+    """
+    min_lon, min_lat, max_lon, max_lat = scene_bounds
+    height, width = scene_shape
+    pixel_width = (max_lon - min_lon) / width
+    pixel_height = (max_lat - min_lat) / height
+
+    # Row 0 is the northern edge of the grid
+    col_start = int(np.floor((aoi_bounds[0] - min_lon) / pixel_width))
+    col_end = int(np.ceil((aoi_bounds[2] - min_lon) / pixel_width))
+    row_start = int(np.floor((max_lat - aoi_bounds[3]) / pixel_height))
+    row_end = int(np.ceil((max_lat - aoi_bounds[1]) / pixel_height))
+
+    col_start, col_end = max(col_start, 0), min(col_end, width)
+    row_start, row_end = max(row_start, 0), min(row_end, height)
+    if row_start >= row_end or col_start >= col_end:
+        raise ValueError("The selected area does not overlap the scene")
+    return slice(row_start, row_end), slice(col_start, col_end)
+
+
+def window_bounds(scene_bounds, scene_shape, window):
+    """Bounds of the pixels in a (row_slice, col_slice) window of a north-up grid"""
+    min_lon, min_lat, max_lon, max_lat = scene_bounds
+    height, width = scene_shape
+    pixel_width = (max_lon - min_lon) / width
+    pixel_height = (max_lat - min_lat) / height
+    rows, cols = window
+    return (min_lon + cols.start * pixel_width, max_lat - rows.stop * pixel_height,
+            min_lon + cols.stop * pixel_width, max_lat - rows.start * pixel_height)
+
+
+def compute_ndvi(red, nir, out=None):
+    """
+    Compute NDVI = (NIR - Red) / (NIR + Red) in float32.
+
+    Integer reflectances are cast to float32 inside the ufuncs, so no float64
+    intermediates are created. Pixels with no signal become NaN.
+
+    Args:
+        red: Red (B4) reflectance array
+        nir: Near-infrared (B8) reflectance array
+        out: Optional preallocated float32 array
+
+    Returns:
+        float32 NDVI array
+    """
+    out = np.subtract(nir, red, out=out, dtype=np.float32)
+    denominator = np.add(nir, red, dtype=np.float32)
+    no_signal = denominator <= 0
+    np.divide(out, denominator, out=out, where=~no_signal)
+    out[no_signal] = np.nan
+    return out
+
+
+def qa60_cloud_mask(qa60):
+    """Binary cloud mask (1 = cloud) from QA60 opaque and cirrus bits"""
+    return ((np.asarray(qa60) & QA60_CLOUD_BITS) != 0).astype(np.uint8)
+
+
+def _read_upsampled_window(band, window, factor):
+    """Read a window given in fine pixels from a band stored `factor` times coarser"""
+    rows, cols = window
+    coarse = band[rows.start // factor:-(-rows.stop // factor), cols.start // factor:-(-cols.stop // factor)]
+    fine = np.repeat(np.repeat(np.asarray(coarse), factor, axis=0), factor, axis=1)
+    row_offset = rows.start - (rows.start // factor) * factor
+    col_offset = cols.start - (cols.start // factor) * factor
+    return fine[row_offset:row_offset + rows.stop - rows.start, col_offset:col_offset + cols.stop - cols.start]
+
+
+def _open_npy_bands(manifest):
+    """Memory-mapped B4, B8 and QA60 (None without a QA60 band)"""
+    fmt = manifest.get("format", "npy")
+    red = open_band(manifest["red"], fmt, manifest.get("dtype"), manifest.get("shape"))
+    nir = open_band(manifest["nir"], fmt, manifest.get("dtype"), manifest.get("shape"))
+    qa60 = None
+    if manifest.get("qa60"):
+        qa60 = open_band(manifest["qa60"], fmt, manifest.get("qa60_dtype", manifest.get("dtype")),
+                         manifest.get("qa60_shape", manifest.get("shape")))
+    return red, nir, qa60
+
+
+def _open_npy_aoi(manifest, aoi_bounds):
+    """Memory-mapped bands and the AOI window in B4/B8 pixels"""
+    red, nir, qa60 = _open_npy_bands(manifest)
+    return red, nir, qa60, bounds_to_window(manifest["bounds"], red.shape, aoi_bounds)
+
+
+def _read_cloud_window(qa60, fine_shape, window):
+    # QA60 is distributed at 60 m, six times coarser than B4/B8
+    factor = fine_shape[0] // qa60.shape[0]
+    if factor > 1:
+        return qa60_cloud_mask(_read_upsampled_window(qa60, window, factor))
+    return qa60_cloud_mask(qa60[window])
+
+
+def _read_npy_window(red, nir, qa60, window):
+    ndvi = compute_ndvi(red[window], nir[window])
+    cloud_mask = None if qa60 is None else _read_cloud_window(qa60, red.shape, window)
+    return ndvi, cloud_mask
+
+
+def _read_npy_aoi(manifest, aoi_bounds):
+    red, nir, qa60, window = _open_npy_aoi(manifest, aoi_bounds)
+    ndvi, cloud_mask = _read_npy_window(red, nir, qa60, window)
+    return ndvi, cloud_mask, window_bounds(manifest["bounds"], red.shape, window)
+
+
+def _import_rasterio():
+    try:
+        import rasterio
+    except ImportError as e:
+        raise ImportError("Reading GeoTIFF bands requires rasterio (pip install rasterio)") from e
+    return rasterio
+
+
+def _geotiff_window(red_ds, aoi_bounds):
+    """Pixel window of the B4 dataset covering an AOI, with its bounds in the dataset CRS and in lon/lat"""
+    from rasterio.warp import transform_bounds
+    from rasterio.windows import Window, bounds, from_bounds
+
+    # AOI bounds are lon/lat; Sentinel-2 tiles are usually in UTM
+    native_bounds = transform_bounds("EPSG:4326", red_ds.crs, *aoi_bounds)
+    window = from_bounds(*native_bounds, transform=red_ds.transform)
+    # Snap outward to whole pixels like bounds_to_window(), so partial edge pixels are kept
+    col_start, row_start = int(np.floor(window.col_off)), int(np.floor(window.row_off))
+    col_end = int(np.ceil(window.col_off + window.width))
+    row_end = int(np.ceil(window.row_off + window.height))
+    window = Window(col_start, row_start, col_end - col_start, row_end - row_start).intersection(
+        Window(0, 0, red_ds.width, red_ds.height))
+    native_bounds = bounds(window, red_ds.transform)
+    return window, native_bounds, tuple(transform_bounds(red_ds.crs, "EPSG:4326", *native_bounds))
+
+
+def _read_geotiff_aoi(manifest, aoi_bounds):
+    rasterio = _import_rasterio()
+    from rasterio.enums import Resampling
+    from rasterio.windows import from_bounds
+
+    with rasterio.open(manifest["red"]) as red_ds, rasterio.open(manifest["nir"]) as nir_ds:
+        window, native_bounds, lonlat_bounds = _geotiff_window(red_ds, aoi_bounds)
+        ndvi = compute_ndvi(red_ds.read(1, window=window), nir_ds.read(1, window=window))
+
+    cloud_mask = None
+    if manifest.get("qa60"):
+        with rasterio.open(manifest["qa60"]) as qa_ds:
+            # The same ground area as the B4/B8 window, resampled to its pixels
+            qa_window = from_bounds(*native_bounds, transform=qa_ds.transform)
+            qa60 = qa_ds.read(1, window=qa_window, out_shape=ndvi.shape, resampling=Resampling.nearest)
+        cloud_mask = qa60_cloud_mask(qa60)
+    return ndvi, cloud_mask, lonlat_bounds
+
+
+def read_aoi(manifest, aoi_bounds):
+    """
+    Read NDVI and the QA60 cloud mask for an AOI, touching only its window.
+
+    The window is snapped outward to whole scene pixels and clipped to the
+    scene, so it generally covers slightly more or less than the AOI; the
+    arrays are georeferenced by the returned bounds, not by aoi_bounds.
+
+    Args:
+        manifest: Dict from load_scene_manifest() (or a path to one)
+        aoi_bounds: (min_lon, min_lat, max_lon, max_lat) of the AOI
+
+    Returns:
+        Tuple of (float32 NDVI array, uint8 cloud mask or None if there is no
+        QA60 band, (min_lon, min_lat, max_lon, max_lat) of the window read)
+    """
+    if isinstance(manifest, str):
+        manifest = load_scene_manifest(manifest)
+    if manifest.get("format", "npy") == "geotiff":
+        return _read_geotiff_aoi(manifest, aoi_bounds)
+    return _read_npy_aoi(manifest, aoi_bounds)
+
+
+def aoi_window_bounds(manifest, aoi_bounds):
+    """Bounds of the window read_aoi() reads for an AOI, found without reading any pixels"""
+    if isinstance(manifest, str):
+        manifest = load_scene_manifest(manifest)
+    if manifest.get("format", "npy") == "geotiff":
+        with _import_rasterio().open(manifest["red"]) as red_ds:
+            return _geotiff_window(red_ds, aoi_bounds)[2]
+    red, _, _, window = _open_npy_aoi(manifest, aoi_bounds)
+    return window_bounds(manifest["bounds"], red.shape, window)
+
+
+def aoi_row_reader(manifest, aoi_bounds):
+    """
+    Read an AOI a band of rows at a time, for processing scenes larger than memory.
+
+    Args:
+        manifest: Dict from load_scene_manifest() (or a path to one)
+        aoi_bounds: (min_lon, min_lat, max_lon, max_lat) of the AOI
+
+    Returns:
+        Tuple of ((height, width) of the AOI window, its bounds as returned by
+        read_aoi(), function of a row slice within the window returning
+        (NDVI, cloud mask or None) for those rows)
+    """
+    if isinstance(manifest, str):
+        manifest = load_scene_manifest(manifest)
+    if manifest.get("format", "npy") == "geotiff":
+        # rasterio windows are read whole; rows are sliced from the result
+        ndvi, cloud_mask, bounds = _read_geotiff_aoi(manifest, aoi_bounds)
+        return ndvi.shape, bounds, lambda rows: (ndvi[rows], None if cloud_mask is None else cloud_mask[rows])
+
+    red, nir, qa60, (window_rows, window_cols) = _open_npy_aoi(manifest, aoi_bounds)
+
+    def read(rows):
+        start, stop, _ = rows.indices(window_rows.stop - window_rows.start)
+        window = slice(window_rows.start + start, window_rows.start + stop), window_cols
+        return _read_npy_window(red, nir, qa60, window)
+
+    bounds = window_bounds(manifest["bounds"], red.shape, (window_rows, window_cols))
+    return (window_rows.stop - window_rows.start, window_cols.stop - window_cols.start), bounds, read
+
+
+class WindowedRaster:
+    """
+    Read-only 2D array-like over memory-mapped bands.
+
+    Slicing it with a (row_slice, col_slice) window reads and computes only
+    that window, so tile-by-tile code (see tiled_analysis) can be given a
+    whole scene larger than memory.
+    """
+
+    def __init__(self, shape, read_window):
+        """
+        Args:
+            shape: Tuple (height, width) of the raster
+            read_window: Function of a (row_slice, col_slice) window with
+                explicit bounds returning that window as an array
+        """
+        self.shape = tuple(shape)
+        self._read_window = read_window
+
+    def __getitem__(self, window):
+        rows, cols = window
+        return self._read_window((slice(*rows.indices(self.shape[0])[:2]), slice(*cols.indices(self.shape[1])[:2])))
+
+
+def open_scene(manifest):
+    """
+    Whole-scene NDVI and cloud mask that are computed only for the windows sliced from them.
+
+    Args:
+        manifest: Dict from load_scene_manifest() (or a path to one) with .npy or raw bands
+
+    Returns:
+        Tuple of (NDVI WindowedRaster, cloud mask WindowedRaster or None if there is no QA60 band)
+    """
+    if isinstance(manifest, str):
+        manifest = load_scene_manifest(manifest)
+    if manifest.get("format", "npy") == "geotiff":
+        raise ValueError("Windowed scene access needs .npy or raw bands; GeoTIFFs are read by AOI (see read_aoi())")
+
+    red, nir, qa60 = _open_npy_bands(manifest)
+    ndvi = WindowedRaster(red.shape, lambda window: compute_ndvi(red[window], nir[window]))
+    cloud_mask = None
+    if qa60 is not None:
+        cloud_mask = WindowedRaster(red.shape, lambda window: _read_cloud_window(qa60, red.shape, window))
+    return ndvi, cloud_mask
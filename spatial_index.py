@@ -0,0 +1,198 @@
+"""
+In-process spatial index of fields and region checks for selections.
+
+STRTree is a static R-tree bulk-loaded with Sort-Tile-Recursive packing over
+bounding boxes; a query walks it one level at a time with array operations.
+FieldIndex uses it to return only the fields inside the map viewport, so the
+map payload depends on the view rather than on the number of fields. Region
+tests whether points and drawn shapes lie inside an outline polygon.
+"""
+import math
+
+import numpy as np
+
+from crop_analysis import feature_bounds
+
+# Children per tree node
+NODE_CAPACITY = 16
+
+# Fields drawn at most per map view; zoomed-out views with more show a notice
+MAX_FIELDS_IN_VIEW = 500
+
+
+def _intersects(boxes, query):
+    """Boolean mask of the (N, 4) boxes intersecting a (min_x, min_y, max_x, max_y) box"""
+    min_x, min_y, max_x, max_y = query
+    return (boxes[:, 0] <= max_x) & (boxes[:, 2] >= min_x) & (boxes[:, 1] <= max_y) & (boxes[:, 3] >= min_y)
+
+
+class STRTree:
+    """
+    Static R-tree over bounding boxes, packed with Sort-Tile-Recursive.
+
+    Every level is an array of boxes ordered so that the children of node i
+    are entries i * capacity to (i + 1) * capacity - 1 of the level below.
+    """
+
+    def __init__(self, boxes, capacity=NODE_CAPACITY):
+        """
+        Args:
+            boxes: (N, 4) array of (min_x, min_y, max_x, max_y)
+            capacity: Children per node
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        self.capacity = capacity
+        self.order = self._pack(boxes)
+        self.levels = [boxes[self.order]]
+        while len(self.levels[-1]) > capacity:
+            self.levels.append(self._parents(self.levels[-1]))
+        self.levels.reverse()
+
+    def __len__(self):
+        return len(self.order)
+
+    def _pack(self, boxes):
+        """Leaf order: vertical slices by center x, each sorted by center y"""
+        count = len(boxes)
+        if count == 0:
+            return np.zeros(0, dtype=np.int64)
+        centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+        leaves = math.ceil(count / self.capacity)
+        slice_size = math.ceil(math.sqrt(leaves)) * self.capacity
+        by_x = np.argsort(centers[:, 0], kind="stable")
+        slices = [by_x[start:start + slice_size] for start in range(0, count, slice_size)]
+        return np.concatenate([part[np.argsort(centers[part, 1], kind="stable")] for part in slices])
+
+    def _parents(self, level):
+        """Bounding boxes of consecutive groups of capacity entries"""
+        groups = math.ceil(len(level) / self.capacity)
+        padded = np.empty((groups * self.capacity, 4))
+        padded[:len(level)] = level
+        # Padding entries never widen a group's box
+        padded[len(level):] = [np.inf, np.inf, -np.inf, -np.inf]
+        padded = padded.reshape(groups, self.capacity, 4)
+        return np.concatenate([padded[:, :, :2].min(axis=1), padded[:, :, 2:].max(axis=1)], axis=1)
+
+    def query(self, bounds):
+        """
+        Indices (into the boxes given at construction) of the boxes intersecting bounds.
+
+        Args:
+            bounds: (min_x, min_y, max_x, max_y)
+
+        Returns:
+            Sorted int array
+        """
+        if len(self.order) == 0:
+            return np.zeros(0, dtype=np.int64)
+        candidates = np.arange(len(self.levels[0]))
+        for depth, level in enumerate(self.levels):
+            hits = candidates[_intersects(level[candidates], bounds)]
+            if depth == len(self.levels) - 1:
+                return np.sort(self.order[hits])
+            below = len(self.levels[depth + 1])
+            candidates = (hits[:, None] * self.capacity + np.arange(self.capacity)).ravel()
+            candidates = candidates[candidates < below]
+
+
+def points_in_ring(lons, lats, ring):
+    """
+    Even-odd test of points against one polygon ring.
+
+    Args:
+        lons, lats: Arrays of point coordinates
+        ring: Sequence of [lon, lat] vertices (GeoJSON order), closed or not
+
+    Returns:
+        Boolean array
+    """
+    ring = np.asarray(ring, dtype=np.float64)
+    x0, y0 = ring[:, 0], ring[:, 1]
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+    lons = np.asarray(lons, dtype=np.float64)[..., None]
+    lats = np.asarray(lats, dtype=np.float64)[..., None]
+    # Edges straddling the point's latitude, crossed to the east of the point
+    straddles = (y0 > lats) != (y1 > lats)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        crossing_lon = x0 + (lats - y0) * (x1 - x0) / (y1 - y0)
+    return np.count_nonzero(straddles & (lons < crossing_lon), axis=-1) % 2 == 1
+
+
+class Region:
+    """Polygon region (e.g. a country outline) for validating selections"""
+
+    def __init__(self, ring):
+        """
+        Args:
+            ring: Outline as [lon, lat] vertices (GeoJSON order)
+        """
+        self.ring = np.asarray(ring, dtype=np.float64)
+        self.bounds = (*self.ring.min(axis=0), *self.ring.max(axis=0))
+
+    def contains(self, lons, lats):
+        """Boolean array of the points inside the region"""
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        inside = _intersects(np.stack([lons, lats, lons, lats], axis=-1), self.bounds)
+        if inside.any():
+            inside[inside] = points_in_ring(lons[inside], lats[inside], self.ring)
+        return inside
+
+    def contains_point(self, lat, lon):
+        return bool(self.contains(lon, lat)[0])
+
+    def contains_feature(self, feature):
+        """
+        Whether a drawn GeoJSON feature lies inside the region.
+
+        Polygons must have every vertex inside; circles (Points with a
+        "radius" property) are checked by their center.
+        """
+        geometry = feature.get("geometry", feature)
+        if geometry.get("type") in ("Polygon", "Rectangle"):
+            vertices = np.asarray(geometry["coordinates"][0], dtype=np.float64)
+            return bool(self.contains(vertices[:, 0], vertices[:, 1]).all())
+        lon, lat = geometry["coordinates"][:2]
+        return self.contains_point(lat, lon)
+
+
+def viewport_bounds(lat, lon, zoom, width=700, height=500):
+    """
+    Approximate (min_lon, min_lat, max_lon, max_lat) seen by a Web Mercator map.
+
+    Used until the map has reported its actual bounds.
+    """
+    degrees_per_pixel = 360.0 / (256 * 2 ** zoom)
+    half_lon = width / 2 * degrees_per_pixel
+    half_lat = height / 2 * degrees_per_pixel * math.cos(math.radians(lat))
+    return (lon - half_lon, lat - half_lat, lon + half_lon, lat + half_lat)
+
+
+class FieldIndex:
+    """Field features indexed by bounding box for viewport queries"""
+
+    def __init__(self, features):
+        """
+        Args:
+            features: GeoJSON features (a FeatureCollection's "features")
+        """
+        self.features = list(features)
+        boxes = np.array([feature_bounds(feature) for feature in self.features], dtype=np.float64).reshape(-1, 4)
+        self.tree = STRTree(boxes)
+
+    def __len__(self):
+        return len(self.features)
+
+    def in_view(self, bounds, limit=MAX_FIELDS_IN_VIEW):
+        """
+        Fields intersecting a viewport.
+
+        Args:
+            bounds: (min_lon, min_lat, max_lon, max_lat) of the view
+            limit: Maximum number of features returned
+
+        Returns:
+            (features, total) where total counts every field in view
+        """
+        hits = self.tree.query(bounds)
+        return [self.features[i] for i in hits[:limit]], len(hits)
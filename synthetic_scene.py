@@ -0,0 +1,398 @@
+"""
+Reproducible synthetic Sentinel-2 scenes at production sizes, for load testing.
+
+A scene is a grid of field parcels, each sown with one crop whose NDVI follows
+a phenology curve over the year, plus the within-field sin/cos pattern of
+simulate_ndvi() and sensor noise. Clouds are stamped per acquisition with
+stamp_cloud_clusters() at a coverage drawn from a monthly climatology. B4, B8
+and QA60 are written to .npy memmaps a chunk of rows at a time with a manifest
+read_aoi() understands, so scenes far larger than RAM can be generated.
+
+Noise and clouds are seeded per fixed band of rows, so a scene only depends
+on its shape, seed and date, not on the chunk size used to write it.
+
+Example:
+    python synthetic_scene.py scenes/ --size 20000 --dates 2024-03-01 2024-07-15 --seed 7
+    python fleet_batch.py scenes/fields.geojson --manifest scenes/2024-07-15/manifest.json
+"""
+import argparse
+import json
+import os
+from datetime import date
+
+import numpy as np
+
+from crop_analysis import LOCATION_OPTIONS, stamp_cloud_clusters
+from sentinel_ingest import BAND_ROWS
+
+# NDVI of every crop: bare-soil base, peak, day of year of the peak and season half-width in days
+CROP_PROFILES = {
+    "Wheat": {"base": 0.12, "peak": 0.80, "peak_day": 60, "width": 40},
+    "Rice": {"base": 0.05, "peak": 0.85, "peak_day": 250, "width": 45},
+    "Cotton": {"base": 0.12, "peak": 0.70, "peak_day": 270, "width": 55},
+    "Sugarcane": {"base": 0.30, "peak": 0.82, "peak_day": 200, "width": 110},
+    "Fallow": {"base": 0.08, "peak": 0.18, "peak_day": 220, "width": 60},
+}
+
+# Mean cloud coverage per calendar month (0-1), monsoon-heavy as over India
+MONTHLY_CLOUD_COVERAGE = (0.08, 0.08, 0.08, 0.10, 0.15, 0.45, 0.70, 0.70, 0.50, 0.22, 0.12, 0.08)
+
+# Parcel edge length in pixels (640 m at 10 m resolution)
+PARCEL_SIZE = 64
+
+# Ground size of a pixel in meters, as Sentinel-2 B4/B8
+PIXEL_SIZE_M = 10
+
+# Memory budget for the working arrays of one chunk
+CHUNK_BYTES = 64 * 1024 * 1024
+
+# Float32 rows held per chunk row (NDVI, noise, brightness, bands)
+_CHUNK_LAYERS = 6
+
+# Sum of red and NIR reflectance of vegetation and soil, and of cloud tops
+SURFACE_BRIGHTNESS = 0.35
+CLOUD_REFLECTANCE = 0.6
+
+# QA60 bit written for clouds (opaque clouds)
+QA60_OPAQUE_CLOUD = 1 << 10
+
+# Sentinel-2 L2A reflectances are stored as uint16 scaled by this factor
+REFLECTANCE_SCALE = 10000
+
+_METERS_PER_DEGREE = 111000
+
+
+def phenology_ndvi(crop, day_of_year):
+    """NDVI of a crop on a day of the year (scalar or array), from its CROP_PROFILES curve"""
+    profile = CROP_PROFILES[crop]
+    # Circular distance to the peak so seasons wrap around the new year
+    distance = (np.asarray(day_of_year) - profile["peak_day"] + 182.5) % 365 - 182.5
+    growth = np.exp(-(distance / profile["width"]) ** 2)
+    return profile["base"] + (profile["peak"] - profile["base"]) * growth
+
+
+def scene_bounds(center, shape, pixel_size_m=PIXEL_SIZE_M):
+    """(min_lon, min_lat, max_lon, max_lat) of a north-up grid of pixel_size_m pixels centered on a location"""
+    half_lat = shape[0] * pixel_size_m / _METERS_PER_DEGREE / 2
+    half_lon = shape[1] * pixel_size_m / (_METERS_PER_DEGREE * np.cos(np.radians(center["lat"]))) / 2
+    return [center["lon"] - half_lon, center["lat"] - half_lat, center["lon"] + half_lon, center["lat"] + half_lat]
+
+
+class SyntheticScene:
+    """
+    A seeded synthetic area observed on any number of dates.
+
+    The parcel layout, crop classes and per-parcel sowing offsets are fixed by
+    the seed; only a chunk of rows of any raster is computed at a time.
+    """
+
+    def __init__(self, shape, seed=0, center=None, parcel_size=PARCEL_SIZE, pixel_size_m=PIXEL_SIZE_M):
+        """
+        Args:
+            shape: Tuple (height, width) in pixels
+            seed: Int seed of the layout, noise and clouds
+            center: {"lat", "lon"} of the scene center (default: center of India)
+            parcel_size: Parcel edge length in pixels
+            pixel_size_m: Ground size of a pixel in meters
+        """
+        self.shape = tuple(int(n) for n in shape)
+        self.seed = seed
+        self.parcel_size = parcel_size
+        self.center = center or LOCATION_OPTIONS["Select a location"]
+        self.bounds = scene_bounds(self.center, self.shape, pixel_size_m)
+        self.crops = list(CROP_PROFILES)
+
+        # One entry per parcel: a few MB even for 100k x 100k pixel scenes
+        layout_rng = np.random.default_rng([seed, 0])
+        grid_shape = (-(-self.shape[0] // parcel_size), -(-self.shape[1] // parcel_size))
+        self.parcel_crops = layout_rng.integers(0, len(self.crops), grid_shape).astype(np.uint8)
+        self.sowing_offsets = layout_rng.normal(0, 10, grid_shape).astype(np.float32)
+        self.vigor = layout_rng.uniform(0.85, 1.05, grid_shape).astype(np.float32)
+
+    @classmethod
+    def covering(cls, bounds, seed=0, max_side=1000):
+        """
+        Scene over an AOI, at 10 m or coarser so neither side exceeds max_side pixels.
+
+        Args:
+            bounds: (min_lon, min_lat, max_lon, max_lat) of the AOI
+            seed: Int seed of the layout, noise and clouds
+            max_side: Largest height or width in pixels
+
+        Returns:
+            SyntheticScene whose bounds match the AOI to within a pixel
+        """
+        min_lon, min_lat, max_lon, max_lat = bounds
+        center = {"lat": (min_lat + max_lat) / 2, "lon": (min_lon + max_lon) / 2}
+        height_m = (max_lat - min_lat) * _METERS_PER_DEGREE
+        width_m = (max_lon - min_lon) * _METERS_PER_DEGREE * np.cos(np.radians(center["lat"]))
+        pixel_size_m = max(PIXEL_SIZE_M, max(height_m, width_m) / max_side)
+        shape = (max(1, round(height_m / pixel_size_m)), max(1, round(width_m / pixel_size_m)))
+        # Parcels keep their ground size at coarser pixels
+        parcel_size = max(4, round(PARCEL_SIZE * PIXEL_SIZE_M / pixel_size_m))
+        return cls(shape, seed, center, parcel_size, pixel_size_m)
+
+    def chunk_rows(self, chunk_bytes=CHUNK_BYTES):
+        """Rows per written chunk: whole bands within the memory budget"""
+        rows = chunk_bytes // (4 * self.shape[1] * _CHUNK_LAYERS)
+        return max(BAND_ROWS, rows // BAND_ROWS * BAND_ROWS)
+
+    def _band_rng(self, acquisition_date, band, stream):
+        return np.random.default_rng([self.seed, acquisition_date.toordinal(), band, stream])
+
+    def ndvi(self, rows, acquisition_date):
+        """
+        Cloud-free NDVI of a range of rows on one date.
+
+        Args:
+            rows: slice of rows starting at a multiple of BAND_ROWS
+            acquisition_date: datetime.date
+
+        Returns:
+            float32 array of shape (rows, width), clipped to [-0.2, 0.9]
+        """
+        start, stop = rows.start, min(rows.stop, self.shape[0])
+        row_index = np.arange(start, stop)
+        col_index = np.arange(self.shape[1])
+        parcel_rows = row_index // self.parcel_size
+        parcel_cols = col_index // self.parcel_size
+
+        # Each crop's curve on the day, shifted by the parcel's sowing offset
+        day = acquisition_date.timetuple().tm_yday - self.sowing_offsets[parcel_rows[:, None], parcel_cols[None, :]]
+        crop_index = self.parcel_crops[parcel_rows[:, None], parcel_cols[None, :]]
+        ndvi = np.empty((stop - start, self.shape[1]), dtype=np.float32)
+        for index, crop in enumerate(self.crops):
+            in_crop = crop_index == index
+            ndvi[in_crop] = phenology_ndvi(crop, day[in_crop])
+        ndvi *= self.vigor[parcel_rows[:, None], parcel_cols[None, :]]
+
+        # The within-field pattern of simulate_ndvi(), scaled down for crops
+        ndvi += (np.sin(row_index / 10)[:, None] * np.cos(col_index / 10)[None, :] * 0.1).astype(np.float32)
+        for band_start in range(start, stop, BAND_ROWS):
+            band_rows = min(BAND_ROWS, stop - band_start)
+            rng = self._band_rng(acquisition_date, band_start // BAND_ROWS, 0)
+            ndvi[band_start - start:band_start - start + band_rows] += rng.normal(
+                0, 0.03, (band_rows, self.shape[1])).astype(np.float32)
+
+        # Tracks between parcels are bare soil
+        ndvi[row_index % self.parcel_size == 0, :] = 0.05
+        ndvi[:, col_index % self.parcel_size == 0] = 0.05
+        return np.clip(ndvi, -0.2, 0.9, out=ndvi)
+
+    def cloud_coverage(self, acquisition_date):
+        """Cloud coverage (0-1) of one date, drawn around the month's climatological mean"""
+        mean = MONTHLY_CLOUD_COVERAGE[acquisition_date.month - 1]
+        rng = np.random.default_rng([self.seed, acquisition_date.toordinal()])
+        return float(min(rng.beta(12 * mean, 12 * (1 - mean)), 0.95))
+
+    def _band_clusters(self, acquisition_date, band, cloud_coverage, cloud_size):
+        """Cloud cluster centers, radii and stamping generator of one band of rows"""
+        rng = self._band_rng(acquisition_date, band, 1)
+        band_start = band * BAND_ROWS
+        band_rows = min(BAND_ROWS, self.shape[0] - band_start)
+        count = rng.poisson(band_rows * self.shape[1] * cloud_coverage / (cloud_size * cloud_size))
+        centers_y = band_start + rng.integers(0, band_rows, count)
+        centers_x = rng.integers(0, self.shape[1], count)
+        radii = rng.integers(cloud_size // 2, cloud_size, count)
+        return centers_y, centers_x, radii, rng
+
+    def cloud_mask(self, rows, acquisition_date, cloud_coverage, cloud_size=10):
+        """
+        Cloud mask (1 = cloud) of a range of rows on one date.
+
+        Clusters are drawn per band of rows, and every band whose clusters can
+        reach the range is stamped, so clouds continue across chunk edges.
+        """
+        start, stop = rows.start, min(rows.stop, self.shape[0])
+        mask = np.zeros((stop - start, self.shape[1]), dtype=np.uint8)
+        if cloud_coverage <= 0:
+            return mask
+        first_band = max(0, (start - cloud_size) // BAND_ROWS)
+        last_band = min(-(-self.shape[0] // BAND_ROWS) - 1, (stop + cloud_size) // BAND_ROWS)
+        for band in range(first_band, last_band + 1):
+            centers_y, centers_x, radii, rng = self._band_clusters(acquisition_date, band, cloud_coverage, cloud_size)
+            if len(radii):
+                stamp_cloud_clusters(mask, centers_y, centers_x, radii, rng, row_offset=start)
+        return mask
+
+    def row_reader(self, acquisition_date, cloud_coverage=None, cloud_size=10):
+        """
+        Function of a row slice returning (NDVI, cloud mask) of those rows on one date.
+
+        Clouds are not burnt into the NDVI; row slices must start at a multiple
+        of BAND_ROWS. cloud_coverage None draws it from the climatology.
+        """
+        if cloud_coverage is None:
+            cloud_coverage = self.cloud_coverage(acquisition_date)
+
+        def read(rows):
+            return (self.ndvi(rows, acquisition_date),
+                    self.cloud_mask(rows, acquisition_date, cloud_coverage, cloud_size))
+
+        return read
+
+    def write(self, directory, acquisition_date, cloud_coverage=None, cloud_size=10, chunk_bytes=CHUNK_BYTES):
+        """
+        Write one acquisition as B04.npy, B08.npy, QA60.npy and manifest.json.
+
+        Args:
+            directory: Output directory, created if needed
+            acquisition_date: datetime.date
+            cloud_coverage: Cloud coverage (0-1); None draws it from the climatology
+            cloud_size: Approximate cloud cluster size in pixels
+            chunk_bytes: Memory budget of one chunk
+
+        Returns:
+            Path of the manifest
+        """
+        if cloud_coverage is None:
+            cloud_coverage = self.cloud_coverage(acquisition_date)
+        os.makedirs(directory, exist_ok=True)
+        bands = {name: _create_band(os.path.join(directory, f"{name}.npy"), self.shape)
+                 for name in ("B04", "B08", "QA60")}
+
+        cloudy_pixels = 0
+        rows_per_chunk = self.chunk_rows(chunk_bytes)
+        for start in range(0, self.shape[0], rows_per_chunk):
+            window = slice(start, min(start + rows_per_chunk, self.shape[0]))
+            ndvi = self.ndvi(window, acquisition_date)
+            cloudy = self.cloud_mask(window, acquisition_date, cloud_coverage, cloud_size).astype(bool)
+            cloudy_pixels += int(np.count_nonzero(cloudy))
+
+            # Split a fixed brightness between the bands so (NIR - red) / (NIR + red) is the NDVI
+            brightness = np.where(cloudy, CLOUD_REFLECTANCE, SURFACE_BRIGHTNESS).astype(np.float32)
+            ndvi[cloudy] = 0.0
+            scale = brightness * (REFLECTANCE_SCALE / 2)
+            _write_rows(*bands["B04"], window, np.rint(scale * (1 - ndvi)))
+            _write_rows(*bands["B08"], window, np.rint(scale * (1 + ndvi)))
+            _write_rows(*bands["QA60"], window, np.where(cloudy, QA60_OPAQUE_CLOUD, 0))
+
+        manifest = {
+            "format": "npy",
+            "red": "B04.npy",
+            "nir": "B08.npy",
+            "qa60": "QA60.npy",
+            "bounds": self.bounds,
+            "date": acquisition_date.isoformat(),
+            "cloud_coverage": cloudy_pixels / (self.shape[0] * self.shape[1]),
+        }
+        manifest_path = os.path.join(directory, "manifest.json")
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        return manifest_path
+
+    def write_fields(self, path):
+        """
+        Write the parcels as a GeoJSON FeatureCollection with their crop, one feature per line.
+
+        Returns:
+            Number of fields written
+        """
+        min_lon, _, max_lon, max_lat = self.bounds
+        pixel_lon = (max_lon - min_lon) / self.shape[1]
+        pixel_lat = (max_lat - self.bounds[1]) / self.shape[0]
+        grid_rows, grid_cols = self.parcel_crops.shape
+        with open(path, "w", encoding="utf-8") as f:
+            f.write('{"type": "FeatureCollection", "features": [\n')
+            for parcel_row in range(grid_rows):
+                top = max_lat - parcel_row * self.parcel_size * pixel_lat
+                bottom = max_lat - min((parcel_row + 1) * self.parcel_size, self.shape[0]) * pixel_lat
+                lines = []
+                for parcel_col in range(grid_cols):
+                    left = min_lon + parcel_col * self.parcel_size * pixel_lon
+                    right = min_lon + min((parcel_col + 1) * self.parcel_size, self.shape[1]) * pixel_lon
+                    ring = [[left, bottom], [right, bottom], [right, top], [left, top], [left, bottom]]
+                    lines.append(json.dumps({
+                        "type": "Feature",
+                        "geometry": {"type": "Polygon", "coordinates": [ring]},
+                        "properties": {"name": f"Parcel {parcel_row}-{parcel_col}",
+                                       "crop": self.crops[self.parcel_crops[parcel_row, parcel_col]]},
+                    }))
+                separator = ",\n" if parcel_row < grid_rows - 1 else "\n"
+                f.write(",\n".join(lines) + separator)
+            f.write("]}\n")
+        return grid_rows * grid_cols
+
+
+def _create_band(path, shape, dtype=np.uint16):
+    """Create an empty .npy band and return (path, data offset, shape, dtype) for _write_rows()"""
+    band = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+    offset = band.offset
+    del band
+    return path, offset, shape, np.dtype(dtype)
+
+
+def _write_rows(path, offset, shape, dtype, rows, values):
+    """Write a block of rows through a memmap of just those rows, so only one chunk is ever mapped"""
+    window = np.memmap(path, dtype=dtype, mode="r+", offset=offset + rows.start * shape[1] * dtype.itemsize,
+                       shape=(rows.stop - rows.start, shape[1]))
+    window[:] = values
+    window.flush()
+    del window
+
+
+def generate_scene_series(directory, shape, dates, seed=0, center=None, cloud_coverage=None, cloud_size=10,
+                          parcel_size=PARCEL_SIZE, chunk_bytes=CHUNK_BYTES, fields=True):
+    """
+    Write one synthetic acquisition per date into directory/<date>/.
+
+    Args:
+        directory: Output directory
+        shape: Tuple (height, width) in pixels
+        dates: datetime.date acquisitions
+        seed: Int seed
+        center: {"lat", "lon"} of the scene center
+        cloud_coverage: Fixed cloud coverage (0-1); None draws each date's from the climatology
+        cloud_size: Approximate cloud cluster size in pixels
+        parcel_size: Parcel edge length in pixels
+        chunk_bytes: Memory budget of one chunk
+        fields: Whether to also write the parcels to directory/fields.geojson
+
+    Returns:
+        List of manifest paths, one per date
+    """
+    scene = SyntheticScene(shape, seed, center, parcel_size)
+    if fields:
+        os.makedirs(directory, exist_ok=True)
+        scene.write_fields(os.path.join(directory, "fields.geojson"))
+    return [scene.write(os.path.join(directory, acquisition_date.isoformat()), acquisition_date,
+                        cloud_coverage, cloud_size, chunk_bytes)
+            for acquisition_date in dates]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate reproducible synthetic Sentinel-2 scenes for load testing")
+    parser.add_argument("directory", help="Output directory; each date is written to <directory>/<date>/")
+    parser.add_argument("--size", type=int, nargs="+", default=[10000],
+                        help="Scene size in pixels: one value for a square scene, or height and width")
+    parser.add_argument("--dates", type=date.fromisoformat, nargs="+", default=[date(2024, 7, 15)],
+                        help="Acquisition dates (YYYY-MM-DD)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--lat", type=float, help="Scene center latitude (default: center of India)")
+    parser.add_argument("--lon", type=float, help="Scene center longitude")
+    parser.add_argument("--cloud-coverage", type=float, help="Fixed cloud coverage (0-1) instead of the monthly climatology")
+    parser.add_argument("--cloud-size", type=int, default=10, help="Cloud cluster size in pixels")
+    parser.add_argument("--parcel-size", type=int, default=PARCEL_SIZE, help="Parcel edge length in pixels")
+    parser.add_argument("--chunk-mb", type=int, default=CHUNK_BYTES // 2**20, help="Memory budget of one chunk in MB")
+    parser.add_argument("--no-fields", action="store_true", help="Do not write the parcels as fields.geojson")
+    args = parser.parse_args(argv)
+
+    if len(args.size) not in (1, 2):
+        parser.error("--size takes one or two values")
+    shape = (args.size[0], args.size[-1])
+    center = None
+    if args.lat is not None or args.lon is not None:
+        default = LOCATION_OPTIONS["Select a location"]
+        center = {"lat": args.lat if args.lat is not None else default["lat"],
+                  "lon": args.lon if args.lon is not None else default["lon"]}
+
+    manifests = generate_scene_series(args.directory, shape, args.dates, args.seed, center, args.cloud_coverage,
+                                      args.cloud_size, args.parcel_size, args.chunk_mb * 2**20, not args.no_fields)
+    for manifest_path in manifests:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        print(f"{manifest['date']}  {shape[0]}x{shape[1]}  clouds {manifest['cloud_coverage']:6.1%}  {manifest_path}")
+
+
+if __name__ == "__main__":
+    main()
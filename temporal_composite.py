@@ -0,0 +1,304 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import warnings
+import zlib
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+try:
+    import fcntl
+except ImportError:  # Windows: stacks are then only locked between the threads of one process
+    fcntl = None
+
+import numpy as np
+
+from crop_analysis import simulate_ndvi, simulate_qa60_cloud_mask
+
+# Sentinel-2 revisit period with both satellites
+REVISIT_DAYS = 5
+
+COMPOSITE_METHODS = ["Median", "Max NDVI", "Latest Clear"]
+
+# Memory budget for one chunk of a chunked reduction over the stack
+CHUNK_BYTES = 64 * 1024 * 1024
+
+# One lock per stack directory for the threads of this process; fcntl covers other processes
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+def acquisition_dates(start_date, end_date, revisit_days=REVISIT_DAYS):
+    """Acquisition dates from start_date to end_date (inclusive) at the revisit interval"""
+    dates = []
+    current = start_date
+    while current <= end_date:
+        dates.append(current)
+        current += timedelta(days=revisit_days)
+    return dates
+
+
+def location_seed(center):
+    """Stable seed for the simulated field at a location"""
+    return zlib.crc32(f"{center['lat']:.4f},{center['lon']:.4f}".encode())
+
+
+def stack_directory(**key):
+    """Directory for the scene stack identified by the given keyword parameters"""
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), "crop_health_stacks", digest)
+
+
+@contextmanager
+def directory_lock(directory):
+    """Exclusive lock on a stack directory, held against other threads and processes"""
+    with _thread_locks_guard:
+        thread_lock = _thread_locks.setdefault(os.path.abspath(directory), threading.Lock())
+    with thread_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(directory, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _write_atomic(path, write):
+    """Write a file under a temporary name in its directory and rename it into place, so readers never see it partly written"""
+    fd, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+def simulate_scene_for_date(shape, acquisition_date, location_seed=0, cloud_coverage=0.2, cloud_size=10):
+    """
+    Simulate one acquisition of a fixed area.
+
+    The underlying field is the same for every date (seeded by location_seed);
+    each date adds its own sensor noise and its own clouds, so repeated calls
+    for the same date return the same scene.
+
+    Returns:
+        Tuple of (NDVI array, cloud mask)
+    """
+    date_rng = np.random.default_rng([location_seed, acquisition_date.toordinal()])
+    ndvi = simulate_ndvi(shape, location_seed)
+    ndvi = np.clip(ndvi + date_rng.normal(0, 0.03, shape), -0.2, 0.9)
+    cloud_mask = simulate_qa60_cloud_mask(shape, cloud_coverage, cloud_size, date_rng)
+    return ndvi, cloud_mask
+
+
+class SceneStack:
+    """
+    Disk-backed stack of cloud-masked NDVI scenes of one area, one .npy per date.
+
+    The max-NDVI and latest-clear composites are kept on disk and updated
+    incrementally as each scene is added; the median is recomputed with
+    chunked reductions when it is requested after the stack changed.
+
+    Several jobs may share a stack directory: adding scenes and reading
+    composites hold the directory lock, reload the index first, and the
+    index and the cached median are replaced atomically.
+    """
+
+    def __init__(self, directory, shape=None):
+        """
+        Args:
+            directory: Stack directory, created if needed
+            shape: Expected (height, width) of the scenes; None takes it from
+                the stack on disk or from the first scene added
+        """
+        self.directory = directory
+        self.shape = None if shape is None else tuple(shape)
+        self.dates = []
+        self.median_dirty = True
+        os.makedirs(directory, exist_ok=True)
+        with directory_lock(directory):
+            self._load_index()
+
+    def _path(self, name):
+        return os.path.join(self.directory, f"{name}.npy")
+
+    def _load_index(self):
+        """Refresh the dates from the index on disk; False while the stack has no scenes"""
+        index_path = os.path.join(self.directory, "index.json")
+        if not os.path.exists(index_path):
+            return False
+        with open(index_path, encoding="utf-8") as f:
+            index = json.load(f)
+        if self.shape is not None and tuple(index["shape"]) != self.shape:
+            raise ValueError(f"Stack in {self.directory} has shape {index['shape']}, not {self.shape}")
+        self.shape = tuple(index["shape"])
+        self.dates = [date.fromisoformat(d) for d in index["dates"]]
+        self.median_dirty = index["median_dirty"]
+        return True
+
+    def _create_composite(self, name, dtype, fill_value):
+        composite = np.lib.format.open_memmap(self._path(name), mode="w+", dtype=dtype, shape=self.shape)
+        composite[:] = fill_value
+        composite.flush()
+
+    def _save_index(self):
+        index = {
+            "shape": list(self.shape),
+            "dates": [d.isoformat() for d in self.dates],
+            "median_dirty": self.median_dirty,
+        }
+        _write_atomic(os.path.join(self.directory, "index.json"), lambda f: f.write(json.dumps(index).encode()))
+
+    def _chunk_rows(self, layers):
+        """Rows per chunk so that `layers` float32 rows fit the chunk budget"""
+        return max(1, CHUNK_BYTES // (4 * self.shape[1] * max(layers, 1)))
+
+    def scene(self, acquisition_date):
+        """Memory-mapped masked NDVI of one date (NaN = cloud)"""
+        return np.load(self._path(acquisition_date.isoformat()), mmap_mode="r")
+
+    def add_scene(self, acquisition_date, ndvi, cloud_mask):
+        """
+        Add one acquisition and update the incremental composites.
+
+        Args:
+            acquisition_date: datetime.date of the scene
+            ndvi: NDVI array of the stack shape (the first scene sets it)
+            cloud_mask: Binary mask (1 = cloud, 0 = clear)
+        """
+        with directory_lock(self.directory):
+            if not self._load_index():
+                # First scene: it fixes the shape of the stack and its incremental composites
+                self.shape = self.shape or tuple(np.shape(ndvi))
+                self._create_composite("max_ndvi", np.float32, np.nan)
+                self._create_composite("latest_clear", np.float32, np.nan)
+                self._create_composite("latest_day", np.int32, -1)
+                self._save_index()
+            if tuple(np.shape(ndvi)) != self.shape:
+                raise ValueError(f"Scene of shape {np.shape(ndvi)} does not fit the stack shape {self.shape}")
+            if acquisition_date not in self.dates:
+                self._add_scene(acquisition_date, ndvi, cloud_mask)
+
+    def _add_scene(self, acquisition_date, ndvi, cloud_mask):
+        scene = np.lib.format.open_memmap(self._path(acquisition_date.isoformat()), mode="w+",
+                                          dtype=np.float32, shape=self.shape)
+        max_ndvi = np.load(self._path("max_ndvi"), mmap_mode="r+")
+        latest_clear = np.load(self._path("latest_clear"), mmap_mode="r+")
+        latest_day = np.load(self._path("latest_day"), mmap_mode="r+")
+        day = acquisition_date.toordinal()
+
+        rows = self._chunk_rows(4)
+        for start in range(0, self.shape[0], rows):
+            window = slice(start, start + rows)
+            chunk = np.where(cloud_mask[window] == 1, np.nan, ndvi[window]).astype(np.float32)
+            scene[window] = chunk
+
+            # fmax ignores NaN, so clouds never replace a clear value
+            np.fmax(max_ndvi[window], chunk, out=max_ndvi[window])
+
+            # Scenes may arrive out of order; only newer clear pixels win
+            newer = ~np.isnan(chunk) & (latest_day[window] <= day)
+            latest_clear[window][newer] = chunk[newer]
+            latest_day[window][newer] = day
+
+        for array in (scene, max_ndvi, latest_clear, latest_day):
+            array.flush()
+
+        self.dates = sorted(self.dates + [acquisition_date])
+        self.median_dirty = True
+        self._save_index()
+
+    def _reduce(self, dates, reduce_chunk):
+        """Apply reduce_chunk to (dates, rows, width) chunks of the stack"""
+        result = np.full(self.shape, np.nan, dtype=np.float32)
+        if not dates:
+            return result
+        scenes = [self.scene(d) for d in dates]
+        rows = self._chunk_rows(len(scenes) + 1)
+        for start in range(0, self.shape[0], rows):
+            window = slice(start, start + rows)
+            chunk = np.stack([scene[window] for scene in scenes])
+            result[window] = reduce_chunk(chunk)
+        return result
+
+    def composite(self, method, dates=None):
+        """
+        Per-pixel cloud-free composite.
+
+        Args:
+            method: One of COMPOSITE_METHODS
+            dates: Optional subset of stack dates; None uses every date, which
+                lets the incremental composites be returned directly
+
+        Returns:
+            float32 NDVI composite (NaN where no date was clear)
+        """
+        with directory_lock(self.directory):
+            if not self._load_index():
+                raise ValueError(f"Stack in {self.directory} has no scenes")
+            return self._composite(method, dates)
+
+    def _composite(self, method, dates):
+        if method not in COMPOSITE_METHODS:
+            raise ValueError(f"Unknown composite method: {method}")
+        dates = sorted(d for d in (self.dates if dates is None else dates) if d in self.dates)
+        incremental = dates == self.dates
+
+        if method == "Max NDVI":
+            if incremental:
+                return np.array(np.load(self._path("max_ndvi"), mmap_mode="r"))
+            return self._reduce(dates, lambda chunk: np.fmax.reduce(chunk, axis=0))
+
+        if method == "Latest Clear":
+            if incremental:
+                return np.array(np.load(self._path("latest_clear"), mmap_mode="r"))
+
+            def latest(chunk):
+                clear = ~np.isnan(chunk)
+                # Index of the last clear date per pixel
+                last = chunk.shape[0] - 1 - np.argmax(clear[::-1], axis=0)
+                values = np.take_along_axis(chunk, last[None], axis=0)[0]
+                return np.where(clear.any(axis=0), values, np.nan)
+            return self._reduce(dates, latest)
+
+        # Median cannot be updated incrementally; cache it until the stack changes
+        if incremental and not self.median_dirty:
+            return np.array(np.load(self._path("median"), mmap_mode="r"))
+
+        with warnings.catch_warnings():
+            # All-NaN pixels (never clear) are expected and stay NaN
+            warnings.simplefilter("ignore", RuntimeWarning)
+            median = self._reduce(dates, lambda chunk: np.nanmedian(chunk, axis=0))
+        if incremental:
+            _write_atomic(self._path("median"), lambda f: np.save(f, median))
+            self.median_dirty = False
+            self._save_index()
+        return median
+
+
+def collect_scenes(stack, dates, load_scene):
+    """
+    Add every acquisition in dates that is not yet in the stack.
+
+    Args:
+        stack: SceneStack
+        dates: Acquisition dates to cover
+        load_scene: Callable taking a date and returning (ndvi, cloud_mask)
+
+    Returns:
+        Number of newly added scenes
+    """
+    added = 0
+    for acquisition_date in dates:
+        if acquisition_date not in stack.dates:
+            ndvi, cloud_mask = load_scene(acquisition_date)
+            stack.add_scene(acquisition_date, ndvi, cloud_mask)
+            added += 1
+    return added
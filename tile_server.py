@@ -0,0 +1,264 @@
+"""
+XYZ tile service for analysis results.
+
+Result rasters (colorized NDVI, classification) are registered as palette
+index arrays with their geographic bounds. Each gets an overview pyramid, and
+256x256 PNG tiles are cut from the pyramid level matching the requested zoom,
+so the map only downloads the tiles in view at a resolution it can show.
+"""
+import hashlib
+import ipaddress
+import math
+import os
+import re
+import socket
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from ndvi_rendering import image_to_png_bytes, paletted_image
+
+TILE_SIZE = 256
+
+# Rendered PNG tiles kept in memory across all layers
+TILE_CACHE_SIZE = 1024
+
+# Result layers kept for serving; older analyses are dropped first
+MAX_LAYERS = 16
+
+# Compression is cheap to skip for small paletted tiles
+TILE_COMPRESS_LEVEL = 1
+
+# Interface and port the tile server binds; port 0 picks a free one
+TILE_HOST = os.environ.get("CROP_HEALTH_TILE_HOST", "127.0.0.1")
+TILE_PORT = int(os.environ.get("CROP_HEALTH_TILE_PORT", 0))
+
+# Base URL the browser uses for tiles when it cannot reach the bind address directly
+TILE_PUBLIC_URL = os.environ.get("CROP_HEALTH_TILE_URL")
+
+_TILE_PATH = re.compile(r"^/tiles/(?P<layer>[0-9a-f]+)/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.png$")
+
+
+def tile_pixel_lonlat(z, x, y, tile_size=TILE_SIZE):
+    """
+    Longitudes of the pixel column centers and latitudes of the pixel row
+    centers of a Web Mercator XYZ tile.
+    """
+    n = 2 ** z
+    offsets = (np.arange(tile_size) + 0.5) / tile_size
+    lons = (x + offsets) / n * 360.0 - 180.0
+    lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + offsets) / n))))
+    return lons, lats
+
+
+def build_pyramid(indices, min_size=TILE_SIZE):
+    """
+    Overview pyramid of a palette index raster.
+
+    Each level halves the previous one by nearest-neighbour decimation, which
+    keeps palette indices (and class indices) exact.
+
+    Returns:
+        List of arrays, full resolution first
+    """
+    levels = [np.ascontiguousarray(indices)]
+    while min(levels[-1].shape) > min_size:
+        levels.append(np.ascontiguousarray(levels[-1][::2, ::2]))
+    return levels
+
+
+class RasterLayer:
+    """Georeferenced palette raster with its overview pyramid"""
+
+    def __init__(self, indices, palette, bounds, transparent_index=None):
+        """
+        Args:
+            indices: 2D uint8 palette index array (north-up)
+            palette: (N, 3) uint8 RGB palette
+            bounds: (min_lon, min_lat, max_lon, max_lat) covered by the raster
+            transparent_index: Palette index drawn transparent (e.g. no-data)
+        """
+        self.levels = build_pyramid(indices)
+        self.palette = palette
+        self.bounds = tuple(float(b) for b in bounds)
+        self.transparent_index = transparent_index
+
+    def _level_for_zoom(self, z):
+        """Coarsest pyramid level that still has at least one source pixel per tile pixel"""
+        min_lon, _, max_lon, _ = self.bounds
+        source_pixel = (max_lon - min_lon) / self.levels[0].shape[1]
+        tile_pixel = 360.0 / (TILE_SIZE * 2 ** z)
+        level = int(math.floor(math.log2(max(tile_pixel / source_pixel, 1.0))))
+        return min(level, len(self.levels) - 1)
+
+    def render_tile(self, z, x, y):
+        """
+        Palette indices of one tile by nearest-neighbour sampling.
+
+        Returns:
+            (TILE_SIZE, TILE_SIZE) uint8 array, or None if the tile misses the raster
+        """
+        min_lon, min_lat, max_lon, max_lat = self.bounds
+        lons, lats = tile_pixel_lonlat(z, x, y)
+        if lons[-1] < min_lon or lons[0] > max_lon or lats[0] < min_lat or lats[-1] > max_lat:
+            return None
+
+        level = self.levels[self._level_for_zoom(z)]
+        height, width = level.shape
+        cols = np.floor((lons - min_lon) / (max_lon - min_lon) * width).astype(np.int64)
+        rows = np.floor((max_lat - lats) / (max_lat - min_lat) * height).astype(np.int64)
+        col_inside = (cols >= 0) & (cols < width)
+        row_inside = (rows >= 0) & (rows < height)
+
+        tile = level[np.ix_(np.clip(rows, 0, height - 1), np.clip(cols, 0, width - 1))]
+        fill = 0 if self.transparent_index is None else self.transparent_index
+        tile[~row_inside, :] = fill
+        tile[:, ~col_inside] = fill
+        return tile
+
+
+class TileServer:
+    """
+    Serves result rasters as 256x256 XYZ PNG tiles from a background thread.
+
+    Tiles are rendered on request from the layer's overview pyramid and kept
+    in an LRU cache, so panning back over the same area costs nothing.
+    """
+
+    def __init__(self, host=TILE_HOST, port=TILE_PORT, public_url=TILE_PUBLIC_URL):
+        """
+        Args:
+            host: Interface to bind
+            port: Port to bind, 0 picks a free one
+            public_url: Base URL the browser uses to reach the server, if it
+                differs from http://host:port (e.g. behind a reverse proxy)
+        """
+        self.host = host
+        self.port = port
+        self.public_url = public_url
+        self.layers = OrderedDict()
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+        self._empty_tiles = {}
+        self._httpd = None
+
+    def start(self):
+        """Start serving in a daemon thread and return self"""
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                match = _TILE_PATH.match(self.path.split("?")[0])
+                png = None
+                if match:
+                    png = server.tile_png(match["layer"], int(match["z"]), int(match["x"]), int(match["y"]))
+                if png is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(png)))
+                self.send_header("Cache-Control", "public, max-age=3600")
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                self.wfile.write(png)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._httpd.daemon_threads = True
+        self.port = self._httpd.server_address[1]
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def add_layer(self, indices, palette, bounds, transparent_index=None):
+        """
+        Register a raster for serving.
+
+        Returns:
+            Layer id, stable for identical rasters so reruns reuse cached tiles
+        """
+        digest = hashlib.sha1(np.ascontiguousarray(indices).tobytes())
+        digest.update(np.asarray(palette, dtype=np.uint8).tobytes())
+        digest.update(repr((tuple(bounds), indices.shape, transparent_index)).encode())
+        layer_id = digest.hexdigest()[:16]
+        with self._lock:
+            if layer_id in self.layers:
+                self.layers.move_to_end(layer_id)
+            else:
+                self.layers[layer_id] = RasterLayer(indices, palette, bounds, transparent_index)
+                while len(self.layers) > MAX_LAYERS:
+                    dropped, _ = self.layers.popitem(last=False)
+                    for key in [key for key in self._tiles if key[0] == dropped]:
+                        del self._tiles[key]
+        return layer_id
+
+    def _bind_address(self):
+        """Bound host as an IP address, or None for a host name"""
+        try:
+            return ipaddress.ip_address(self.host)
+        except ValueError:
+            return None
+
+    def local_only(self):
+        """Whether the tile URLs only work in a browser on the machine running the server"""
+        if self.public_url:
+            return False
+        address = self._bind_address()
+        return self.host == "localhost" if address is None else address.is_loopback
+
+    def tile_url(self, layer_id):
+        """Leaflet URL template of a layer"""
+        host = self.host
+        address = self._bind_address()
+        if address is not None and address.is_unspecified:
+            # Bound to every interface; browsers cannot use the wildcard address itself
+            host = socket.getfqdn()
+        elif address is not None and address.version == 6:
+            host = f"[{host}]"
+        base = self.public_url or f"http://{host}:{self.port}"
+        return f"{base.rstrip('/')}/tiles/{layer_id}/{{z}}/{{x}}/{{y}}.png"
+
+    def tile_png(self, layer_id, z, x, y):
+        """PNG bytes of a tile (cached), or None for an unknown layer"""
+        key = (layer_id, z, x, y)
+        with self._lock:
+            if key in self._tiles:
+                self._tiles.move_to_end(key)
+                return self._tiles[key]
+            layer = self.layers.get(layer_id)
+        if layer is None:
+            return None
+
+        tile = layer.render_tile(z, x, y)
+        if tile is None:
+            png = self._empty_tile(layer)
+        else:
+            image = paletted_image(tile, layer.palette)
+            if layer.transparent_index is not None:
+                image.info["transparency"] = layer.transparent_index
+            png = image_to_png_bytes(image, compress_level=TILE_COMPRESS_LEVEL)
+
+        with self._lock:
+            self._tiles[key] = png
+            while len(self._tiles) > TILE_CACHE_SIZE:
+                self._tiles.popitem(last=False)
+        return png
+
+    def _empty_tile(self, layer):
+        """Fully transparent tile shared by every tile outside a layer"""
+        fill = 0 if layer.transparent_index is None else layer.transparent_index
+        if fill not in self._empty_tiles:
+            image = paletted_image(np.full((TILE_SIZE, TILE_SIZE), fill, dtype=np.uint8), layer.palette)
+            image.info["transparency"] = fill
+            self._empty_tiles[fill] = image_to_png_bytes(image)
+        return self._empty_tiles[fill]
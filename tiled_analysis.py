@@ -0,0 +1,114 @@
+import numpy as np
+
+from crop_analysis import NDVI_CLASS_LUT, build_analysis_result
+from gap_filling import DEFAULT_GAP_FILL_METHOD, INTERPOLATION_KERNEL_SIZE
+from ndvi_statistics import NDVIStatistics
+from scene import Scene
+
+# Gap filling methods that only read a fixed neighbourhood, with the halo in pixels they need.
+# The pyramid and nearest-valid fills can reach arbitrarily far and need the whole scene.
+TILE_LOCAL_GAP_FILL_METHODS = {"Kernel Mean (5x5)": INTERPOLATION_KERNEL_SIZE // 2}
+
+# Default tile edge length in pixels
+DEFAULT_TILE_SIZE = 1024
+
+
+def iter_tiles(shape, tile_size=DEFAULT_TILE_SIZE, overlap=0):
+    """
+    Generate tile windows covering an image.
+
+    Args:
+        shape: Tuple, shape of the image (height, width)
+        tile_size: Int, edge length of the core tiles
+        overlap: Int, halo width read around each tile (clipped at the image edges)
+
+    Yields:
+        Tuple of (core, halo, core_in_halo) where core and halo are
+        (row_slice, col_slice) windows into the image and core_in_halo
+        selects the core from an array read with the halo window
+    """
+    height, width = shape
+    for row in range(0, height, tile_size):
+        for col in range(0, width, tile_size):
+            row_end = min(row + tile_size, height)
+            col_end = min(col + tile_size, width)
+            halo_row = max(row - overlap, 0)
+            halo_col = max(col - overlap, 0)
+            halo_row_end = min(row_end + overlap, height)
+            halo_col_end = min(col_end + overlap, width)
+            yield (
+                (slice(row, row_end), slice(col, col_end)),
+                (slice(halo_row, halo_row_end), slice(halo_col, halo_col_end)),
+                (slice(row - halo_row, row_end - halo_row), slice(col - halo_col, col_end - halo_col)),
+            )
+
+
+def accumulate_tiles(ndvi, cloud_mask=None, cloud_handling=None, tile_size=DEFAULT_TILE_SIZE,
+                     gap_fill_method=DEFAULT_GAP_FILL_METHOD):
+    """
+    Run cloud handling, classification and statistics tile by tile.
+
+    Only one tile (plus its halo) is held in memory at a time, so ndvi and
+    cloud_mask can be memory-mapped arrays larger than RAM.
+
+    Args:
+        ndvi: 2D NDVI array or array-like supporting slicing (e.g. np.memmap)
+        cloud_mask: Matching binary cloud mask, or None to disable cloud masking
+        cloud_handling: One of CLOUD_HANDLING_METHODS (ignored without a cloud mask)
+        tile_size: Int, edge length of the tiles
+        gap_fill_method: Gap filling method for "Interpolate"; must be one of
+            TILE_LOCAL_GAP_FILL_METHODS, since tiles cannot reproduce the others
+
+    Returns:
+        NDVIStatistics
+
+    Raises:
+        ValueError: For "Interpolate" with a gap filling method that is not tile-local
+    """
+    if cloud_mask is None:
+        cloud_handling = None
+    # Interpolation reads neighbours, so tiles need a halo as wide as the fill reaches
+    overlap = 0
+    if cloud_handling == "Interpolate":
+        if gap_fill_method not in TILE_LOCAL_GAP_FILL_METHODS:
+            raise ValueError(f"{gap_fill_method} gap filling needs the whole scene; tiled analysis supports "
+                             + ", ".join(TILE_LOCAL_GAP_FILL_METHODS))
+        overlap = TILE_LOCAL_GAP_FILL_METHODS[gap_fill_method]
+
+    stats = NDVIStatistics(NDVI_CLASS_LUT)
+    for core, halo, core_in_halo in iter_tiles(ndvi.shape, tile_size, overlap):
+        cloud_halo = None if cloud_handling is None else np.asarray(cloud_mask[halo])
+        scene = Scene(ndvi[halo], cloud_halo)
+
+        masked_tile = scene.data(cloud_handling, gap_fill_method)[core_in_halo]
+        valid_tile = scene.valid_mask(cloud_handling, gap_fill_method)[core_in_halo]
+        class_tile = scene.class_index(NDVI_CLASS_LUT, cloud_handling, gap_fill_method)[core_in_halo]
+        cloud_tile = None if cloud_halo is None else cloud_halo[core_in_halo]
+        stats.update(masked_tile, valid_tile, class_tile, cloud_tile)
+
+    return stats
+
+
+def analyze_tiled(ndvi, cloud_mask=None, cloud_handling=None, tile_size=DEFAULT_TILE_SIZE,
+                  location_name="", center=None, gap_fill_method=DEFAULT_GAP_FILL_METHOD):
+    """
+    Streaming counterpart of crop_analysis.analyze_area() for scenes that do not fit in memory.
+
+    Class counts, cloud percentage, health score and insights are identical to
+    the in-memory path run with the same gap_fill_method; the mean and std NDVI
+    can differ only by floating point rounding. "Interpolate" is only
+    supported with TILE_LOCAL_GAP_FILL_METHODS (see accumulate_tiles()).
+
+    Returns:
+        AnalysisResult without array fields
+    """
+    stats = accumulate_tiles(ndvi, cloud_mask, cloud_handling, tile_size, gap_fill_method)
+    return build_analysis_result(
+        location_name,
+        center,
+        cloud_handling if cloud_mask is not None else None,
+        stats.cloud_percentage() if cloud_mask is not None else None,
+        stats.class_counts_by_label(),
+        stats.ndvi_stats(),
+        ndvi_histogram=stats.histogram(),
+    )